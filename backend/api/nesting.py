@@ -4,16 +4,197 @@
 API для раскроя деталей
 """
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
 import logging
+import os
+import threading
+import uuid
+from typing import Dict, List, Optional
 
-from utils.rectpack_optimizer import optimize_nesting
+from utils.rectpack_optimizer import ALGORITHMS, optimize_nesting
+from utils.shape_nesting import optimize_shape_nesting
+from utils.common_line import optimize_common_line
+from utils.part_in_part import optimize_part_in_part
+from utils.remnant_objective import consolidate_remnants
 from utils.waste_calculator import calculate_wastes
+from utils.cut_sequence import optimize_cut_sequence
+from utils.batch_nesting import nest_orders
+from utils.nesting_cache import NestingCache, make_cache_key
+from utils.nfp_cache import NfpCache
+from utils.online_nesting import OnlineConfigConflict, OnlineNester, sheets_result
+from utils.nesting_jobs import NestingJobManager, JobQueueFull, STATUS_DONE, STATUS_FAILED
+from utils.progress import make_progress_callback
+from utils.result_format import check_format, encode_result
+from utils.sheet_preview import result_hash, sheet_preview
 
 logger = logging.getLogger(__name__)
 
 nesting_bp = Blueprint('nesting', __name__)
 
+# Кэш результатов: фронтенд повторно отправляет тот же запрос после перерисовки и экспорта
+result_cache = NestingCache(
+    max_entries=128,
+    ttl_seconds=3600,
+    disk_dir=os.environ.get('NESTING_CACHE_DIR')
+)
+
+# NFP пар деталей для раскроя по контуру - переживает перезапуск
+nfp_cache = NfpCache(os.environ.get('NFP_CACHE_DB', 'nfp_cache.db'))
+
+# Асинхронные задания: длинный раскрой не держит воркер Flask
+job_manager = NestingJobManager(max_workers=2, max_queue=8)
+
+# Потоковый раскрой очереди производства - открытые листы переживают перезапуск
+online_nester = OnlineNester(os.environ.get('ONLINE_NESTING_STATE', 'online_nesting.json'))
+
+
+def _nesting_params(data: Dict) -> Dict:
+    """Параметры optimize_nesting из тела запроса"""
+    return {
+        'sheet_width': data.get('sheet_width', 2500),
+        'sheet_height': data.get('sheet_height', 1250),
+        'allow_rotation': data.get('allow_rotation', True),
+        'cut_gap': 5.0,  # Зазор между деталями 5мм (отступы накладываются)
+        'edge_margin': 5.0  # Отступ от края листа 5мм со всех сторон
+    }
+
+
+def _nesting_options(data: Dict) -> Dict:
+    """
+    Режим раскроя из тела запроса
+
+    nesting_mode: 'rect' - по габаритам (по умолчанию), 'shape' - по контуру DXF,
+                  'common_line' - общий рез между одинаковыми деталями,
+                  'part_in_part' - мелкие детали в вырезах крупных
+    rotations: допустимые углы поворота для режима 'shape', градусы
+    cut_speed_mm_min, pierce_time_s: для расчета машинного времени в 'common_line'
+    min_hole_side: минимальная сторона выреза для вложения в 'part_in_part', мм
+    remnant_time_limit_s: время на сбор крупного остатка в 'rect', с (по умолчанию 0 -
+                          не выполняется: проход дороже самого раскроя и зависит от времени)
+    algorithm: алгоритм упаковки 'rect' (rectpack_optimizer.ALGORITHMS) или 'auto'
+    """
+    options = {'nesting_mode': data.get('nesting_mode') or 'rect'}
+    if options['nesting_mode'] not in ('rect', 'shape', 'common_line', 'part_in_part'):
+        raise ValueError(f"Unknown nesting_mode: {options['nesting_mode']}")
+    
+    if options['nesting_mode'] == 'shape' and data.get('rotations') is not None:
+        options['rotations'] = [float(a) for a in data['rotations']]
+    
+    if options['nesting_mode'] == 'common_line':
+        for key in ('cut_speed_mm_min', 'pierce_time_s'):
+            if data.get(key) is not None:
+                options[key] = float(data[key])
+    
+    if options['nesting_mode'] == 'part_in_part' and data.get('min_hole_side') is not None:
+        options['min_hole_side'] = float(data['min_hole_side'])
+    
+    if options['nesting_mode'] == 'rect':
+        limit = data.get('remnant_time_limit_s')
+        options['remnant_time_limit_s'] = 0.0 if limit is None else float(limit)
+        if data.get('algorithm') is not None:
+            if data['algorithm'] != 'auto' and data['algorithm'] not in ALGORITHMS:
+                raise ValueError(f"Unknown algorithm: {data['algorithm']}. Available: auto, {', '.join(ALGORITHMS)}")
+            options['algorithm'] = data['algorithm']
+    
+    return options
+
+
+def _result_format(data: Optional[Dict] = None, nesting_mode: str = 'rect') -> str:
+    """Формат ответа: ?format= или поле "format" тела запроса (см. utils.result_format)"""
+    fmt = request.args.get('format') or (data or {}).get('format') or 'json'
+    return check_format(fmt, nesting_mode)
+
+
+def _result_response(result: Dict, fmt: str, data: Optional[Dict] = None):
+    """
+    Ответ с результатом раскроя в формате fmt
+    
+    ?patterns=compact (или поле "patterns" тела запроса) - детали одинаковых
+    листов передаются один раз (см. utils.sheet_patterns)
+    """
+    compact = (request.args.get('patterns') or (data or {}).get('patterns')) == 'compact'
+    body, mimetype = encode_result(result, fmt, compact=compact)
+    if isinstance(body, bytes):
+        return Response(body, mimetype=mimetype)
+    return jsonify(body)
+
+
+def _calculate(parts: List[Dict], params: Dict,
+               cancel_event: Optional[threading.Event] = None,
+               progress_id: Optional[str] = None,
+               options: Optional[Dict] = None) -> Dict:
+    """
+    Раскрой + обрезки с кэшированием результата
+    
+    Общая часть синхронного /calculate и асинхронных заданий.
+    Возвращает результат optimize_nesting (при ошибке - success=False и error).
+    """
+    progress = make_progress_callback(progress_id)
+    options = options or {}
+    
+    cache_key = make_cache_key(parts, **params, **options)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"[NESTING API] Результат взят из кэша: {cache_key[:12]}")
+        if progress:
+            progress('done', {'success': True, 'cached': True,
+                              'utilization_percent': cached.get('utilization_percent')})
+        return cached
+    
+    logger.info("[NESTING API] Начинаю оптимизацию раскроя...")
+    
+    # Оптимизация раскроя
+    if options.get('nesting_mode') == 'shape':
+        result = optimize_shape_nesting(parts=parts, cancel_event=cancel_event,
+                                        progress_callback=progress,
+                                        rotations=options.get('rotations'),
+                                        nfp_cache=nfp_cache, **params)
+    elif options.get('nesting_mode') == 'common_line':
+        machine = {k: options[k] for k in ('cut_speed_mm_min', 'pierce_time_s') if k in options}
+        result = optimize_common_line(parts=parts, cancel_event=cancel_event,
+                                      progress_callback=progress, **machine, **params)
+    elif options.get('nesting_mode') == 'part_in_part':
+        extras = {k: options[k] for k in ('min_hole_side',) if k in options}
+        result = optimize_part_in_part(parts=parts, cancel_event=cancel_event,
+                                       progress_callback=progress, **extras, **params)
+    else:
+        result = optimize_nesting(parts=parts, cancel_event=cancel_event,
+                                  progress_callback=progress, algorithm=options.get('algorithm'), **params)
+        # Свободное место - в один крупный остаток при том же числе листов
+        consolidate_remnants(result, time_limit_s=options.get('remnant_time_limit_s', 0), **params)
+    
+    logger.info(f"[NESTING API] Результат оптимизации: success={result.get('success')}")
+    
+    if not result.get('success'):
+        logger.error(f"[ERROR] Ошибка оптимизации: {result.get('error', 'Unknown error')}")
+        if progress:
+            progress('done', {'success': False, 'error': result.get('error'),
+                              'cancelled': result.get('cancelled', False)})
+        return result
+    
+    logger.info("[NESTING API] Вычисляю обрезки...")
+    
+    # Вычисляем обрезки
+    wastes = calculate_wastes(result)
+    result['wastes'] = wastes
+    
+    # Порядок резки деталей (меньше холостых перемещений головы)
+    optimize_cut_sequence(result)
+    
+    logger.info(f"[OK] Раскрой рассчитан: {result['sheets_needed']} листов, "
+               f"{len(wastes)} обрезков, использование {result['utilization_percent']}%")
+    logger.info("=" * 50)
+    
+    # По result_id фронтенд запрашивает превью листов (/preview/<result_id>/<sheet_number>)
+    result['result_id'] = cache_key
+    result_cache.put(cache_key, result)
+    
+    if progress:
+        progress('done', {'success': True, 'sheets_needed': result['sheets_needed'],
+                          'utilization_percent': result['utilization_percent']})
+    
+    return result
+
 
 @nesting_bp.route('/calculate', methods=['POST'])
 def calculate_nesting():
@@ -28,7 +209,16 @@ def calculate_nesting():
         ],
         "sheet_width": 2500,
         "sheet_height": 1250,
-        "allow_rotation": true
+        "allow_rotation": true,
+        "nesting_mode": "rect",  # "shape" - раскрой по контуру (geometry_id из /api/upload),
+                                 # "common_line" - общий рез (cut_speed_mm_min, pierce_time_s)
+                                 # "part_in_part" - мелкие детали в вырезах (min_hole_side)
+        "rotations": [0, 90, 180, 270],  # углы поворота для "shape"
+        "remnant_time_limit_s": 1.0,  # "rect": сбор крупного остатка, с (по умолчанию 0 - не выполняется)
+        "algorithm": "auto",  # "rect": алгоритм упаковки, "auto" - по признакам заказа (utils.algorithm_selector)
+        "progress_id": "...",  # необязательно, см. /api/progress/<progress_id>
+        "format": "json",  # "columnar" | "msgpack" | "npz" - компактный ответ, только для nesting_mode "rect" (utils.result_format)
+        "patterns": "full"  # "compact" - детали одинаковых листов один раз (utils.sheet_patterns)
     }
     """
     try:
@@ -58,36 +248,19 @@ def calculate_nesting():
         for i, part in enumerate(parts):
             logger.info(f"  Деталь {i+1}: {part.get('name')} - {part.get('width')}x{part.get('height')} (кол-во: {part.get('quantity', 1)})")
         
-        logger.info("[NESTING API] Начинаю оптимизацию раскроя...")
-        
-        # Оптимизация раскроя
-        result = optimize_nesting(
-            parts=parts,
-            sheet_width=sheet_width,
-            sheet_height=sheet_height,
-            allow_rotation=allow_rotation,
-            cut_gap=5.0,  # Зазор между деталями 5мм (отступы накладываются)
-            edge_margin=5.0  # Отступ от края листа 5мм со всех сторон
-        )
+        params = _nesting_params(data)
+        try:
+            options = _nesting_options(data)
+            fmt = _result_format(data, options['nesting_mode'])
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
         
-        logger.info(f"[NESTING API] Результат оптимизации: success={result.get('success')}")
+        result = _calculate(parts, params, progress_id=data.get('progress_id'), options=options)
         
         if not result.get('success'):
-            error_msg = result.get('error', 'Unknown error')
-            logger.error(f"[ERROR] Ошибка оптимизации: {error_msg}")
-            return jsonify({'error': error_msg}), 500
-        
-        logger.info("[NESTING API] Вычисляю обрезки...")
-        
-        # Вычисляем обрезки
-        wastes = calculate_wastes(result)
-        result['wastes'] = wastes
+            return jsonify({'error': result.get('error', 'Unknown error')}), 500
         
-        logger.info(f"[OK] Раскрой рассчитан: {result['sheets_needed']} листов, "
-                   f"{len(wastes)} обрезков, использование {result['utilization_percent']}%")
-        logger.info("=" * 50)
-        
-        return jsonify(result)
+        return _result_response(result, fmt, data)
         
     except Exception as e:
         logger.error("=" * 50)
@@ -97,6 +270,166 @@ def calculate_nesting():
         return jsonify({'error': str(e)}), 500
 
 
+@nesting_bp.route('/batch', methods=['POST'])
+def calculate_batch_nesting():
+    """
+    Совместный раскрой нескольких заказов по материалам
+    
+    POST /api/nesting/batch
+    {
+        "orders": [
+            {
+                "order_number": "А-12158-1544",
+                "material": "Оцинковка",
+                "thickness": 1.5,
+                "parts": [{"name": "Корпус", "width": 1500, "height": 400, "quantity": 1}]
+            }
+        ],
+        "material_prices": {"Оцинковка": 3500},
+        "sheet_width": 2500,
+        "sheet_height": 1250,
+        "allow_rotation": true
+    }
+    
+    Каждая размещенная деталь помечена order_number, в "orders" - доля
+    площади листов и стоимость по каждому заказу.
+    """
+    try:
+        data = request.get_json()
+        
+        if not data:
+            return jsonify({'error': 'Empty request body'}), 400
+        
+        orders = data.get('orders', [])
+        if not orders:
+            return jsonify({'error': 'No orders provided'}), 400
+        
+        logger.info(f"[NESTING API] Совместный раскрой: {len(orders)} заказов")
+        
+        result = nest_orders(
+            orders=orders,
+            material_prices=data.get('material_prices'),
+            **_nesting_params(data)
+        )
+        
+        if not result.get('success'):
+            return jsonify({'error': result.get('error', 'Unknown error')}), 500
+        
+        return jsonify(result)
+        
+    except Exception as e:
+        logger.error(f"Ошибка совместного раскроя: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+
+@nesting_bp.route('/jobs', methods=['POST'])
+def submit_nesting_job():
+    """
+    Поставить раскрой в очередь
+    
+    POST /api/nesting/jobs
+    Тело запроса - как у /api/nesting/calculate
+    
+    Returns:
+        202 {"success": true, "job_id": "...", "status": "queued", "progress_id": "..."}
+        429 если очередь заполнена
+    """
+    try:
+        data = request.get_json()
+        
+        if not data:
+            return jsonify({'error': 'Empty request body'}), 400
+        
+        parts = data.get('parts', [])
+        if not parts:
+            return jsonify({'error': 'No parts provided'}), 400
+        
+        progress_id = data.get('progress_id') or uuid.uuid4().hex
+        
+        try:
+            options = _nesting_options(data)
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        
+        try:
+            job = job_manager.submit(_calculate, parts, _nesting_params(data),
+                                     progress_id=progress_id, options=options)
+        except JobQueueFull as e:
+            logger.warning(f"[JOBS] {e}")
+            return jsonify({'error': str(e)}), 429
+        
+        response = job.to_dict()
+        response['success'] = True
+        response['progress_id'] = progress_id
+        return jsonify(response), 202
+        
+    except Exception as e:
+        logger.error(f"Ошибка постановки задания раскроя: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+
+@nesting_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_nesting_job(job_id):
+    """Статус задания раскроя"""
+    job = job_manager.get(job_id)
+    
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    return jsonify(job.to_dict())
+
+
+@nesting_bp.route('/jobs/<job_id>/result', methods=['GET'])
+def get_nesting_job_result(job_id):
+    """
+    Результат задания раскроя
+    
+    200 - результат (как у /api/nesting/calculate, ?format= - компактный формат)
+    400 - неизвестный формат или колоночный формат для режима раскроя не 'rect'
+    409 - задание еще не завершено или отменено
+    500 - задание завершилось ошибкой
+    """
+    try:
+        fmt = _result_format()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    job = job_manager.get(job_id)
+    
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    if job.status == STATUS_DONE:
+        # Режим раскроя известен только по готовому результату
+        try:
+            check_format(fmt, job.result.get('nesting_mode', 'rect'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return _result_response(job.result, fmt)
+    
+    if job.status == STATUS_FAILED:
+        return jsonify({'error': job.error, 'status': job.status}), 500
+    
+    return jsonify({'error': f'Job is {job.status}', 'status': job.status}), 409
+
+
+@nesting_bp.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_nesting_job(job_id):
+    """Отменить задание раскроя"""
+    job = job_manager.cancel(job_id)
+    
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    return jsonify(job.to_dict())
+
+
+@nesting_bp.route('/jobs', methods=['GET'])
+def get_nesting_jobs_stats():
+    """Состояние очереди заданий"""
+    return jsonify(job_manager.stats())
+
+
 @nesting_bp.route('/optimize', methods=['POST'])
 def optimize_with_wastes():
     """
@@ -127,6 +460,206 @@ def optimize_with_wastes():
         return jsonify({'error': str(e)}), 500
 
 
+@nesting_bp.route('/cache', methods=['GET'])
+def get_cache_stats():
+    """Статистика кэша результатов раскроя"""
+    return jsonify(result_cache.stats())
+
+
+@nesting_bp.route('/cache', methods=['DELETE'])
+def clear_cache():
+    """Очистить кэш результатов раскроя"""
+    result_cache.clear()
+    
+    return jsonify({'success': True})
+
+
+@nesting_bp.route('/cache/nfp', methods=['GET'])
+def get_nfp_cache_stats():
+    """Статистика кэша no-fit polygon (раскрой по контуру)"""
+    return jsonify(nfp_cache.stats())
+
+
+@nesting_bp.route('/cache/nfp', methods=['DELETE'])
+def clear_nfp_cache():
+    """Очистить кэш no-fit polygon"""
+    nfp_cache.clear()
+    
+    return jsonify({'success': True})
+
+
+@nesting_bp.route('/online', methods=['GET'])
+def get_online_state():
+    """Потоковый раскрой: настройки, открытые и закрытые (ожидающие резки) листы"""
+    return jsonify(online_nester.state())
+
+
+@nesting_bp.route('/online/push', methods=['POST'])
+def push_online_parts():
+    """
+    Добавить поступившие детали в потоковый раскрой
+    
+    POST /api/nesting/online/push
+    {
+        "parts": [{"name": "Корпус", "width": 1500, "height": 400, "quantity": 1}],
+        "order_number": "А-12158-1544"  # необязательно
+    }
+    
+    Детали сразу размещаются на открытых листах; в ответе - размещения,
+    отклоненные детали и листы, закрытые этим вызовом.
+    """
+    try:
+        data = request.get_json()
+        
+        if not data or not data.get('parts'):
+            return jsonify({'error': 'No parts provided'}), 400
+        
+        return jsonify(online_nester.push(data['parts'], order_number=data.get('order_number')))
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Ошибка потокового раскроя: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+
+@nesting_bp.route('/online/close', methods=['POST'])
+def close_online_sheets():
+    """Закрыть открытый лист ({"sheet_number": N}) или все непустые открытые листы"""
+    data = request.get_json(silent=True) or {}
+    closed = online_nester.close(data.get('sheet_number'))
+    return jsonify({'closed_sheets': closed})
+
+
+@nesting_bp.route('/online/release', methods=['POST'])
+def release_online_sheets():
+    """
+    Забрать закрытые листы на резку
+    
+    POST /api/nesting/online/release
+    {"sheet_numbers": [1, 2]}  # необязательно, по умолчанию - все закрытые
+    
+    Returns: результат в формате /api/nesting/calculate (для экспорта),
+    листы удаляются из состояния
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        sheets = online_nester.release(data.get('sheet_numbers'))
+        config = online_nester.config
+        
+        result = sheets_result(sheets, config['sheet_width'], config['sheet_height'])
+        optimize_cut_sequence(result)
+        
+        return jsonify(result)
+        
+    except Exception as e:
+        logger.error(f"Ошибка выдачи листов потокового раскроя: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+
+@nesting_bp.route('/online/config', methods=['POST'])
+def configure_online_nesting():
+    """
+    Настройки потокового раскроя (см. utils.online_nesting.DEFAULT_CONFIG)
+    
+    Размер листа и зазоры меняются только без открытых листов (409),
+    неизвестные настройки и значения неверного типа - 400.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        return jsonify(online_nester.configure(**data))
+    except OnlineConfigConflict as e:
+        return jsonify({'error': str(e)}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+def _preview_response(result: Dict, result_id: str, sheet_number: int, params: Dict):
+    """Ответ превью листа: изображение или сетка тайлов (см. utils.sheet_preview)"""
+    fmt = params.get('format') or 'svg'
+    zoom = params.get('zoom')
+    tile = params.get('tile')
+    if isinstance(tile, str):
+        tile = tile.split(',')
+    if tile is not None:
+        col, row = (int(v) for v in tile)
+        tile = (col, row)
+    
+    try:
+        preview = sheet_preview(result, result_id, sheet_number, fmt=fmt,
+                                zoom=float(zoom) if zoom is not None else None, tile=tile)
+    except KeyError as e:
+        return jsonify({'error': str(e.args[0])}), 404
+    
+    if 'tiles' in preview:
+        tiles = preview['tiles']
+        tiles['urls'] = [[f"/api/nesting/preview/{result_id}/{sheet_number}?format={fmt}&zoom={tiles['zoom']:g}&tile={c},{r}"
+                          for c in range(tiles['columns'])] for r in range(tiles['rows'])]
+        return jsonify({'result_id': result_id, 'sheet_number': sheet_number, 'tiles': tiles})
+    
+    etag = preview['cache_key']
+    if etag in request.if_none_match:
+        return Response(status=304)
+    response = Response(preview['body'], mimetype=preview['mimetype'])
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    return response
+
+
+@nesting_bp.route('/preview/<result_id>/<int:sheet_number>', methods=['GET'])
+def get_sheet_preview(result_id, sheet_number):
+    """
+    Превью листа рассчитанного раскроя
+    
+    GET /api/nesting/preview/<result_id>/<sheet_number>?format=svg&zoom=0.3&tile=0,1
+    
+    result_id - из ответа /calculate. format: "svg" | "png", zoom - пикселей
+    на мм. Если PNG в этом масштабе слишком велик, возвращается JSON
+    с сеткой тайлов ("tiles": столбцы, строки, url каждого тайла).
+    """
+    try:
+        result = result_cache.get(result_id)
+        if result is None:
+            return jsonify({'error': 'Result not found (expired). Recalculate or POST /preview'}), 404
+        return _preview_response(result, result_id, sheet_number, request.args)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@nesting_bp.route('/preview', methods=['POST'])
+def post_sheet_preview():
+    """
+    Превью листа результата из запроса (результаты online, batch и т.п.)
+    
+    POST /api/nesting/preview
+    {
+        "nesting_result": {...},
+        "sheet_number": 1,
+        "format": "png",
+        "zoom": 0.5,
+        "tile": [0, 0]  # необязательно
+    }
+    
+    Результат сохраняется в кэше результатов под своим хэшем: url тайлов
+    в ответе ведут на GET /preview/<result_id>/... (как для /calculate).
+    """
+    try:
+        data = request.get_json()
+        if not data or not data.get('nesting_result'):
+            return jsonify({'error': 'nesting_result is required'}), 400
+        result = data['nesting_result']
+        result_id = result_hash(result)
+        if result_cache.get(result_id) is None:
+            result_cache.put(result_id, result)
+        return _preview_response(result, result_id, int(data.get('sheet_number', 1)), data)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @nesting_bp.route('/sheets', methods=['GET'])
 def get_sheet_sizes():
     """Получить стандартные размеры листов"""
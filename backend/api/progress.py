@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+API прогресса долгих операций (Server-Sent Events)
+"""
+
+from flask import Blueprint, Response, stream_with_context
+
+from utils.progress import progress_broker
+
+progress_bp = Blueprint('progress', __name__)
+
+
+@progress_bp.route('/<progress_id>', methods=['GET'])
+def stream_progress(progress_id):
+    """
+    Поток событий прогресса
+
+    GET /api/progress/<progress_id>
+
+    Клиент открывает поток до запуска операции и передает тот же
+    progress_id в /api/upload (поле формы или ?progress_id=),
+    /api/nesting/calculate или /api/nesting/jobs.
+
+    События:
+        file_parsed   - {"index", "total", "name", "ok"}
+        rects_placed  - {"placed", "total", "sheets", "utilization_percent"}
+        sheet_closed  - {"sheet_number", "parts_count", "utilization_percent", "best_utilization_percent"}
+        done          - {"success", ...} - последнее событие, поток закрывается
+    """
+    response = Response(
+        stream_with_context(progress_broker.stream(progress_id)),
+        mimetype='text/event-stream'
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+
+    return response
@@ -6,13 +6,15 @@ API для управления обрезками
 
 from flask import Blueprint, request, jsonify
 import logging
+import os
 
-from utils.waste_database import WasteDatabase
+from utils.waste_assignment import assign_wastes
+from utils.waste_database import WasteDatabase, WastesUnavailable
 
 logger = logging.getLogger(__name__)
 
 wastes_bp = Blueprint('wastes', __name__)
-db = WasteDatabase()
+db = WasteDatabase(os.environ.get('WASTE_DB', 'wastes.db'))
 
 
 @wastes_bp.route('/', methods=['GET'])
@@ -54,45 +56,54 @@ def search_suitable_wastes():
         "parts": [
             {"name": "Распорка", "width": 298, "height": 122}
         ],
-        "material": "Оцинковка 1.5мм"
+        "material": "Оцинковка 1.5мм",
+        "top_k": 3,
+        "reserve": false,
+        "used_in": "А-12158-1544"
     }
+    
+    Каждый обрезок подбирается не больше чем одной детали (utils.waste_assignment).
+    reserve - подобранные обрезки резервируются (статус 'reserved', used_in).
+    top_k > 1 - в совпадении еще 'candidates': до top_k подходящих обрезков
+    по возрастанию площади (без учета других деталей)
     """
     try:
         data = request.get_json()
         
         parts = data.get('parts', [])
         material = data.get('material', 'Оцинковка 1.5мм')
+        top_k = int(data.get('top_k', 1))
         
         if not parts:
             return jsonify({'error': 'No parts provided'}), 400
+        if top_k < 1:
+            return jsonify({'error': 'top_k must be at least 1'}), 400
         
         logger.info(f"Поиск обрезков для {len(parts)} деталей")
         
-        matches = []
-        
-        for part in parts:
-            suitable = db.find_suitable(
-                width=part['width'],
-                height=part['height'],
-                material=material
-            )
-            
-            if suitable:
-                matches.append({
-                    'part': part,
-                    'waste': suitable,
-                    'economy_rub': suitable.get('economy_rub', 0)
-                })
+        assignment = assign_wastes(db, parts, material=material,
+                                   reserve=bool(data.get('reserve', False)), used_in=data.get('used_in'))
+        matches = assignment['matches']
         
-        total_economy = sum(m['economy_rub'] for m in matches)
+        if top_k > 1:
+            candidates = db.find_candidates_many(parts, material=material, top_k=top_k)
+            by_part = {id(part): part_candidates for part, part_candidates in zip(parts, candidates)}
+            for match in matches:
+                match['candidates'] = by_part[id(match['part'])]
         
         return jsonify({
             'success': True,
             'found': len(matches) > 0,
             'matches': matches,
-            'total_economy': total_economy
+            'total_economy': assignment['total_economy'],
+            'unmatched': assignment['unmatched'],
+            'reserved': assignment['reserved']
         })
         
+    except WastesUnavailable as e:
+        return jsonify({'error': str(e)}), 409
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Ошибка поиска обрезков: {e}", exc_info=True)
         return jsonify({'error': str(e)}), 500
@@ -111,10 +122,20 @@ def add_waste():
         "project": "LITE.154.160.1400",
         "order": "А-12158-1544"
     }
+    
+    Несколько обрезков одной транзакцией: {"wastes": [{...}, ...]}
     """
     try:
         data = request.get_json()
         
+        if 'wastes' in data:
+            waste_ids = db.add_many(data['wastes'])
+            
+            return jsonify({
+                'success': True,
+                'waste_ids': waste_ids
+            })
+        
         waste_id = db.add(data)
         
         return jsonify({
@@ -4,7 +4,7 @@
 ZVD Area Calculator - Простой калькулятор площадей разверток
 """
 
-from flask import Flask, jsonify, request, send_file
+from flask import Flask, Response, jsonify, request, send_file
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import logging
@@ -44,7 +44,12 @@ app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50 MB max для боль
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
 
 from utils.dxf_parser import parse_dxf_dimensions
+from utils.part_geometry import register_dxf
 from utils.area_calculator import calculate_total_area
+from utils.json_stream import read_json_stream
+from utils.nesting_validator import validate_sheet_stream
+from utils.sheet_patterns import format_sheet_numbers, iter_sheet_groups
+from utils.dxf_export import iter_dxf_bytes
 
 # Импорты для работы с Excel и PDF
 try:
@@ -90,6 +95,24 @@ except ImportError as e:
 except Exception as e:
     logger.error(f"[ERROR] Ошибка при регистрации blueprint раскроя: {e}", exc_info=True)
 
+# Поток событий прогресса (SSE)
+try:
+    from api.progress import progress_bp
+    app.register_blueprint(progress_bp, url_prefix='/api/progress')
+    logger.info("[OK] Blueprint прогресса зарегистрирован: /api/progress")
+except ImportError as e:
+    logger.error(f"[ERROR] Не удалось загрузить API прогресса: {e}", exc_info=True)
+
+# База обрезков
+try:
+    from api.wastes import wastes_bp
+    app.register_blueprint(wastes_bp, url_prefix='/api/wastes')
+    logger.info("[OK] Blueprint обрезков зарегистрирован: /api/wastes")
+except ImportError as e:
+    logger.error(f"[ERROR] Не удалось загрузить API обрезков: {e}", exc_info=True)
+
+from utils.progress import make_progress_callback
+
 @app.route('/')
 def index():
     return jsonify({
@@ -101,7 +124,8 @@ def index():
             '/api/calculate': 'POST - Рассчитать площади',
             '/api/import/excel': 'POST - Импорт данных из Excel',
             '/api/import/pdf': 'POST - Импорт данных из PDF',
-            '/api/nesting/validate': 'POST - Валидация раскроя (проверка координат)'
+            '/api/nesting/validate': 'POST - Валидация раскроя (проверка координат)',
+            '/api/progress/<progress_id>': 'GET - Поток событий прогресса (SSE)'
         }
     })
 
@@ -124,6 +148,7 @@ def upload_files():
             ...
         ]
     """
+    progress = None
     try:
         logger.info(f"[UPLOAD] Получен запрос на загрузку файлов")
         
@@ -135,6 +160,9 @@ def upload_files():
         logger.info(f"[UPLOAD] Получено файлов: {len(files)}")
         results = []
         
+        # Прогресс разбора файлов для /api/progress/<progress_id>
+        progress = make_progress_callback(request.form.get('progress_id') or request.args.get('progress_id'))
+        
         for idx, file in enumerate(files):
             logger.info(f"[UPLOAD] Обработка файла {idx+1}/{len(files)}: {file.filename}")
             if file.filename == '':
@@ -169,13 +197,22 @@ def upload_files():
                     area_m2 = (width * height) / 1_000_000
                     
                     # Используем ОРИГИНАЛЬНОЕ имя файла для отображения
-                    results.append({
+                    part_info = {
                         'name': original_filename,  # Оригинальное имя с русскими буквами и пробелами
                         'width': round(width, 1),
                         'height': round(height, 1),
                         'area_m2': round(area_m2, 4),
                         'quantity': 1  # По умолчанию 1
-                    })
+                    }
+                    
+                    # Контур детали для раскроя по форме (nesting_mode=shape) -
+                    # разбирается при первом обращении, не при загрузке
+                    try:
+                        part_info['geometry_id'] = register_dxf(str(filepath))
+                    except OSError as contour_error:
+                        logger.warning(f"[UPLOAD] Контур {original_filename} не сохранен: {contour_error}")
+                    
+                    results.append(part_info)
                     
                     logger.info(f"✓ {original_filename}: {width:.0f}×{height:.0f} мм")
                 else:
@@ -198,8 +235,19 @@ def upload_files():
                     'area_m2': 0,
                     'quantity': 1
                 })
+            
+            if progress:
+                progress('file_parsed', {
+                    'index': idx + 1,
+                    'total': len(files),
+                    'name': original_filename,
+                    'ok': results[-1]['width'] > 0
+                })
         
         logger.info(f"[UPLOAD] Успешно обработано файлов: {len(results)}")
+        
+        if progress:
+            progress('done', {'success': True, 'files': len(results)})
         return jsonify({
             'success': True,
             'parts': results
@@ -209,6 +257,9 @@ def upload_files():
         logger.error(f"[UPLOAD] Ошибка загрузки файлов: {e}", exc_info=True)
         import traceback
         logger.error(f"[UPLOAD] Traceback: {traceback.format_exc()}")
+        # Подписчики прогресса иначе ждут 'done' до таймаута потока
+        if progress:
+            progress('done', {'success': False, 'error': str(e)})
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/calculate', methods=['POST'])
@@ -535,193 +586,22 @@ def validate_nesting():
         }
     """
     try:
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({'error': 'Empty request body'}), 400
-        
-        sheets = data.get('sheets', [])
-        sheet_width = data.get('sheet_width', 2500)
-        sheet_height = data.get('sheet_height', 1250)
-        
-        errors = []
-        warnings = []
-        intersections = []
-        out_of_bounds = []
-        overlaps = []
-        total_parts = 0
-        
-        logger.info(f"[VALIDATE] Валидация раскроя: {len(sheets)} листов, размер {sheet_width}x{sheet_height}")
-        
-        for sheet in sheets:
-            sheet_num = sheet.get('sheet_number', 0)
-            parts = sheet.get('parts', [])
-            total_parts += len(parts)
+        # Тело разбирается потоково: листы по одному, без сборки всего JSON в памяти
+        data, sheets = read_json_stream(request.stream, ('sheets',))
+        with sheets:
+            if not data and not sheets.present:
+                return jsonify({'error': 'Empty request body'}), 400
             
-            logger.info(f"[VALIDATE] Лист {sheet_num}: {len(parts)} деталей")
+            sheet_width = data.get('sheet_width', 2500)
+            sheet_height = data.get('sheet_height', 1250)
             
-            # Проверяем каждую деталь
-            for i, part in enumerate(parts):
-                name = part.get('name', f'Деталь {i+1}')
-                x = float(part.get('x', 0))
-                y = float(part.get('y', 0))
-                width = float(part.get('width', 0))
-                height = float(part.get('height', 0))
-                rotated = part.get('rotated', False)
-                
-                # Проверка 1: Выход за границы листа
-                x2 = x + width
-                y2 = y + height
-                
-                if x < 0 or y < 0:
-                    error_msg = f"Лист {sheet_num}, {name}: координаты отрицательные (x={x:.1f}, y={y:.1f})"
-                    errors.append(error_msg)
-                    out_of_bounds.append({
-                        'sheet': sheet_num,
-                        'part': name,
-                        'issue': 'negative_coords',
-                        'x': x,
-                        'y': y
-                    })
-                    logger.warning(f"[VALIDATE] {error_msg}")
-                
-                if x2 > sheet_width or y2 > sheet_height:
-                    error_msg = f"Лист {sheet_num}, {name}: деталь выходит за границы листа (x2={x2:.1f} > {sheet_width} или y2={y2:.1f} > {sheet_height})"
-                    errors.append(error_msg)
-                    out_of_bounds.append({
-                        'sheet': sheet_num,
-                        'part': name,
-                        'issue': 'out_of_bounds',
-                        'x': x,
-                        'y': y,
-                        'x2': x2,
-                        'y2': y2,
-                        'sheet_width': sheet_width,
-                        'sheet_height': sheet_height
-                    })
-                    logger.warning(f"[VALIDATE] {error_msg}")
-                
-                # Проверка 2: Некорректные размеры
-                if width <= 0 or height <= 0:
-                    error_msg = f"Лист {sheet_num}, {name}: некорректные размеры (width={width:.1f}, height={height:.1f})"
-                    errors.append(error_msg)
-                    logger.warning(f"[VALIDATE] {error_msg}")
-                
-                # Проверка 3: Пересечения с другими деталями на этом листе
-                for j, other_part in enumerate(parts):
-                    if i == j:
-                        continue
-                    
-                    other_name = other_part.get('name', f'Деталь {j+1}')
-                    other_x = float(other_part.get('x', 0))
-                    other_y = float(other_part.get('y', 0))
-                    other_width = float(other_part.get('width', 0))
-                    other_height = float(other_part.get('height', 0))
-                    other_x2 = other_x + other_width
-                    other_y2 = other_y + other_height
-                    
-                    # Проверка пересечения прямоугольников
-                    # Два прямоугольника НЕ пересекаются, если:
-                    # - один полностью слева от другого: x2 <= other_x ИЛИ other_x2 <= x
-                    # - один полностью сверху от другого: y2 <= other_y ИЛИ other_y2 <= y
-                    # Если НЕ выполняется ни одно из этих условий, значит есть пересечение
-                    if not (x2 <= other_x or other_x2 <= x or y2 <= other_y or other_y2 <= y):
-                        # Есть пересечение
-                        intersection_x_min = max(x, other_x)
-                        intersection_x_max = min(x2, other_x2)
-                        intersection_y_min = max(y, other_y)
-                        intersection_y_max = min(y2, other_y2)
-                        
-                        intersection_width = intersection_x_max - intersection_x_min
-                        intersection_height = intersection_y_max - intersection_y_min
-                        intersection_area = intersection_width * intersection_height
-                        
-                        error_msg = f"Лист {sheet_num}: ПЕРЕСЕЧЕНИЕ '{name}' и '{other_name}' - площадь пересечения: {intersection_area:.1f} мм² ({intersection_width:.1f}×{intersection_height:.1f} мм)"
-                        errors.append(error_msg)
-                        
-                        # Добавляем только если еще не добавлено (избегаем дубликатов)
-                        already_added = False
-                        for existing in intersections:
-                            if (existing['part1'] == name and existing['part2'] == other_name) or \
-                               (existing['part1'] == other_name and existing['part2'] == name):
-                                already_added = True
-                                break
-                        
-                        if not already_added:
-                            intersections.append({
-                                'sheet': sheet_num,
-                                'part1': name,
-                                'part2': other_name,
-                                'part1_coords': {'x': x, 'y': y, 'x2': x2, 'y2': y2},
-                                'part2_coords': {'x': other_x, 'y': other_y, 'x2': other_x2, 'y2': other_y2},
-                                'intersection_area_mm2': intersection_area,
-                                'intersection_width': intersection_width,
-                                'intersection_height': intersection_height,
-                                'intersection_coords': {
-                                    'x': intersection_x_min,
-                                    'y': intersection_y_min,
-                                    'x2': intersection_x_max,
-                                    'y2': intersection_y_max
-                                }
-                            })
-                        logger.warning(f"[VALIDATE] {error_msg}")
-                
-                # Проверка 4: Слишком близкое расположение (меньше 5мм зазора)
-                for j, other_part in enumerate(parts):
-                    if i == j:
-                        continue
-                    
-                    other_name = other_part.get('name', f'Деталь {j+1}')
-                    other_x = float(other_part.get('x', 0))
-                    other_y = float(other_part.get('y', 0))
-                    other_width = float(other_part.get('width', 0))
-                    other_height = float(other_part.get('height', 0))
-                    other_x2 = other_x + other_width
-                    other_y2 = other_y + other_height
-                    
-                    # Вычисляем минимальное расстояние между прямоугольниками
-                    # Если они не пересекаются, вычисляем расстояние
-                    if x2 <= other_x or other_x2 <= x or y2 <= other_y or other_y2 <= y:
-                        # Не пересекаются, вычисляем расстояние
-                        dx = max(0, max(x - other_x2, other_x - x2))
-                        dy = max(0, max(y - other_y2, other_y - y2))
-                        min_distance = max(dx, dy)
-                        
-                        if min_distance < 5.0 and min_distance > 0:
-                            warning_msg = f"Лист {sheet_num}: {name} и {other_name} слишком близко (расстояние: {min_distance:.1f} мм < 5 мм)"
-                            warnings.append(warning_msg)
-                            overlaps.append({
-                                'sheet': sheet_num,
-                                'part1': name,
-                                'part2': other_name,
-                                'distance_mm': min_distance
-                            })
-                            logger.info(f"[VALIDATE] {warning_msg}")
-        
-        is_valid = len(errors) == 0
-        
-        result = {
-            'valid': is_valid,
-            'errors': errors,
-            'warnings': warnings,
-            'details': {
-                'total_parts': total_parts,
-                'total_sheets': len(sheets),
-                'intersections': intersections,
-                'out_of_bounds': out_of_bounds,
-                'overlaps': overlaps,
-                'errors_count': len(errors),
-                'warnings_count': len(warnings)
-            }
-        }
-        
-        if is_valid:
-            logger.info(f"[VALIDATE] ✓ Раскрой валиден: {total_parts} деталей на {len(sheets)} листах")
-        else:
-            logger.warning(f"[VALIDATE] ✗ Раскрой содержит ошибки: {len(errors)} ошибок, {len(warnings)} предупреждений")
+            # Одинаковые листы (и листы компактного результата) проверяются один раз
+            result = validate_sheet_stream(sheets, sheet_width, sheet_height)
         
         return jsonify(result)
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Ошибка валидации раскроя: {e}", exc_info=True)
         return jsonify({'error': str(e)}), 500
@@ -739,16 +619,21 @@ def export_excel():
     
     Returns: Excel файл
     """
+    sheets = None
     try:
         if not PANDAS_AVAILABLE:
             return jsonify({'error': 'pandas/openpyxl не установлены. Установите: pip install pandas openpyxl'}), 500
         
-        data = request.get_json()
-        if not data:
+        # Тело разбирается потоково: листы результата по одному, без сборки всего JSON в памяти
+        try:
+            data, sheets = read_json_stream(request.stream, ('nesting_result', 'sheets'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if not data and not sheets.present:
             return jsonify({'error': 'Empty request body'}), 400
         
         nesting_result = data.get('nesting_result')
-        if not nesting_result:
+        if nesting_result is None or (not nesting_result and not len(sheets)):
             return jsonify({'error': 'nesting_result is required'}), 400
         
         order_number = data.get('order_number', '')
@@ -942,8 +827,8 @@ def export_excel():
                     except Exception as width_error:
                         logger.warning(f"Не удалось установить автоширину для листа 'Позиции': {width_error}")
             
-                # Лист 3+: Координаты для каждого листа
-                for sheet in nesting_result.get('sheets', []):
+                # Лист 3+: Координаты для каждого раскроя (одинаковые листы - одна вкладка)
+                for sheet, sheet_numbers in iter_sheet_groups(sheets):
                     sheet_num = sheet.get('sheet_number', 1)
                     parts_data = []
                     for part in sheet.get('parts', []):
@@ -966,8 +851,10 @@ def export_excel():
                     df_sheet = pd.DataFrame(parts_data)
                     # Добавляем заголовок с номером заказа, если указан
                     sheet_name = f'Лист {sheet_num}'
+                    if len(sheet_numbers) > 1:
+                        sheet_name = f'Лист {sheet_num} ×{len(sheet_numbers)}'
                     if order_number:
-                        sheet_name = f'Лист {sheet_num} ({order_number})'
+                        sheet_name = f'{sheet_name} ({order_number})'
                     
                     df_sheet.to_excel(writer, sheet_name=sheet_name, index=False, startrow=1)
                     
@@ -981,6 +868,9 @@ def export_excel():
                         worksheet.merge_cells(f'A1:{last_col_letter}1')
                         header_cell = worksheet['A1']
                         header_cell.value = f'КООРДИНАТЫ РАЗМЕЩЕНИЯ ДЕТАЛЕЙ - ЛИСТ {sheet_num}'
+                        if len(sheet_numbers) > 1:
+                            header_cell.value = (f'КООРДИНАТЫ РАЗМЕЩЕНИЯ ДЕТАЛЕЙ - ЛИСТЫ '
+                                                 f'{format_sheet_numbers(sheet_numbers)} (×{len(sheet_numbers)})')
                         header_cell.font = Font(bold=True, size=14)
                         header_cell.alignment = Alignment(horizontal='center', vertical='center')
                     except Exception as header_error:
@@ -1094,6 +984,9 @@ def export_excel():
     except Exception as e:
         logger.error(f"Ошибка экспорта Excel: {e}", exc_info=True)
         return jsonify({'error': str(e)}), 500
+    finally:
+        if sheets is not None:
+            sheets.close()
 
 @app.route('/api/export/pdf', methods=['POST'])
 def export_pdf():
@@ -1108,16 +1001,21 @@ def export_pdf():
     
     Returns: PDF файл
     """
+    sheets = None
     try:
         if not REPORTLAB_AVAILABLE:
             return jsonify({'error': 'reportlab не установлен. Установите: pip install reportlab'}), 500
         
-        data = request.get_json()
-        if not data:
+        # Тело разбирается потоково: листы результата по одному, без сборки всего JSON в памяти
+        try:
+            data, sheets = read_json_stream(request.stream, ('nesting_result', 'sheets'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if not data and not sheets.present:
             return jsonify({'error': 'Empty request body'}), 400
         
         nesting_result = data.get('nesting_result')
-        if not nesting_result:
+        if nesting_result is None or (not nesting_result and not len(sheets)):
             return jsonify({'error': 'nesting_result is required'}), 400
         
         validation_result = data.get('validation_result')
@@ -1430,8 +1328,12 @@ def export_pdf():
                     story.append(Paragraph(f'• {error}', normal_style))
             story.append(Spacer(1, 20))
         
-        # Визуализация и координаты для каждого листа
-        for sheet in nesting_result.get('sheets', []):
+        # Визуализация и координаты для каждого раскроя (одинаковые листы - одна страница)
+        for group_idx, (sheet, sheet_numbers) in enumerate(iter_sheet_groups(sheets)):
+            # Разрыв страницы перед каждым раскроем (кроме первого)
+            if group_idx > 0:
+                story.append(PageBreak())
+            
             sheet_num = sheet.get('sheet_number', 1)
             sheet_width = nesting_result.get('sheet_width', 2500)
             sheet_height = nesting_result.get('sheet_height', 1250)
@@ -1445,7 +1347,10 @@ def export_pdf():
                 spaceAfter=15,
                 fontName=font_name
             )
-            story.append(Paragraph(f'<b>Лист {sheet_num}</b>', sheet_heading_style))
+            sheet_title = f'Лист {sheet_num}'
+            if len(sheet_numbers) > 1:
+                sheet_title = f'Листы {format_sheet_numbers(sheet_numbers)} (×{len(sheet_numbers)})'
+            story.append(Paragraph(f'<b>{sheet_title}</b>', sheet_heading_style))
             
             # Визуализация раскроя (горизонтальная ориентация)
             try:
@@ -1624,10 +1529,6 @@ def export_pdf():
                 ('INNERGRID', (0, 0), (-1, -1), 0.5, colors.black)
             ]))
             story.append(coord_table)
-            
-            # Разрыв страницы после каждого листа (кроме последнего)
-            if sheet_num < len(nesting_result.get('sheets', [])):
-                story.append(PageBreak())
         
         doc.build(story)
         buffer.seek(0)
@@ -1661,6 +1562,75 @@ def export_pdf():
     except Exception as e:
         logger.error(f"Ошибка экспорта PDF: {e}", exc_info=True)
         return jsonify({'error': str(e)}), 500
+    finally:
+        if sheets is not None:
+            sheets.close()
+
+
+@app.route('/api/export/dxf', methods=['POST'])
+def export_dxf():
+    """
+    Экспорт раскроя в DXF для станка (потоковый ответ)
+    
+    POST /api/export/dxf
+    {
+        "nesting_result": {...},  # Результат раскроя (полный или patterns: "compact")
+        "parts": [...],  # Детали запроса раскроя - контуры ('contour'/'holes', 'geometry_id')
+        "sheet_numbers": [1, 2],  # необязательно - только эти листы
+        "order_number": ""
+    }
+    
+    Returns: DXF файл (R12)
+    """
+    sheets = None
+    try:
+        # Тело разбирается потоково: листы результата по одному, без сборки всего JSON в памяти
+        data, sheets = read_json_stream(request.stream, ('nesting_result', 'sheets'))
+        if not data and not sheets.present:
+            return jsonify({'error': 'Empty request body'}), 400
+        
+        nesting_result = data.get('nesting_result')
+        if nesting_result is None or (not nesting_result and not len(sheets)):
+            return jsonify({'error': 'nesting_result is required'}), 400
+        
+        sheet_numbers = data.get('sheet_numbers')
+        if sheet_numbers is not None:
+            sheet_numbers = [int(n) for n in sheet_numbers]
+        
+        from datetime import datetime
+        import urllib.parse
+        
+        order_number = data.get('order_number', '')
+        if order_number:
+            safe_order_number = ''.join('_' if c in '/\\:*?"<>|' else c for c in order_number)
+            filename = f"Раскрой {safe_order_number}.dxf"
+        else:
+            filename = f"Раскрой {datetime.now().strftime('%Y%m%d_%H%M%S')}.dxf"
+        
+        # Блоки и проверка деталей - до ответа 200 (ошибка данных - 400, а не оборванный файл)
+        chunks = iter_dxf_bytes(nesting_result, data.get('parts'), sheet_numbers, sheets)
+        
+        def stream(spooled):
+            # Листы читаются, пока отдается ответ; закрываются по его окончании
+            try:
+                yield from chunks
+            finally:
+                spooled.close()
+        
+        response = Response(stream(sheets), mimetype='application/dxf')
+        sheets = None
+        response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{urllib.parse.quote(filename.encode('utf-8'))}"
+        logger.info(f"✓ Экспорт DXF: {filename}")
+        return response
+        
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Ошибка экспорта DXF: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if sheets is not None:
+            sheets.close()
 
 if __name__ == '__main__':
     logger.info("🚀 Запуск ZVD Area Calculator")
@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк раскроя
+
+Генерирует воспроизводимые (seed) наборы задач и прогоняет их через все
+доступные движки раскроя, записывая время, пиковую память (tracemalloc),
+число листов и использование материала. Сравнение с сохраненным
+эталоном (baseline) показывает регрессии.
+
+Классы задач 2D bin packing:
+    Berkey-Wang I-VI     - стороны U[1, 10|35|100], квадратный лист 10..300
+    Martello-Vigo VII-X  - смесь четырех типов деталей, лист 100x100
+    shop                 - детали в мм на листе 2500x1250, с количествами
+
+Файлы классических наборов (формат 2BP: класс, n, номер, размер листа,
+затем n строк "h w") загружаются через --instances.
+
+Запуск из каталога backend:
+
+    python -m benchmarks.nesting_benchmark --output results.json
+    python -m benchmarks.nesting_benchmark --baseline baseline.json
+    python -m benchmarks.nesting_benchmark --save-baseline baseline.json
+
+Движок 'auto' работает со своим селектором алгоритма: без --selector-model
+модели нет и каждый прогон перебирает весь портфель; история пишется во
+временный каталог (или в --selector-history), а не в рабочие файлы
+utils.algorithm_selector. Использованная модель записывается в результаты.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+from utils.algorithm_selector import AlgorithmSelector, optimize_auto
+from utils.common_line import optimize_common_line
+from utils.part_in_part import optimize_part_in_part
+from utils.rectpack_optimizer import optimize_nesting
+from utils.shape_nesting import optimize_shape_nesting
+
+logger = logging.getLogger(__name__)
+
+# Селектор алгоритма движка 'auto' (см. configure_auto_selector)
+_auto_selector: Optional[AlgorithmSelector] = None
+
+
+def configure_auto_selector(model_path: Optional[str] = None,
+                            history_path: Optional[str] = None) -> AlgorithmSelector:
+    """
+    Селектор движка 'auto' с путями бенчмарка
+
+    Args:
+        model_path: файл модели; None - без модели (весь портфель на каждом прогоне)
+        history_path: файл истории; None - во временном каталоге
+
+    Доля разведки нулевая: с моделью прогоны воспроизводимы.
+    """
+    global _auto_selector
+    workdir = None
+    if model_path is None or history_path is None:
+        workdir = tempfile.mkdtemp(prefix='nesting_benchmark_')
+    _auto_selector = AlgorithmSelector(
+        model_path or os.path.join(workdir, 'algorithm_model.json'),
+        history_path or os.path.join(workdir, 'algorithm_history.jsonl'),
+        exploration_rate=0.0
+    )
+    return _auto_selector
+
+
+def _optimize_auto(**kwargs) -> Dict:
+    """optimize_auto с селектором бенчмарка"""
+    return optimize_auto(**kwargs, selector=_auto_selector or configure_auto_selector())
+
+
+def selector_model_info(selector: AlgorithmSelector) -> Dict:
+    """Какая модель использовалась движком 'auto': путь, sha256, дата обучения, число записей"""
+    info = {'model': str(selector.model_path), 'history': str(selector.history_path), 'exists': False}
+    try:
+        data = selector.model_path.read_bytes()
+    except OSError:
+        return info
+    info.update(exists=True, sha256=hashlib.sha256(data).hexdigest())
+    try:
+        model = json.loads(data)
+        info.update(trained_at=model.get('trained_at'), samples=len(model.get('samples', [])))
+    except ValueError:
+        pass
+    return info
+
+
+# Движки раскроя: имя -> функция с сигнатурой optimize_nesting
+# ('auto' - выбор алгоритма по модели или весь портфель, как algorithm=auto в API)
+ENGINES: Dict[str, Callable[..., Dict]] = {
+    'rect': optimize_nesting,
+    'auto': _optimize_auto,
+    'common_line': optimize_common_line,
+    'part_in_part': optimize_part_in_part,
+    'shape': optimize_shape_nesting,
+}
+
+# Движки, которые по умолчанию не запускаются на больших наборах
+SLOW_ENGINES = {'shape': 120}
+
+BERKEY_WANG = {
+    # класс: (максимальная сторона детали, сторона листа)
+    'I': (10, 10),
+    'II': (10, 30),
+    'III': (35, 40),
+    'IV': (35, 100),
+    'V': (100, 100),
+    'VI': (100, 300),
+}
+
+# Martello-Vigo: доля деталей каждого типа (1-4), лист 100x100
+MARTELLO_VIGO = {
+    'VII': (0.7, 0.1, 0.1, 0.1),
+    'VIII': (0.1, 0.7, 0.1, 0.1),
+    'IX': (0.1, 0.1, 0.7, 0.1),
+    'X': (0.1, 0.1, 0.1, 0.7),
+}
+
+DEFAULT_SIZES = (20, 40, 60, 80, 100)
+
+# Допуски при сравнении с эталоном
+DEFAULT_TOLERANCES = {
+    'time_percent': 25.0,     # рост времени
+    'time_min_seconds': 0.05, # меньшие абсолютные изменения времени - шум
+    'memory_percent': 25.0,   # рост пиковой памяти
+    'utilization_points': 0.5 # падение использования, п.п.
+}
+
+
+# ---------------------------------------------------------------------------
+# Наборы задач
+# ---------------------------------------------------------------------------
+
+def _instance(instance_id: str, instance_class: str, sheet_width: float, sheet_height: float,
+              sizes: List[tuple], scale: float, cut_gap: float = 0.0,
+              edge_margin: float = 0.0) -> Dict:
+    parts = [
+        {'name': f'p{i + 1}', 'width': w * scale, 'height': h * scale, 'quantity': q}
+        for i, (w, h, q) in enumerate(sizes)
+    ]
+    return {
+        'id': instance_id,
+        'class': instance_class,
+        'n': sum(p['quantity'] for p in parts),
+        'sheet_width': sheet_width * scale,
+        'sheet_height': sheet_height * scale,
+        'cut_gap': cut_gap,
+        'edge_margin': edge_margin,
+        'parts': parts,
+    }
+
+
+def generate_berkey_wang(instance_class: str, n: int, seed: int, scale: float = 10.0) -> Dict:
+    """Berkey-Wang I-VI: стороны U[1, max_side], квадратный лист"""
+    max_side, bin_side = BERKEY_WANG[instance_class]
+    rng = random.Random(f'BW-{instance_class}-{n}-{seed}')
+    sizes = [(rng.randint(1, max_side), rng.randint(1, max_side), 1) for _ in range(n)]
+    return _instance(f'BW-{instance_class}-{n}-{seed}', f'BW-{instance_class}',
+                     bin_side, bin_side, sizes, scale)
+
+
+def generate_martello_vigo(instance_class: str, n: int, seed: int, scale: float = 10.0) -> Dict:
+    """Martello-Vigo VII-X: смесь четырех типов деталей на листе 100x100"""
+    w_bin = h_bin = 100
+    rng = random.Random(f'MV-{instance_class}-{n}-{seed}')
+    ranges = {
+        1: ((2 * w_bin // 3, w_bin), (1, h_bin // 2)),
+        2: ((1, w_bin // 2), (2 * h_bin // 3, h_bin)),
+        3: ((w_bin // 2, w_bin), (h_bin // 2, h_bin)),
+        4: ((1, w_bin // 2), (1, h_bin // 2)),
+    }
+
+    sizes = []
+    for _ in range(n):
+        item_type = rng.choices((1, 2, 3, 4), weights=MARTELLO_VIGO[instance_class])[0]
+        (w_lo, w_hi), (h_lo, h_hi) = ranges[item_type]
+        sizes.append((rng.randint(w_lo, w_hi), rng.randint(h_lo, h_hi), 1))
+
+    return _instance(f'MV-{instance_class}-{n}-{seed}', f'MV-{instance_class}',
+                     w_bin, h_bin, sizes, scale)
+
+
+def generate_shop(n: int, seed: int) -> Dict:
+    """Типичный заказ цеха: 2500x1250, зазор 5 мм, позиции с количествами"""
+    rng = random.Random(f'shop-{n}-{seed}')
+    sizes = []
+    total = 0
+    while total < n:
+        quantity = min(rng.choice((1, 1, 2, 4, 6, 10)), n - total)
+        sizes.append((rng.randint(40, 1200), rng.randint(40, 600), quantity))
+        total += quantity
+
+    return _instance(f'shop-{n}-{seed}', 'shop', 2500, 1250, sizes, 1.0, cut_gap=5.0, edge_margin=5.0)
+
+
+def load_2bp_file(path: str, scale: float = 10.0) -> List[Dict]:
+    """
+    Классические наборы в формате 2BP (Berkey-Wang, Martello-Vigo)
+
+    Каждая задача: строки "класс", "n", "номер", "h_bin w_bin", затем n строк "h w";
+    текст после чисел (комментарии) игнорируется.
+    """
+    numbers = []
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            values = []
+            for token in line.split():
+                try:
+                    values.append(float(token))
+                except ValueError:
+                    break
+            if values:
+                numbers.append(values)
+
+    instances = []
+    i = 0
+    while i + 3 < len(numbers):
+        instance_class = int(numbers[i][0])
+        n = int(numbers[i + 1][0])
+        number = int(numbers[i + 2][0])
+        h_bin, w_bin = numbers[i + 3][0], numbers[i + 3][1]
+        items = numbers[i + 4:i + 4 + n]
+        i += 4 + n
+
+        sizes = [(item[1], item[0], 1) for item in items if len(item) >= 2]
+        instances.append(_instance(f'{Path(path).stem}-{instance_class}-{n}-{number}',
+                                   f'2BP-{instance_class}', w_bin, h_bin, sizes, scale))
+
+    return instances
+
+
+def build_suite(classes: Sequence[str], sizes: Sequence[int], seeds: Sequence[int]) -> List[Dict]:
+    """Набор задач по классам, размерам и seed"""
+    suite = []
+    for instance_class in classes:
+        for n in sizes:
+            for seed in seeds:
+                if instance_class in BERKEY_WANG:
+                    suite.append(generate_berkey_wang(instance_class, n, seed))
+                elif instance_class in MARTELLO_VIGO:
+                    suite.append(generate_martello_vigo(instance_class, n, seed))
+                elif instance_class == 'shop':
+                    suite.append(generate_shop(n, seed))
+                else:
+                    raise ValueError(f'Unknown instance class: {instance_class}')
+    return suite
+
+
+def lower_bound(instance: Dict) -> int:
+    """Нижняя оценка числа листов по площади (L0)"""
+    parts_area = sum(p['width'] * p['height'] * p['quantity'] for p in instance['parts'])
+    return math.ceil(parts_area / (instance['sheet_width'] * instance['sheet_height']))
+
+
+# ---------------------------------------------------------------------------
+# Прогон
+# ---------------------------------------------------------------------------
+
+def run_engine(engine: str, instance: Dict, repeats: int = 1, measure_memory: bool = True) -> Dict:
+    """
+    Прогон одного движка на одной задаче
+
+    Время - минимум по repeats прогонам без tracemalloc, память -
+    отдельный прогон под tracemalloc (он заметно замедляет выполнение).
+    """
+    func = ENGINES[engine]
+    kwargs = {
+        'parts': instance['parts'],
+        'sheet_width': instance['sheet_width'],
+        'sheet_height': instance['sheet_height'],
+        'allow_rotation': True,
+        'cut_gap': instance['cut_gap'],
+        'edge_margin': instance['edge_margin'],
+    }
+
+    seconds = None
+    result = None
+    for _ in range(max(1, repeats)):
+        started = time.perf_counter()
+        result = func(**kwargs)
+        elapsed = time.perf_counter() - started
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    peak_mb = None
+    if measure_memory:
+        tracemalloc.start()
+        try:
+            func(**kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        peak_mb = round(peak / 1024 / 1024, 3)
+
+    placed = sum(s['parts_count'] for s in result.get('sheets', []))
+
+    return {
+        'instance': instance['id'],
+        'class': instance['class'],
+        'n': instance['n'],
+        'engine': engine,
+        'success': bool(result.get('success')),
+        'error': result.get('error'),
+        'seconds': round(seconds, 4),
+        'peak_memory_mb': peak_mb,
+        'sheets': result.get('sheets_needed'),
+        'lower_bound': lower_bound(instance),
+        'utilization_percent': result.get('utilization_percent'),
+        'placed': placed,
+    }
+
+
+def run_suite(instances: List[Dict], engines: Sequence[str], repeats: int = 1,
+              measure_memory: bool = True, include_slow: bool = False) -> List[Dict]:
+    """Прогон всех движков на всех задачах"""
+    records = []
+    for instance in instances:
+        for engine in engines:
+            limit = SLOW_ENGINES.get(engine)
+            if limit is not None and not include_slow and instance['n'] > limit:
+                continue
+
+            record = run_engine(engine, instance, repeats, measure_memory)
+            records.append(record)
+            print(f"[BENCH] {instance['id']:<22} {engine:<12} {record['seconds']:>8.3f} с  "
+                  f"листов {record['sheets']} (L0 {record['lower_bound']})  "
+                  f"{record['utilization_percent']}%", flush=True)
+    return records
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(records: List[Dict], baseline: Dict, tolerances: Optional[Dict] = None) -> List[Dict]:
+    """
+    Регрессии относительно эталона
+
+    Returns:
+        [{'instance', 'engine', 'metric', 'baseline', 'current'}]
+    """
+    tolerances = dict(DEFAULT_TOLERANCES, **(tolerances or {}))
+    reference = {(r['instance'], r['engine']): r for r in baseline.get('records', [])}
+    regressions = []
+
+    def flag(record, metric, old, new):
+        regressions.append({'instance': record['instance'], 'engine': record['engine'],
+                            'metric': metric, 'baseline': old, 'current': new})
+
+    for record in records:
+        old = reference.get((record['instance'], record['engine']))
+        if old is None:
+            continue
+
+        if old['success'] and not record['success']:
+            flag(record, 'success', True, False)
+            continue
+
+        if (record['sheets'] or 0) > (old['sheets'] or 0):
+            flag(record, 'sheets', old['sheets'], record['sheets'])
+
+        if (old['utilization_percent'] or 0) - (record['utilization_percent'] or 0) > tolerances['utilization_points']:
+            flag(record, 'utilization_percent', old['utilization_percent'], record['utilization_percent'])
+
+        slower = record['seconds'] - old['seconds']
+        if slower > tolerances['time_min_seconds'] and slower > old['seconds'] * tolerances['time_percent'] / 100:
+            flag(record, 'seconds', old['seconds'], record['seconds'])
+
+        if old.get('peak_memory_mb') and record.get('peak_memory_mb'):
+            if record['peak_memory_mb'] > old['peak_memory_mb'] * (1 + tolerances['memory_percent'] / 100):
+                flag(record, 'peak_memory_mb', old['peak_memory_mb'], record['peak_memory_mb'])
+
+    return regressions
+
+
+def summarize(records: List[Dict]) -> Dict[str, Dict]:
+    """Сводка по движкам: суммарное время, листы, отставание от L0"""
+    summary = {}
+    for record in records:
+        s = summary.setdefault(record['engine'], {'runs': 0, 'failed': 0, 'seconds': 0.0,
+                                                  'sheets': 0, 'lower_bound': 0})
+        s['runs'] += 1
+        s['failed'] += 0 if record['success'] else 1
+        s['seconds'] = round(s['seconds'] + record['seconds'], 4)
+        s['sheets'] += record['sheets'] or 0
+        s['lower_bound'] += record['lower_bound']
+    return summary
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Бенчмарк раскроя')
+    parser.add_argument('--classes', nargs='+',
+                        default=list(BERKEY_WANG) + list(MARTELLO_VIGO) + ['shop'],
+                        help='классы задач: I..X, shop')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='число деталей')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[1], help='seed генератора')
+    parser.add_argument('--instances', nargs='*', default=[], help='файлы наборов в формате 2BP')
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES), help='движки раскроя')
+    parser.add_argument('--repeats', type=int, default=1, help='повторов для замера времени')
+    parser.add_argument('--no-memory', action='store_true', help='не замерять пиковую память')
+    parser.add_argument('--include-slow', action='store_true',
+                        help='запускать медленные движки на больших наборах')
+    parser.add_argument('--output', default='benchmark_results.json', help='файл результатов')
+    parser.add_argument('--baseline', help='эталон для поиска регрессий')
+    parser.add_argument('--save-baseline', help='сохранить результаты как эталон')
+    parser.add_argument('--selector-model', help="модель выбора алгоритма для 'auto' (по умолчанию - без модели)")
+    parser.add_argument('--selector-history',
+                        help="история раскроев 'auto' (по умолчанию - во временном каталоге)")
+    args = parser.parse_args(argv)
+
+    # Подробные логи движков искажают время
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+    unknown = [e for e in args.engines if e not in ENGINES]
+    if unknown:
+        parser.error(f"unknown engines: {', '.join(unknown)}")
+
+    instances = build_suite(args.classes, args.sizes, args.seeds)
+    for path in args.instances:
+        instances.extend(load_2bp_file(path))
+
+    selector = configure_auto_selector(args.selector_model, args.selector_history)
+    records = run_suite(instances, args.engines, args.repeats, not args.no_memory, args.include_slow)
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'summary': summarize(records),
+        'records': records,
+    }
+    if 'auto' in args.engines:
+        report['auto_selector'] = selector_model_info(selector)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        report['baseline'] = {'file': args.baseline, 'commit': baseline.get('commit')}
+        report['regressions'] = compare(records, baseline)
+
+        for r in report['regressions']:
+            print(f"[REGRESSION] {r['instance']} {r['engine']}: {r['metric']} {r['baseline']} -> {r['current']}")
+        print(f"Регрессий: {len(report['regressions'])}")
+        exit_code = 1 if report['regressions'] else 0
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for engine, s in report['summary'].items():
+        print(f"{engine:<12} прогонов {s['runs']:>4}  ошибок {s['failed']}  время {s['seconds']:.2f} с  "
+              f"листов {s['sheets']} (L0 {s['lower_bound']})")
+
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
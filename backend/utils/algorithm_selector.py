@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Автоматический выбор алгоритма упаковки по признакам заказа
+
+Разные заказы лучше раскладываются разными алгоритмами rectpack
+(rectpack_optimizer.ALGORITHMS), а перебор всего портфеля на каждом
+запросе дорог. Для каждого раскроя в режиме 'auto' сохраняются
+признаки заказа (число позиций, разброс пропорций и размеров,
+перекос количеств...) и результаты опробованных алгоритмов. По этой
+истории модель k ближайших соседей выбирает один-два алгоритма для
+нового заказа; пока модель не уверена (мало истории, соседи
+голосуют вразнобой) - прогоняется весь портфель, и такие прогоны
+пополняют историю честными победителями. Модель обучается только на
+прогонах портфеля (победитель среди выбранных моделью алгоритмов лишь
+подтверждал бы ее выбор), поэтому и уверенная модель отдает портфелю
+долю запросов EXPLORATION_RATE. История хранит последние
+MAX_HISTORY_ENTRIES записей.
+
+История - JSON Lines, модель - JSON; модель перечитывается при
+изменении файла, поэтому переобучение не требует перезапуска:
+
+    python -m utils.algorithm_selector train
+    python -m utils.algorithm_selector stats
+"""
+
+import heapq
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from utils.rectpack_optimizer import ALGORITHMS, DEFAULT_ALGORITHM, optimize_nesting
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_PATH = 'algorithm_model.json'
+DEFAULT_HISTORY_PATH = 'algorithm_history.jsonl'
+
+FEATURE_NAMES = (
+    'part_types',       # log(1 + число позиций)
+    'total_quantity',   # log(1 + число деталей)
+    'aspect_spread',    # СКО log(длинная / короткая сторона)
+    'size_spread',      # коэффициент вариации площади детали
+    'quantity_skew',    # доля самой многочисленной позиции
+    'relative_size',    # log10(средняя площадь детали / площадь листа)
+    'max_side_ratio',   # наибольшая сторона детали / наибольшая сторона листа
+    'sheet_fill',       # log(1 + площадь деталей / площадь листа)
+)
+
+# Соседей в голосовании
+NEIGHBOURS = 7
+# Меньше записей в модели - всегда весь портфель
+MIN_TRAINING_SAMPLES = 20
+# Доля голосов лидера, начиная с которой модели доверяют
+CONFIDENCE_THRESHOLD = 0.6
+# Второй алгоритм пробуется, если у него не меньше этой доли голосов
+SECOND_CHOICE_SHARE = 0.2
+# Доля запросов, на которых весь портфель прогоняется и при уверенной модели
+EXPLORATION_RATE = 0.1
+# Записей в истории (старые отбрасываются при дописывании)
+MAX_HISTORY_ENTRIES = 5000
+
+
+def instance_features(parts: List[Dict], sheet_width: float, sheet_height: float) -> Dict[str, float]:
+    """Признаки заказа (детали с некорректными размерами не учитываются)"""
+    items = []
+    for part in parts:
+        width, height = float(part.get('width', 0)), float(part.get('height', 0))
+        quantity = int(part.get('quantity', 1))
+        if width > 0 and height > 0 and quantity > 0:
+            items.append((width, height, quantity))
+
+    total = sum(q for _, _, q in items)
+    if not total:
+        return {name: 0.0 for name in FEATURE_NAMES}
+
+    def weighted_std(values):
+        mean = sum(v * q for v, (_, _, q) in zip(values, items)) / total
+        return mean, math.sqrt(sum((v - mean) ** 2 * q for v, (_, _, q) in zip(values, items)) / total)
+
+    aspects = [math.log(max(w, h) / min(w, h)) for w, h, _ in items]
+    areas = [w * h for w, h, _ in items]
+    _, aspect_std = weighted_std(aspects)
+    mean_area, area_std = weighted_std(areas)
+    sheet_area = float(sheet_width) * float(sheet_height)
+
+    return {
+        'part_types': math.log1p(len(items)),
+        'total_quantity': math.log1p(total),
+        'aspect_spread': aspect_std,
+        'size_spread': area_std / mean_area,
+        'quantity_skew': max(q for _, _, q in items) / total,
+        'relative_size': math.log10(mean_area / sheet_area),
+        'max_side_ratio': max(max(w, h) for w, h, _ in items) / max(sheet_width, sheet_height),
+        'sheet_fill': math.log1p(mean_area * total / sheet_area),
+    }
+
+
+def result_score(result: Dict) -> float:
+    """
+    Оценка раскроя (меньше - лучше): число листов минус один плюс
+    заполнение наименее заполненного листа - при равном числе листов
+    выигрывает раскрой с более свободным «последним» листом
+    """
+    sheets = result.get('sheets', [])
+    if not result.get('success') or not sheets:
+        return math.inf
+    return len(sheets) - 1 + min(s.get('utilization_percent', 0) for s in sheets) / 100
+
+
+class AlgorithmSelector:
+    """
+    Модель выбора алгоритма (k ближайших соседей) и история раскроев
+
+    Args:
+        exploration_rate: доля запросов с полным портфелем при уверенной модели
+        max_history: записей в истории
+    """
+
+    def __init__(self, model_path: str = DEFAULT_MODEL_PATH,
+                 history_path: str = DEFAULT_HISTORY_PATH,
+                 exploration_rate: float = EXPLORATION_RATE,
+                 max_history: int = MAX_HISTORY_ENTRIES):
+        self.model_path = Path(model_path)
+        self.history_path = Path(history_path)
+        self.exploration_rate = exploration_rate
+        self.max_history = max_history
+        self._history_lines = None
+        self._model = None
+        self._model_mtime = None
+        self._lock = threading.Lock()
+
+    # --- модель ---
+
+    def _load_model(self) -> Optional[Dict]:
+        """Модель с диска (перечитывается при изменении файла)"""
+        try:
+            mtime = self.model_path.stat().st_mtime
+        except OSError:
+            return None
+        with self._lock:
+            if mtime != self._model_mtime:
+                try:
+                    model = json.loads(self.model_path.read_text(encoding='utf-8'))
+                except (OSError, ValueError) as e:
+                    logger.warning(f"[ALGORITHM] Модель {self.model_path} не прочитана: {e}")
+                    model = None
+                if model is not None and tuple(model.get('features', ())) != FEATURE_NAMES:
+                    logger.warning(f"[ALGORITHM] Модель {self.model_path} обучена на других признаках")
+                    model = None
+                self._model, self._model_mtime = model, mtime
+            return self._model
+
+    def recommend(self, features: Dict[str, float]) -> Tuple[List[str], float]:
+        """
+        Алгоритмы для заказа
+
+        Returns:
+            (алгоритмы в порядке убывания голосов, уверенность 0..1);
+            при неуверенности и на доле exploration_rate запросов - весь
+            портфель, DEFAULT_ALGORITHM первым
+        """
+        portfolio = [DEFAULT_ALGORITHM] + [name for name in ALGORITHMS if name != DEFAULT_ALGORITHM]
+        model = self._load_model()
+        samples = [s for s in (model or {}).get('samples', []) if s['winner'] in ALGORITHMS]
+        if len(samples) < MIN_TRAINING_SAMPLES:
+            return portfolio, 0.0
+
+        x = [(features[name] - mean) / std
+             for name, mean, std in zip(FEATURE_NAMES, model['mean'], model['std'])]
+        nearest = heapq.nsmallest(model.get('k', NEIGHBOURS), samples, key=lambda s: math.dist(x, s['x']))
+
+        votes = {}
+        for sample in nearest:
+            weight = 1.0 / (math.dist(x, sample['x']) + 1e-3)
+            votes[sample['winner']] = votes.get(sample['winner'], 0.0) + weight
+        total = sum(votes.values())
+        ranked = sorted(votes, key=votes.get, reverse=True)
+        confidence = votes[ranked[0]] / total
+
+        if confidence < CONFIDENCE_THRESHOLD or random.random() < self.exploration_rate:
+            return portfolio, confidence
+        chosen = ranked[:1] + [name for name in ranked[1:2] if votes[name] / total >= SECOND_CHOICE_SHARE]
+        return chosen, confidence
+
+    # --- история ---
+
+    def record(self, features: Dict[str, float], scores: Dict[str, float], portfolio: bool):
+        """Дописать раскрой в историю (сверх max_history - остаются последние записи)"""
+        finite = {name: round(score, 6) for name, score in scores.items() if math.isfinite(score)}
+        if not finite:
+            return
+        entry = {
+            'timestamp': time.time(),
+            'features': {name: round(value, 6) for name, value in features.items()},
+            'scores': finite,
+            'winner': min(finite, key=finite.get),
+            'portfolio': portfolio
+        }
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self._lock:
+            try:
+                self.history_path.parent.mkdir(parents=True, exist_ok=True)
+                if self._history_lines is None:
+                    self._history_lines = self._count_lines()
+                with open(self.history_path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+                self._history_lines += 1
+                # Обрезка с запасом в четверть: файл переписывается не на каждой записи
+                if self._history_lines > self.max_history * 5 // 4:
+                    self._trim_history()
+            except OSError as e:
+                logger.warning(f"[ALGORITHM] История не записана: {e}")
+
+    def _count_lines(self) -> int:
+        try:
+            with open(self.history_path, 'rb') as f:
+                return sum(1 for _ in f)
+        except OSError:
+            return 0
+
+    def _trim_history(self):
+        """Оставить последние max_history записей (атомарная замена файла, под блокировкой)"""
+        with open(self.history_path, 'r', encoding='utf-8') as f:
+            lines = f.readlines()[-self.max_history:]
+        tmp_path = self.history_path.with_name(self.history_path.name + '.tmp')
+        tmp_path.write_text(''.join(lines), encoding='utf-8')
+        os.replace(tmp_path, self.history_path)
+        self._history_lines = len(lines)
+
+    def history(self) -> List[Dict]:
+        """Записи истории (поврежденные строки пропускаются)"""
+        entries = []
+        try:
+            with open(self.history_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if all(name in entry.get('features', {}) for name in FEATURE_NAMES):
+                        entries.append(entry)
+        except OSError:
+            pass
+        return entries
+
+    def train(self, k: int = NEIGHBOURS) -> Dict:
+        """
+        Обучить модель по истории и сохранить на диск
+
+        Только записи с полным портфелем: у остальных победитель - лучший
+        из выбранных самой моделью алгоритмов, обучение на них закрепляло бы
+        ее прежний выбор.
+        """
+        entries = [entry for entry in self.history() if entry.get('portfolio')]
+        if not entries:
+            return {'success': False, 'error': f'Нет прогонов портфеля в истории: {self.history_path}'}
+
+        columns = [[entry['features'][name] for entry in entries] for name in FEATURE_NAMES]
+        mean = [sum(c) / len(c) for c in columns]
+        std = [math.sqrt(sum((v - m) ** 2 for v in c) / len(c)) or 1.0 for c, m in zip(columns, mean)]
+
+        samples = []
+        for entry in entries:
+            samples.append({
+                'x': [round((entry['features'][name] - m) / s, 6) for name, m, s in zip(FEATURE_NAMES, mean, std)],
+                'winner': entry['winner']
+            })
+
+        model = {
+            'features': list(FEATURE_NAMES),
+            'mean': mean,
+            'std': std,
+            'k': k,
+            'samples': samples,
+            'trained_at': time.time()
+        }
+        tmp_path = self.model_path.with_name(self.model_path.name + '.tmp')
+        tmp_path.write_text(json.dumps(model, ensure_ascii=False), encoding='utf-8')
+        os.replace(tmp_path, self.model_path)
+
+        return {'success': True, **self.stats()}
+
+    def stats(self) -> Dict:
+        """Сводка по истории и модели"""
+        entries = self.history()
+        wins = {}
+        for entry in entries:
+            wins[entry['winner']] = wins.get(entry['winner'], 0) + 1
+        model = self._load_model()
+        return {
+            'history_entries': len(entries),
+            'portfolio_runs': sum(1 for e in entries if e.get('portfolio')),
+            'wins': dict(sorted(wins.items(), key=lambda kv: -kv[1])),
+            'model_samples': len(model['samples']) if model else 0,
+            'model_trained_at': model.get('trained_at') if model else None
+        }
+
+
+_default_selector = None
+
+
+def default_selector() -> AlgorithmSelector:
+    """Общий селектор процесса (пути - NESTING_ALGORITHM_MODEL / NESTING_ALGORITHM_HISTORY)"""
+    global _default_selector
+    if _default_selector is None:
+        _default_selector = AlgorithmSelector(
+            os.environ.get('NESTING_ALGORITHM_MODEL', DEFAULT_MODEL_PATH),
+            os.environ.get('NESTING_ALGORITHM_HISTORY', DEFAULT_HISTORY_PATH)
+        )
+    return _default_selector
+
+
+def optimize_auto(parts: List[Dict], sheet_width: float = 2500, sheet_height: float = 1250,
+                  allow_rotation: bool = True, cut_gap: float = 5.0, edge_margin: float = 10.0,
+                  cancel_event: Optional[threading.Event] = None,
+                  progress_callback: Optional[Callable[[str, Dict], None]] = None,
+                  selector: Optional[AlgorithmSelector] = None) -> Dict:
+    """
+    optimize_nesting с алгоритмом, выбранным по признакам заказа
+
+    Returns:
+        лучший из результатов выбранных алгоритмов; дополнительно
+        'algorithm' и 'algorithm_selection': кандидаты, уверенность модели,
+        оценки опробованных алгоритмов (см. result_score)
+    """
+    selector = selector or default_selector()
+    features = instance_features(parts, sheet_width, sheet_height)
+    candidates, confidence = selector.recommend(features)
+    portfolio = len(candidates) == len(ALGORITHMS)
+
+    logger.info(f"[ALGORITHM] Кандидаты: {', '.join(candidates)} (уверенность {confidence:.2f})")
+
+    best, best_score = None, math.inf
+    scores = {}
+    for index, name in enumerate(candidates):
+        if progress_callback is not None:
+            progress_callback('algorithm_started', {'algorithm': name, 'index': index + 1,
+                                                    'total': len(candidates)})
+        result = optimize_nesting(parts, sheet_width=sheet_width, sheet_height=sheet_height,
+                                  allow_rotation=allow_rotation, cut_gap=cut_gap, edge_margin=edge_margin,
+                                  cancel_event=cancel_event, progress_callback=progress_callback,
+                                  algorithm=name)
+        if result.get('cancelled'):
+            return result
+        scores[name] = result_score(result)
+        if best is None or scores[name] < best_score:
+            best, best_score = result, scores[name]
+
+    if best.get('success'):
+        selector.record(features, scores, portfolio)
+        best['algorithm_selection'] = {
+            'candidates': candidates,
+            'confidence': round(confidence, 3),
+            'portfolio': portfolio,
+            'scores': {name: round(score, 4) for name, score in scores.items() if math.isfinite(score)}
+        }
+        logger.info(f"[ALGORITHM] Выбран {best['algorithm']}: {best['sheets_needed']} листов")
+
+    return best
+
+
+def main(argv: Optional[List[str]] = None):
+    """Командная строка: train / stats"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Выбор алгоритма раскроя')
+    parser.add_argument('--model', default=os.environ.get('NESTING_ALGORITHM_MODEL', DEFAULT_MODEL_PATH),
+                        help='файл модели')
+    parser.add_argument('--history', default=os.environ.get('NESTING_ALGORITHM_HISTORY', DEFAULT_HISTORY_PATH),
+                        help='файл истории раскроев')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    train = sub.add_parser('train', help='обучить модель по истории')
+    train.add_argument('--k', type=int, default=NEIGHBOURS, help='число соседей')
+    sub.add_parser('stats', help='сводка по истории и модели')
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    selector = AlgorithmSelector(args.model, args.history)
+    if args.command == 'train':
+        result = selector.train(k=args.k)
+    else:
+        result = selector.stats()
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
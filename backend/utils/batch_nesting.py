@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Совместный раскрой нескольких заказов
+
+Детали всех заказов группируются по материалу и толщине, каждая группа
+раскраивается целиком (без полупустого последнего листа у каждого заказа).
+Независимые группы считаются в общем пуле процессов (utils.process_pool). Площадь листов группы
+распределяется между заказами пропорционально площади их деталей.
+"""
+
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from utils.rectpack_optimizer import optimize_nesting
+from utils.waste_calculator import calculate_wastes
+from utils.cut_sequence import optimize_cut_sequence
+from utils.nesting_validator import refresh_validation
+from utils.process_pool import map_in_pool
+from utils.sheet_patterns import detect_patterns
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MATERIAL = 'Оцинковка'
+DEFAULT_THICKNESS = 1.5
+
+
+def group_parts_by_material(orders: List[Dict]) -> Dict[Tuple[str, float], List[Dict]]:
+    """
+    Группирует детали заказов по (материал, толщина)
+
+    Материал и толщина берутся из детали, иначе из заказа.
+    Каждой детали присваивается внутреннее уникальное имя, чтобы одноименные
+    детали разных заказов не смешивались в optimize_nesting.
+
+    Returns:
+        {(material, thickness): [{'name': internal, 'width', 'height', 'quantity',
+                                  'order_number', 'original_name'}]}
+    """
+    groups = {}
+
+    for order_idx, order in enumerate(orders):
+        order_number = str(order.get('order_number') or f'Заказ {order_idx + 1}')
+
+        for part_idx, part in enumerate(order.get('parts', [])):
+            material = part.get('material') or order.get('material') or DEFAULT_MATERIAL
+            thickness = float(part.get('thickness') or order.get('thickness') or DEFAULT_THICKNESS)
+
+            groups.setdefault((material, thickness), []).append({
+                'name': f'{order_idx}:{part_idx}',
+                'width': part.get('width', 0),
+                'height': part.get('height', 0),
+                'quantity': part.get('quantity', 1),
+                'order_number': order_number,
+                'original_name': part.get('name', 'unknown')
+            })
+
+    return groups
+
+
+def _nest_group(task: Dict) -> Dict:
+    """Раскрой одной группы (выполняется в дочернем процессе)"""
+    result = optimize_nesting(
+        parts=[{k: p[k] for k in ('name', 'width', 'height', 'quantity')} for p in task['parts']],
+        **task['params']
+    )
+    if result.get('success'):
+        result['wastes'] = calculate_wastes(result)
+        optimize_cut_sequence(result)
+    return result
+
+
+def _run_groups(tasks: List[Dict], parallel: bool) -> List[Dict]:
+    """Раскрой групп: параллельно в процессах или последовательно"""
+    if parallel and len(tasks) > 1:
+        results = map_in_pool(_nest_group, tasks)
+        if results is not None:
+            return results
+        logger.warning("[BATCH] Параллельный раскрой недоступен, считаю последовательно")
+
+    return [_nest_group(task) for task in tasks]
+
+
+def _tag_placements(result: Dict, parts: List[Dict]):
+    """
+    Возвращает деталям исходные имена и помечает номер заказа
+
+    Раскрои и отчет валидации пересчитываются: в них были внутренние
+    имена '<заказ>:<деталь>'.
+    """
+    by_name = {p['name']: p for p in parts}
+
+    for sheet in result.get('sheets', []):
+        for placement in sheet['parts']:
+            source = by_name.get(placement['name'])
+            if source:
+                placement['name'] = source['original_name']
+                placement['order_number'] = source['order_number']
+
+    for position in result.get('positions_summary', []):
+        source = by_name.get(position['name'])
+        if source:
+            position['name'] = source['original_name']
+            position['order_number'] = source['order_number']
+
+    if 'patterns' in result:
+        detect_patterns(result)
+    refresh_validation(result)
+
+
+def _allocate_costs(result: Dict, parts: List[Dict], price: Optional[float]) -> Dict[str, Dict]:
+    """
+    Распределяет площадь листов группы между заказами
+
+    Доля заказа = площадь его размещенных деталей / площадь всех деталей группы.
+    """
+    requested = {}
+    for p in parts:
+        requested[p['order_number']] = requested.get(p['order_number'], 0) + int(p.get('quantity', 1))
+
+    placed_area = {}
+    placed_count = {}
+    for sheet in result.get('sheets', []):
+        for placement in sheet['parts']:
+            order_number = placement.get('order_number')
+            placed_area[order_number] = placed_area.get(order_number, 0) + placement['area_m2']
+            placed_count[order_number] = placed_count.get(order_number, 0) + 1
+
+    group_parts_area = sum(placed_area.values())
+    group_sheet_area = result.get('total_sheet_area_m2', 0)
+
+    allocation = {}
+    for order_number, count in requested.items():
+        parts_area = placed_area.get(order_number, 0)
+        share = parts_area / group_parts_area if group_parts_area > 0 else 0
+        sheet_area = group_sheet_area * share
+
+        allocation[order_number] = {
+            'parts_requested': count,
+            'parts_placed': placed_count.get(order_number, 0),
+            'parts_area_m2': round(parts_area, 4),
+            'share_percent': round(share * 100, 2),
+            'allocated_sheet_area_m2': round(sheet_area, 4),
+            'allocated_waste_area_m2': round(sheet_area - parts_area, 4),
+            'cost_rub': round(sheet_area * price, 2) if price else None
+        }
+
+    return allocation
+
+
+def nest_orders(orders: List[Dict], sheet_width: float = 2500, sheet_height: float = 1250,
+                allow_rotation: bool = True, cut_gap: float = 5.0, edge_margin: float = 5.0,
+                material_prices: Optional[Dict[str, float]] = None, parallel: bool = True) -> Dict:
+    """
+    Совместный раскрой заказов по материалам
+
+    Args:
+        orders: [{'order_number': str, 'material': str, 'thickness': float,
+                  'parts': [{'name', 'width', 'height', 'quantity', 'material'?, 'thickness'?}]}]
+        material_prices: цена материала ₽/м² по названию материала
+        parallel: считать группы материалов в отдельных процессах
+
+    Returns:
+        {
+            'success': bool,
+            'groups': [...],   # результат optimize_nesting по каждой группе + material/thickness
+            'orders': [...],   # распределение площади и стоимости по заказам
+            'sheets_needed': int,
+            'total_cost_rub': float | None
+        }
+    """
+    material_prices = material_prices or {}
+    groups = group_parts_by_material(orders)
+
+    if not groups:
+        return {'success': False, 'error': 'No parts provided'}
+
+    logger.info(f"[BATCH] Совместный раскрой: {len(orders)} заказов, {len(groups)} групп материалов")
+
+    params = {
+        'sheet_width': sheet_width,
+        'sheet_height': sheet_height,
+        'allow_rotation': allow_rotation,
+        'cut_gap': cut_gap,
+        'edge_margin': edge_margin
+    }
+    keys = list(groups.keys())
+    tasks = [{'parts': groups[key], 'params': params} for key in keys]
+
+    results = _run_groups(tasks, parallel)
+
+    group_results = []
+    orders_summary = {}
+    errors = []
+
+    for (material, thickness), task, result in zip(keys, tasks, results):
+        if not result.get('success'):
+            errors.append(f"{material} {thickness} мм: {result.get('error', 'Unknown error')}")
+            continue
+
+        _tag_placements(result, task['parts'])
+        price = material_prices.get(material)
+        allocation = _allocate_costs(result, task['parts'], price)
+
+        result['material'] = material
+        result['thickness'] = thickness
+        result['price_per_m2'] = price
+        result['orders_allocation'] = allocation
+        group_results.append(result)
+
+        for order_number, alloc in allocation.items():
+            summary = orders_summary.setdefault(order_number, {
+                'order_number': order_number,
+                'parts_requested': 0,
+                'parts_placed': 0,
+                'parts_area_m2': 0,
+                'allocated_sheet_area_m2': 0,
+                'allocated_waste_area_m2': 0,
+                'cost_rub': 0 if price else None,
+                'groups': []
+            })
+            summary['parts_requested'] += alloc['parts_requested']
+            summary['parts_placed'] += alloc['parts_placed']
+            summary['parts_area_m2'] = round(summary['parts_area_m2'] + alloc['parts_area_m2'], 4)
+            summary['allocated_sheet_area_m2'] = round(summary['allocated_sheet_area_m2'] + alloc['allocated_sheet_area_m2'], 4)
+            summary['allocated_waste_area_m2'] = round(summary['allocated_waste_area_m2'] + alloc['allocated_waste_area_m2'], 4)
+            if alloc['cost_rub'] is not None:
+                summary['cost_rub'] = round((summary['cost_rub'] or 0) + alloc['cost_rub'], 2)
+            summary['groups'].append(dict(alloc, material=material, thickness=thickness))
+
+    if errors and not group_results:
+        return {'success': False, 'error': '; '.join(errors)}
+
+    costs = [o['cost_rub'] for o in orders_summary.values() if o['cost_rub'] is not None]
+    sheets_needed = sum(r['sheets_needed'] for r in group_results)
+
+    logger.info(f"[BATCH] Готово: {sheets_needed} листов в {len(group_results)} группах")
+
+    return {
+        'success': True,
+        'sheets_needed': sheets_needed,
+        'groups': group_results,
+        'orders': list(orders_summary.values()),
+        'total_cost_rub': round(sum(costs), 2) if costs else None,
+        'errors': errors
+    }
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Раскрой с общим резом (common-line cutting)
+
+Одинаковые детали собираются в блоки cols x rows без зазора между собой:
+соседние детали блока режутся одной линией. Блоки раскладываются обычным
+optimize_nesting (между блоками - прежний cut_gap), затем разворачиваются
+обратно в детали.
+
+Для каждого листа совпадающие ребра деталей сливаются в общие отрезки
+реза - по ним считается длина реза и машинное время. Врезка - одна на
+связную цепочку реза (соприкасающиеся отрезки режутся без отрыва).
+"""
+
+import bisect
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from utils.nesting_validator import refresh_validation
+from utils.rectpack_optimizer import optimize_nesting
+from utils.sheet_patterns import detect_patterns
+
+logger = logging.getLogger(__name__)
+
+EPS = 1e-6
+
+# Скорость резки и время врезки по умолчанию (лазер, оцинковка 1-2 мм)
+DEFAULT_CUT_SPEED_MM_MIN = 3000.0
+DEFAULT_PIERCE_TIME_S = 0.5
+DEFAULT_MAX_BLOCK_PARTS = 16
+
+
+def plan_blocks(width: float, height: float, quantity: int, usable_width: float,
+                usable_height: float, max_block_parts: int = DEFAULT_MAX_BLOCK_PARTS) -> List[Tuple[int, int, int]]:
+    """
+    Разбивает количество одинаковых деталей на блоки
+
+    Предпочтение - самый большой блок, при равенстве - ближе к квадрату.
+
+    Returns:
+        [(cols, rows, count)] - count блоков по cols x rows деталей
+    """
+    max_cols = int((usable_width + EPS) // width) if width > 0 else 0
+    max_rows = int((usable_height + EPS) // height) if height > 0 else 0
+    if max_cols < 1 or max_rows < 1:
+        # Помещается только с поворотом (или не помещается) - решает optimize_nesting
+        return [(1, 1, quantity)]
+
+    blocks = []
+    remaining = quantity
+    while remaining > 0:
+        best = None
+        for cols in range(1, min(max_cols, remaining, max_block_parts) + 1):
+            rows = min(max_rows, remaining // cols, max_block_parts // cols)
+            if rows < 1:
+                continue
+            score = (cols * rows, -abs(cols * width - rows * height))
+            if best is None or score > best[0]:
+                best = (score, cols, rows)
+
+        _, cols, rows = best
+        count = remaining // (cols * rows)
+        blocks.append((cols, rows, count))
+        remaining -= count * cols * rows
+
+    return blocks
+
+
+def _merge_intervals(intervals: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
+    intervals.sort()
+    merged = [list(intervals[0])]
+    for start, end in intervals[1:]:
+        if start <= merged[-1][1] + EPS:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def merge_cut_segments(parts: List[Dict]) -> List[List[float]]:
+    """
+    Общие отрезки реза листа
+
+    Ребра деталей, лежащие на одной прямой и перекрывающиеся или
+    стыкующиеся, сливаются в один отрезок.
+
+    Returns:
+        [[x1, y1, x2, y2], ...]
+    """
+    horizontal = {}
+    vertical = {}
+
+    for part in parts:
+        x, y, w, h = part['x'], part['y'], part['width'], part['height']
+        for line_y in (y, y + h):
+            horizontal.setdefault(round(line_y, 3), []).append((x, x + w))
+        for line_x in (x, x + w):
+            vertical.setdefault(round(line_x, 3), []).append((y, y + h))
+
+    segments = []
+    for line_y, intervals in sorted(horizontal.items()):
+        for start, end in _merge_intervals(intervals):
+            segments.append([round(start, 3), line_y, round(end, 3), line_y])
+    for line_x, intervals in sorted(vertical.items()):
+        for start, end in _merge_intervals(intervals):
+            segments.append([line_x, round(start, 3), line_x, round(end, 3)])
+
+    return segments
+
+
+def count_cut_chains(segments: List[List[float]]) -> int:
+    """
+    Число связных цепочек реза (по одной врезке на цепочку)
+
+    Отрезки горизонтальные и вертикальные (merge_cut_segments); связаны,
+    если пересекаются или касаются. Отдельный прямоугольник - одна
+    цепочка из 4 отрезков, блок с общим резом - тоже одна.
+    """
+    parent = list(range(len(segments)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    horizontal = [i for i, s in enumerate(segments) if s[1] == s[3]]
+    vertical = sorted((segments[i][0], i) for i, s in enumerate(segments) if s[1] != s[3])
+    vertical_x = [x for x, _ in vertical]
+
+    for i in horizontal:
+        x1, y, x2, _ = segments[i]
+        start = bisect.bisect_left(vertical_x, min(x1, x2) - EPS)
+        end = bisect.bisect_right(vertical_x, max(x1, x2) + EPS)
+        for _, j in vertical[start:end]:
+            _, y1, _, y2 = segments[j]
+            if min(y1, y2) - EPS <= y <= max(y1, y2) + EPS:
+                parent[find(i)] = find(j)
+
+    return sum(1 for i in range(len(segments)) if find(i) == i)
+
+
+def _machine_time_min(length_mm: float, pierces: int, cut_speed_mm_min: float,
+                      pierce_time_s: float) -> float:
+    return length_mm / cut_speed_mm_min + pierces * pierce_time_s / 60.0
+
+
+def optimize_common_line(parts: List[Dict], sheet_width: float = 2500,
+                         sheet_height: float = 1250, allow_rotation: bool = True,
+                         cut_gap: float = 5.0, edge_margin: float = 10.0,
+                         cut_speed_mm_min: float = DEFAULT_CUT_SPEED_MM_MIN,
+                         pierce_time_s: float = DEFAULT_PIERCE_TIME_S,
+                         max_block_parts: int = DEFAULT_MAX_BLOCK_PARTS,
+                         cancel_event: Optional[threading.Event] = None,
+                         progress_callback: Optional[Callable[[str, Dict], None]] = None) -> Dict:
+    """
+    Раскрой с общим резом между одинаковыми деталями
+
+    Args:
+        parts: как в optimize_nesting
+        cut_speed_mm_min: скорость резки, мм/мин
+        pierce_time_s: время одной врезки, с
+        max_block_parts: максимум деталей в блоке с общим резом
+
+    Returns:
+        результат в формате optimize_nesting и дополнительно:
+        'nesting_mode': 'common_line',
+        у листов 'cut_segments' и 'cut_length_mm',
+        'cut_stats' - длина реза, число врезок и машинное время
+        без общего реза и с ним
+    """
+    usable_width = sheet_width - 2 * edge_margin - cut_gap
+    usable_height = sheet_height - 2 * edge_margin - cut_gap
+
+    # Одинаковые детали (имя и размеры) объединяются
+    types = {}
+    position_map = {}
+    for part in parts:
+        name = part.get('name', 'unknown')
+        width = float(part.get('width', 0))
+        height = float(part.get('height', 0))
+        key = (name, width, height)
+        types[key] = types.get(key, 0) + int(part.get('quantity', 1))
+        if name not in position_map:
+            position_map[name] = len(position_map) + 1
+
+    block_parts = []
+    block_info = {}
+    for (name, width, height), quantity in types.items():
+        if width <= 0 or height <= 0:
+            logger.warning(f"   [WARN] Пропущена деталь с некорректными размерами: {name}")
+            continue
+
+        for cols, rows, count in plan_blocks(width, height, quantity, usable_width, usable_height, max_block_parts):
+            block_name = f'block{len(block_parts)}'
+            block_info[block_name] = (name, width, height, cols, rows)
+            block_parts.append({
+                'name': block_name,
+                'width': cols * width,
+                'height': rows * height,
+                'quantity': count
+            })
+
+    logger.info(f"[COMMON LINE] {sum(types.values())} деталей собрано в "
+                f"{sum(b['quantity'] for b in block_parts)} блоков")
+
+    result = optimize_nesting(
+        parts=block_parts, sheet_width=sheet_width, sheet_height=sheet_height,
+        allow_rotation=allow_rotation, cut_gap=cut_gap, edge_margin=edge_margin,
+        cancel_event=cancel_event, progress_callback=progress_callback
+    )
+    if not result.get('success'):
+        return result
+
+    # Разворачиваем блоки в детали
+    total_separate_length = 0.0
+    total_length = 0.0
+    total_parts = 0
+    total_pierces = 0
+    position_data = {}
+    segments_by_pattern = {}
+
+    for sheet in result['sheets']:
+        sheet_parts = []
+        for block_id, block in enumerate(sheet['parts']):
+            name, width, height, cols, rows = block_info[block['name']]
+            if block['rotated']:
+                nx, ny, cell_w, cell_h = rows, cols, height, width
+            else:
+                nx, ny, cell_w, cell_h = cols, rows, width, height
+
+            for j in range(ny):
+                for i in range(nx):
+                    sheet_parts.append({
+                        'name': name,
+                        'width': cell_w,
+                        'height': cell_h,
+                        'x': block['x'] + i * cell_w,
+                        'y': block['y'] + j * cell_h,
+                        'rotated': block['rotated'],
+                        'position_number': position_map[name],
+                        'area_m2': (cell_w * cell_h) / 1_000_000,
+                        'block_id': block_id
+                    })
+
+        # Одинаковые раскрои блоков дают одинаковые отрезки реза
+        pattern_id = sheet.get('pattern_id')
+        cached = segments_by_pattern.get(pattern_id)
+        if cached is None:
+            segments = merge_cut_segments(sheet_parts)
+            cached = (segments, count_cut_chains(segments))
+            if pattern_id is not None:
+                segments_by_pattern[pattern_id] = cached
+        segments, pierces = cached
+        cut_length = sum(abs(s[2] - s[0]) + abs(s[3] - s[1]) for s in segments)
+        separate_length = sum(2 * (p['width'] + p['height']) for p in sheet_parts)
+
+        sheet['parts'] = sheet_parts
+        sheet['parts_count'] = len(sheet_parts)
+        sheet['cut_segments'] = segments
+        sheet['cut_length_mm'] = round(cut_length, 1)
+
+        total_separate_length += separate_length
+        total_length += cut_length
+        total_parts += len(sheet_parts)
+        total_pierces += pierces
+
+        for part in sheet_parts:
+            pos = position_data.setdefault(part['position_number'], {
+                'position_number': part['position_number'],
+                'name': part['name'],
+                'width': part['width'],
+                'height': part['height'],
+                'area_m2': part['area_m2'],
+                'quantity': 0,
+                'total_area_m2': 0
+            })
+            pos['quantity'] += 1
+            pos['total_area_m2'] += part['area_m2']
+
+    # Без общего реза каждая деталь - отдельный контур с одной врезкой,
+    # с общим резом - одна врезка на связную цепочку реза
+    separate_time = _machine_time_min(total_separate_length, total_parts, cut_speed_mm_min, pierce_time_s)
+    common_time = _machine_time_min(total_length, total_pierces, cut_speed_mm_min, pierce_time_s)
+
+    result['nesting_mode'] = 'common_line'
+    result['positions_summary'] = sorted(position_data.values(), key=lambda p: p['position_number'])
+    result['cut_stats'] = {
+        'cut_speed_mm_min': cut_speed_mm_min,
+        'pierce_time_s': pierce_time_s,
+        'separate_cut_length_mm': round(total_separate_length, 1),
+        'cut_length_mm': round(total_length, 1),
+        'cut_length_saved_mm': round(total_separate_length - total_length, 1),
+        'separate_pierces': total_parts,
+        'pierces': total_pierces,
+        'separate_machine_time_min': round(separate_time, 2),
+        'machine_time_min': round(common_time, 2)
+    }
+
+    # Раскрои сравниваются уже по деталям, а не по блокам
+    detect_patterns(result)
+    refresh_validation(result)
+
+    logger.info(f"[COMMON LINE] Рез {total_length / 1000:.1f} м вместо {total_separate_length / 1000:.1f} м, "
+                f"время {common_time:.1f} мин вместо {separate_time:.1f} мин")
+
+    return result
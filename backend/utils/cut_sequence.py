@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Порядок резки деталей на листе (минимизация холостых перемещений)
+
+Каждая деталь режется с одной точки врезки наружного контура
+(вершина, ближайшая к левому нижнему углу габарита): голова приходит
+в эту точку, сначала вырезает внутренние контуры (отверстия, в порядке
+ближайшего соседа) и возвращается, затем режет наружный контур и
+остается в той же точке. Поэтому перемещение между деталями - отрезок
+между их точками врезки, а обход отверстий от порядка деталей не зависит.
+
+Порядок деталей: ближайший сосед от начала координат станка (0, 0),
+затем 2-opt по спискам ближайших соседей для открытого маршрута.
+"""
+
+import logging
+import math
+import time
+from typing import Dict, List, Sequence, Tuple
+
+from utils.sheet_patterns import pattern_signature
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+Point = Tuple[float, float]
+
+# Скорость холостого хода по умолчанию, мм/мин
+DEFAULT_RAPID_SPEED_MM_MIN = 30000.0
+# Размер списка ближайших соседей для 2-opt
+NEIGHBOURS = 10
+# Ограничение времени 2-opt на один лист, с
+TWO_OPT_TIME_LIMIT_S = 0.5
+
+ORIGIN = (0.0, 0.0)
+
+
+def _pierce_point(part: Dict) -> Point:
+    """Точка врезки наружного контура"""
+    x, y = float(part.get('x', 0)), float(part.get('y', 0))
+    contour = part.get('contour')
+    if not contour:
+        return (x, y)
+    return tuple(min(contour, key=lambda p: (p[0] - x) ** 2 + (p[1] - y) ** 2))
+
+
+def _order_holes(holes: List[List], start: Point) -> Tuple[List[List], float]:
+    """
+    Порядок вырезки отверстий ближайшим соседом от точки врезки детали
+
+    Returns:
+        (отверстия в порядке резки, холостой путь туда и обратно к точке врезки)
+    """
+    remaining = list(holes)
+    ordered = []
+    current = start
+    travel = 0.0
+    while remaining:
+        best_idx, best_point, best_dist = 0, None, math.inf
+        for idx, hole in enumerate(remaining):
+            for px, py in hole:
+                dist = math.hypot(px - current[0], py - current[1])
+                if dist < best_dist:
+                    best_idx, best_point, best_dist = idx, (px, py), dist
+        ordered.append(remaining.pop(best_idx))
+        travel += best_dist
+        current = best_point
+    if ordered:
+        travel += math.hypot(current[0] - start[0], current[1] - start[1])
+    return ordered, travel
+
+
+def path_length(points: Sequence[Point], order: Sequence[int], start: Point = ORIGIN) -> float:
+    """Длина открытого маршрута start -> points[order[0]] -> ..."""
+    length = 0.0
+    cx, cy = start
+    for idx in order:
+        px, py = points[idx]
+        length += math.hypot(px - cx, py - cy)
+        cx, cy = px, py
+    return length
+
+
+def nearest_neighbour(points: Sequence[Point], start: Point = ORIGIN) -> List[int]:
+    """Маршрут ближайшего соседа от точки start"""
+    if NUMPY_AVAILABLE and len(points) > 1:
+        coords = np.asarray(points, dtype=float)
+        visited = np.zeros(len(points), dtype=bool)
+        order = []
+        current = np.asarray(start, dtype=float)
+        for _ in range(len(points)):
+            dist = ((coords - current) ** 2).sum(axis=1)
+            dist[visited] = np.inf
+            nxt = int(dist.argmin())
+            visited[nxt] = True
+            order.append(nxt)
+            current = coords[nxt]
+        return order
+
+    remaining = set(range(len(points)))
+    order = []
+    cx, cy = start
+    while remaining:
+        nxt = min(remaining, key=lambda i: (points[i][0] - cx) ** 2 + (points[i][1] - cy) ** 2)
+        remaining.remove(nxt)
+        order.append(nxt)
+        cx, cy = points[nxt]
+    return order
+
+
+def _neighbour_lists(coords: Sequence[Point], k: int) -> List[List[int]]:
+    """k ближайших к каждой точке (кроме точки 0 - начала маршрута), по возрастанию расстояния"""
+    n = len(coords)
+    if NUMPY_AVAILABLE:
+        xy = np.asarray(coords, dtype=float)
+        near = []
+        # Блоками, чтобы не строить всю матрицу расстояний сразу
+        for lo in range(0, n, 512):
+            block = ((xy[lo:lo + 512, None, :] - xy[None, :, :]) ** 2).sum(axis=2)
+            block[:, 0] = np.inf
+            block[np.arange(block.shape[0]), np.arange(lo, lo + block.shape[0])] = np.inf
+            idx = np.argpartition(block, k - 1, axis=1)[:, :k]
+            for row, cand in zip(block, idx):
+                near.append([int(c) for c in cand[np.argsort(row[cand])]])
+        return near
+
+    near = []
+    for a in range(n):
+        ax, ay = coords[a]
+        candidates = sorted(range(1, n), key=lambda b: (coords[b][0] - ax) ** 2 + (coords[b][1] - ay) ** 2)
+        near.append([b for b in candidates if b != a][:k])
+    return near
+
+
+def two_opt(points: Sequence[Point], order: List[int], start: Point = ORIGIN,
+            neighbours: int = NEIGHBOURS, time_limit: float = TWO_OPT_TIME_LIMIT_S) -> List[int]:
+    """
+    2-opt для открытого маршрута с фиксированным началом
+
+    Кандидаты на новое ребро - только ближайшие соседи вершины,
+    поэтому проход стоит O(n * neighbours) вместо O(n^2).
+    """
+    n = len(order)
+    if n < 3:
+        return order
+
+    # Узел 0 - начало маршрута, детали - 1..n
+    coords = [start] + list(points)
+    tour = [0] + [i + 1 for i in order]
+    pos = [0] * (n + 1)
+    for i, node in enumerate(tour):
+        pos[node] = i
+
+    def dist(a: int, b: int) -> float:
+        return math.hypot(coords[a][0] - coords[b][0], coords[a][1] - coords[b][1])
+
+    near = _neighbour_lists(coords, min(neighbours, n - 1))
+
+    deadline = time.monotonic() + time_limit
+    improved = True
+    while improved and time.monotonic() < deadline:
+        improved = False
+        for i in range(n):
+            a, b = tour[i], tour[i + 1]
+            d_ab = dist(a, b)
+            for c in near[a]:
+                d_ac = dist(a, c)
+                if d_ac >= d_ab:
+                    break
+                j = pos[c]
+                if j > i + 1:
+                    # Ребра (a, b) и (c, d) -> (a, c) и (b, d), участок b..c разворачивается
+                    d = tour[j + 1] if j < n else None
+                    gain = d_ab - d_ac
+                    if d is not None:
+                        gain += dist(c, d) - dist(b, d)
+                    lo, hi = i + 1, j
+                elif j < i:
+                    # Ребра (c, e) и (a, b) -> (c, a) и (e, b), участок e..a разворачивается
+                    e = tour[j + 1]
+                    gain = dist(c, e) + d_ab - d_ac - dist(e, b)
+                    lo, hi = j + 1, i
+                else:
+                    continue
+
+                if gain > 1e-9:
+                    tour[lo:hi + 1] = tour[lo:hi + 1][::-1]
+                    for p in range(lo, hi + 1):
+                        pos[tour[p]] = p
+                    improved = True
+                    break
+
+    return [node - 1 for node in tour[1:]]
+
+
+def sequence_sheet(parts: List[Dict]) -> Tuple[List[int], List[Point], float, float]:
+    """
+    Порядок резки деталей листа (отверстия деталей переупорядочиваются на месте)
+
+    Returns:
+        (порядок - индексы parts, точки врезки, холостой путь по отверстиям,
+         холостой путь между деталями)
+    """
+    points = [_pierce_point(part) for part in parts]
+    holes_travel = 0.0
+    for part, point in zip(parts, points):
+        if part.get('holes'):
+            part['holes'], travel = _order_holes(part['holes'], point)
+            holes_travel += travel
+
+    order = _children_first(parts, two_opt(points, nearest_neighbour(points)))
+    travel = path_length(points, order)
+
+    # Эвристика не гарантирует улучшения на уже хорошем порядке
+    initial = _children_first(parts, list(range(len(parts))))
+    initial_travel = path_length(points, initial)
+    if travel > initial_travel:
+        order, travel = initial, initial_travel
+
+    return order, points, holes_travel, travel
+
+
+def _children_first(parts: List[Dict], order: List[int]) -> List[int]:
+    """
+    Детали в вырезах (utils.part_in_part) режутся раньше детали-носителя:
+    после вырезки наружного контура носитель уже не держит их на листе
+    """
+    children = {}
+    for idx, part in enumerate(parts):
+        if part.get('inside') is not None:
+            children.setdefault(part['inside'], []).append(idx)
+    if not children:
+        return order
+
+    hosts = {part.get('nest_id') for part in parts if part.get('nest_id') is not None}
+    position = {idx: pos for pos, idx in enumerate(order)}
+    result = []
+    for idx in order:
+        # Носителя на листе нет - вложенная деталь остается на своем месте маршрута
+        if parts[idx].get('inside') in hosts:
+            continue
+        nested = children.get(parts[idx].get('nest_id'), [])
+        result.extend(sorted(nested, key=position.__getitem__))
+        result.append(idx)
+    return result
+
+
+def _canonical_key(part: Dict):
+    return repr(pattern_signature({'parts': [part]}))
+
+
+def optimize_cut_sequence(result: Dict,
+                          rapid_speed_mm_min: float = DEFAULT_RAPID_SPEED_MM_MIN) -> Dict:
+    """
+    Упорядочивает детали каждого листа в порядке резки
+
+    Детали листа ('parts') переставляются, им добавляются 'cut_order'
+    (с 1) и 'pierce_point'; листам - 'rapid_distance_mm' и
+    'rapid_distance_before_mm' (в исходном порядке раскроя), результату -
+    'cut_sequence': холостой путь и время до и после по всем листам.
+    Одинаковые раскрои (utils.sheet_patterns) считаются один раз.
+
+    Returns:
+        тот же результат (изменяется на месте)
+    """
+    if not result.get('success'):
+        return result
+
+    started = time.monotonic()
+    total_before = 0.0
+    total_after = 0.0
+    solved = {}
+
+    for sheet in result.get('sheets', []):
+        parts = sheet.get('parts', [])
+        pattern_id = sheet.get('pattern_id')
+        before = path_length([_pierce_point(part) for part in parts], range(len(parts)))
+
+        # У одинаковых листов детали могут идти в разном порядке -
+        # приводим к общему, чтобы применить найденную перестановку
+        if pattern_id is not None:
+            parts.sort(key=_canonical_key)
+
+        cached = solved.get(pattern_id) if pattern_id is not None else None
+        if cached is None:
+            cached = sequence_sheet(parts) + (parts,)
+            if pattern_id is not None:
+                solved[pattern_id] = cached
+        else:
+            # Порядок отверстий - как у первого листа раскроя
+            for part, first in zip(parts, cached[4]):
+                if first.get('holes'):
+                    part['holes'] = [list(h) for h in first['holes']]
+        order, points, holes_travel, travel = cached[:4]
+        before += holes_travel
+        after = holes_travel + travel
+
+        sheet['parts'] = [parts[idx] for idx in order]
+        for cut_order, idx in enumerate(order, start=1):
+            parts[idx]['cut_order'] = cut_order
+            parts[idx]['pierce_point'] = [round(points[idx][0], 2), round(points[idx][1], 2)]
+
+        sheet['rapid_distance_before_mm'] = round(before, 1)
+        sheet['rapid_distance_mm'] = round(after, 1)
+        total_before += before
+        total_after += after
+
+    result['cut_sequence'] = {
+        'rapid_speed_mm_min': rapid_speed_mm_min,
+        'rapid_distance_before_mm': round(total_before, 1),
+        'rapid_distance_mm': round(total_after, 1),
+        'rapid_distance_saved_percent': round((1 - total_after / total_before) * 100, 1) if total_before > 0 else 0.0,
+        'rapid_time_before_min': round(total_before / rapid_speed_mm_min, 2),
+        'rapid_time_min': round(total_after / rapid_speed_mm_min, 2)
+    }
+
+    logger.info(f"[CUT SEQUENCE] Холостой ход {total_before / 1000:.1f} м -> {total_after / 1000:.1f} м "
+                f"за {time.monotonic() - started:.2f} с")
+
+    return result
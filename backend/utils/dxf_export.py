@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Экспорт раскроя в DXF для станка ЧПУ
+
+Каждый лист - контур листа и детали по реальной геометрии (контур
+из запроса, geometry_id загруженного DXF или прямоугольник). Геометрия
+каждой позиции записывается один раз как блок (BLOCK), размещение
+детали - вставка блока (INSERT) с точкой и углом поворота.
+
+Файл DXF R12 (AC1009) пишется потоково: генератор отдает секции
+и сущности по одной, поэтому раскрой на сотни листов не собирается
+в памяти целиком. Блоки и проверка размещений строятся до первого
+фрагмента (при вызове iter_dxf): ошибка в данных - исключение до
+начала ответа, а не оборванный файл. Листы в файле идут друг над другом с интервалом
+SHEET_SPACING_MM, лист 1 - внизу в начале координат.
+
+Слои: SHEET - контур листа, OUTER - наружные контуры деталей,
+INNER - вырезы, LABELS - номера листов и позиций.
+"""
+
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from utils.part_geometry import load_geometry, part_geometry, rectangle_geometry, rotation_offset
+
+logger = logging.getLogger(__name__)
+
+# Интервал между листами в файле, мм
+SHEET_SPACING_MM = 200.0
+# Кодировка текста (номера листов, имена блоков - ASCII)
+DXF_ENCODING = 'cp1251'
+
+# Слои: имя -> цвет ACI
+LAYERS = {
+    'SHEET': 8,
+    'OUTER': 7,
+    'INNER': 1,
+    'LABELS': 3,
+}
+
+
+def _num(value: float) -> str:
+    text = f'{float(value):.4f}'.rstrip('0').rstrip('.')
+    return '0' if text == '-0' else text
+
+
+def _polyline(points: Iterable[Tuple[float, float]], layer: str) -> str:
+    """Замкнутая POLYLINE (R12: POLYLINE + VERTEX + SEQEND)"""
+    chunks = [f'0\nPOLYLINE\n8\n{layer}\n66\n1\n10\n0\n20\n0\n30\n0\n70\n1\n']
+    for x, y in points:
+        chunks.append(f'0\nVERTEX\n8\n{layer}\n10\n{_num(x)}\n20\n{_num(y)}\n30\n0\n')
+    chunks.append(f'0\nSEQEND\n8\n{layer}\n')
+    return ''.join(chunks)
+
+
+def _text(x: float, y: float, height: float, text: str, layer: str = 'LABELS') -> str:
+    return f'0\nTEXT\n8\n{layer}\n10\n{_num(x)}\n20\n{_num(y)}\n30\n0\n40\n{_num(height)}\n1\n{text}\n'
+
+
+def _insert(block: str, x: float, y: float, angle: float, layer: str = 'OUTER') -> str:
+    entity = f'0\nINSERT\n8\n{layer}\n2\n{block}\n10\n{_num(x)}\n20\n{_num(y)}\n30\n0\n'
+    if angle:
+        entity += f'50\n{_num(angle)}\n'
+    return entity
+
+
+def _original_size(placement: Dict) -> Tuple[float, float]:
+    """Размеры детали без поворота (в результате они уже переставлены для rotated)"""
+    width, height = float(placement.get('width', 0)), float(placement.get('height', 0))
+    if placement.get('rotated') and placement.get('rotation') is None:
+        return height, width
+    return width, height
+
+
+def _placement_geometry(placement: Dict, parts_by_name: Dict[str, Dict]) -> Dict:
+    """Геометрия позиции (без поворота, габарит от (0, 0))"""
+    part = parts_by_name.get(placement.get('name'))
+    if part is not None:
+        return part_geometry(part)
+    geometry = load_geometry(placement.get('geometry_id'))
+    if geometry:
+        return geometry
+    return rectangle_geometry(*_original_size(placement))
+
+
+def _insertion(placement: Dict, geometry: Dict) -> Tuple[float, float, float]:
+    """
+    Точка вставки и угол блока
+
+    Прямоугольный раскрой: rotated - поворот на 90° против часовой
+    с переносом габарита в (0, 0), точка вставки смещается на ширину
+    размещения. Раскрой по контуру: угол 'rotation', габарит повернутой
+    детали переносится в (x, y) (как part_geometry.rotate_polygon).
+    """
+    x, y = float(placement.get('x', 0)), float(placement.get('y', 0))
+    angle = placement.get('rotation')
+    if angle is not None:
+        angle = float(angle) % 360
+        if not angle:
+            return x, y, 0.0
+        points = list(geometry['outer']) + [p for hole in geometry['holes'] for p in hole]
+        offset_x, offset_y = rotation_offset(points, angle)
+        return x - offset_x, y - offset_y, angle
+    if placement.get('rotated'):
+        return x + float(placement.get('width', 0)), y, 90.0
+    return x, y, 0.0
+
+
+def _sheet_parts(sheets: Iterable[Dict], wanted: Optional[Set[int]] = None) -> Iterator[Tuple[Dict, List[Dict]]]:
+    """
+    Листы с деталями (для компактного результата - детали первого листа раскроя)
+
+    Детали раскроев собираются по всем листам, отбор wanted - после:
+    повторный лист выдается с деталями, даже если первый лист его
+    раскроя не экспортируется.
+
+    Raises:
+        ValueError: лист компактного результата без деталей своего раскроя
+    """
+    parts_by_pattern = {}
+    for sheet in sheets:
+        pattern_id = sheet.get('pattern_id')
+        if 'parts' in sheet:
+            parts_by_pattern.setdefault(pattern_id, sheet['parts'])
+            sheet_parts = sheet['parts']
+        elif pattern_id is None:
+            sheet_parts = []
+        elif pattern_id in parts_by_pattern:
+            sheet_parts = parts_by_pattern[pattern_id]
+        else:
+            raise ValueError(f"Sheet {sheet.get('sheet_number')}: no parts for pattern {pattern_id}")
+        if wanted is None or sheet.get('sheet_number') in wanted:
+            yield sheet, sheet_parts
+
+
+def _check_placement(placement: Dict):
+    """Числовые поля размещения (ValueError/TypeError до начала записи)"""
+    for key in ('x', 'y', 'width', 'height'):
+        float(placement.get(key, 0))
+    if placement.get('rotation') is not None:
+        float(placement['rotation'])
+
+
+def iter_dxf(result: Dict, parts: Optional[List[Dict]] = None,
+             sheet_numbers: Optional[Iterable[int]] = None,
+             sheets: Optional[Iterable[Dict]] = None) -> Iterator[str]:
+    """
+    DXF раскроя по частям
+
+    Блоки строятся и размещения проверяются сразу при вызове, генератор
+    только форматирует текст.
+
+    Args:
+        result: результат раскроя (полный или compact_patterns)
+        parts: детали запроса раскроя - источник контуров ('contour'/'holes',
+               'geometry_id'); без них - geometry_id размещений или прямоугольники
+        sheet_numbers: экспортировать только эти листы
+        sheets: листы, если их нет в result (SpooledArray потокового разбора
+                тела); читаются в два прохода - блоки и сущности
+
+    Returns:
+        генератор фрагментов текста DXF
+
+    Raises:
+        ValueError, TypeError: некорректные листы, детали или размещения
+    """
+    sheet_width = float(result.get('sheet_width', 2500))
+    sheet_height = float(result.get('sheet_height', 1250))
+    wanted = {int(n) for n in sheet_numbers} if sheet_numbers is not None else None
+    source = result.get('sheets', []) if sheets is None else sheets
+    parts_by_name = {p.get('name'): p for p in parts or [] if p.get('name') is not None}
+
+    # Блоки: одна геометрия на позицию (первое размещение с этим именем)
+    blocks = {}  # name -> (имя блока, геометрия)
+    sheets_count = 0
+    for _, sheet_parts in _sheet_parts(source, wanted):
+        sheets_count += 1
+        for placement in sheet_parts:
+            _check_placement(placement)
+            name = placement.get('name')
+            if name not in blocks:
+                blocks[name] = (f'PART_{len(blocks) + 1}', _placement_geometry(placement, parts_by_name))
+
+    return _iter_sections(source, wanted, sheets_count, blocks, sheet_width, sheet_height)
+
+
+def _iter_sections(sheets: Iterable[Dict], wanted: Optional[Set[int]], sheets_count: int, blocks: Dict,
+                   sheet_width: float, sheet_height: float) -> Iterator[str]:
+    """Секции DXF по подготовленным листам (отбор wanted) и блокам"""
+    pitch = sheet_height + SHEET_SPACING_MM
+    extent_y = max(sheets_count * pitch - SHEET_SPACING_MM, 0.0)
+
+    yield ('0\nSECTION\n2\nHEADER\n'
+           '9\n$ACADVER\n1\nAC1009\n'
+           '9\n$DWGCODEPAGE\n3\nANSI_1251\n'
+           '9\n$INSBASE\n10\n0\n20\n0\n30\n0\n'
+           f'9\n$EXTMIN\n10\n0\n20\n0\n30\n0\n'
+           f'9\n$EXTMAX\n10\n{_num(sheet_width)}\n20\n{_num(extent_y)}\n30\n0\n'
+           '0\nENDSEC\n')
+
+    tables = ['0\nSECTION\n2\nTABLES\n',
+              '0\nTABLE\n2\nLTYPE\n70\n1\n'
+              '0\nLTYPE\n2\nCONTINUOUS\n70\n0\n3\nSolid line\n72\n65\n73\n0\n40\n0\n'
+              '0\nENDTAB\n',
+              f'0\nTABLE\n2\nLAYER\n70\n{len(LAYERS)}\n']
+    for layer, color in LAYERS.items():
+        tables.append(f'0\nLAYER\n2\n{layer}\n70\n0\n62\n{color}\n6\nCONTINUOUS\n')
+    tables.append('0\nENDTAB\n0\nENDSEC\n')
+    yield ''.join(tables)
+
+    yield '0\nSECTION\n2\nBLOCKS\n'
+    for block, geometry in blocks.values():
+        yield (f'0\nBLOCK\n8\n0\n2\n{block}\n70\n0\n10\n0\n20\n0\n30\n0\n3\n{block}\n'
+               + _polyline(geometry['outer'], 'OUTER')
+               + ''.join(_polyline(hole, 'INNER') for hole in geometry['holes'])
+               + '0\nENDBLK\n8\n0\n')
+    yield '0\nENDSEC\n'
+
+    yield '0\nSECTION\n2\nENTITIES\n'
+    label_height = max(sheet_height / 40, 10.0)
+    for index, (sheet, sheet_parts) in enumerate(_sheet_parts(sheets, wanted)):
+        base_y = index * pitch
+        number = sheet.get('sheet_number', index + 1)
+        chunks = [_polyline([(0, base_y), (sheet_width, base_y),
+                             (sheet_width, base_y + sheet_height), (0, base_y + sheet_height)], 'SHEET'),
+                  _text(0, base_y + sheet_height + label_height / 2, label_height, f'Лист {number}')]
+        for placement in sheet_parts:
+            block, geometry = blocks[placement.get('name')]
+            x, y, angle = _insertion(placement, geometry)
+            chunks.append(_insert(block, x, y + base_y, angle))
+
+            position = placement.get('position_number')
+            if position:
+                width, height = float(placement.get('width', 0)), float(placement.get('height', 0))
+                text_height = max(min(width, height) / 5, 1.0)
+                chunks.append(_text(float(placement.get('x', 0)) + width / 2 - text_height / 2,
+                                    float(placement.get('y', 0)) + base_y + height / 2 - text_height / 2,
+                                    min(text_height, 30.0), str(position)))
+        yield ''.join(chunks)
+    yield '0\nENDSEC\n0\nEOF\n'
+
+    logger.info(f"[DXF] Экспортировано листов: {sheets_count}, блоков: {len(blocks)}")
+
+
+def iter_dxf_bytes(result: Dict, parts: Optional[List[Dict]] = None,
+                   sheet_numbers: Optional[Iterable[int]] = None,
+                   sheets: Optional[Iterable[Dict]] = None) -> Iterator[bytes]:
+    """iter_dxf в кодировке DXF_ENCODING (для потокового ответа; ошибки данных - при вызове)"""
+    chunks = iter_dxf(result, parts, sheet_numbers, sheets)
+    return (chunk.encode(DXF_ENCODING, errors='replace') for chunk in chunks)
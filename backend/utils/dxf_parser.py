@@ -75,3 +75,84 @@ def parse_dxf_dimensions(dxf_path: str):
         logger.error(f"Ошибка чтения DXF: {e}")
         return (None, None)
 
+
+
+# Типы сущностей, из которых собираются контуры детали
+CONTOUR_ENTITY_TYPES = ('LINE', 'ARC', 'CIRCLE', 'ELLIPSE', 'SPLINE', 'LWPOLYLINE', 'POLYLINE')
+
+
+def _chain_segments(chains, tolerance: float = 0.1):
+    """
+    Сшивает открытые цепочки точек в замкнутые контуры по совпадению концов
+    
+    Returns:
+        список замкнутых контуров [[(x, y), ...], ...]
+    """
+    def close(a, b):
+        return abs(a[0] - b[0]) <= tolerance and abs(a[1] - b[1]) <= tolerance
+    
+    loops = []
+    chains = [list(c) for c in chains if len(c) >= 2]
+    
+    while chains:
+        current = chains.pop()
+        
+        extended = True
+        while extended and not close(current[0], current[-1]):
+            extended = False
+            for i, other in enumerate(chains):
+                if close(current[-1], other[0]):
+                    current.extend(other[1:])
+                elif close(current[-1], other[-1]):
+                    current.extend(reversed(other[:-1]))
+                elif close(current[0], other[-1]):
+                    current[:0] = other[:-1]
+                elif close(current[0], other[0]):
+                    current[:0] = list(reversed(other[1:]))
+                else:
+                    continue
+                del chains[i]
+                extended = True
+                break
+        
+        if len(current) >= 4 and close(current[0], current[-1]):
+            loops.append(current[:-1])
+    
+    return loops
+
+
+def parse_dxf_contours(dxf_path: str, tolerance: float = 0.5):
+    """
+    Получить замкнутые контуры детали из DXF файла
+    
+    Дуги, окружности и сплайны аппроксимируются отрезками с точностью tolerance (мм).
+    
+    Returns:
+        геометрия детали (см. utils.part_geometry) или None
+    """
+    from ezdxf import path as ezdxf_path
+    from utils.part_geometry import build_geometry
+    
+    try:
+        doc = ezdxf.readfile(dxf_path)
+        msp = doc.modelspace()
+        
+        chains = []
+        for entity in msp:
+            if entity.dxftype() not in CONTOUR_ENTITY_TYPES:
+                continue
+            try:
+                entity_path = ezdxf_path.make_path(entity)
+                for sub_path in entity_path.sub_paths():
+                    points = [(v.x, v.y) for v in sub_path.flattening(tolerance)]
+                    if len(points) >= 2:
+                        chains.append(points)
+            except Exception as e:
+                logger.debug(f"Пропущена сущность {entity.dxftype()}: {e}")
+        
+        loops = _chain_segments(chains)
+        return build_geometry(loops, tolerance=tolerance)
+        
+    except Exception as e:
+        logger.error(f"Ошибка чтения контуров DXF: {e}")
+        return None
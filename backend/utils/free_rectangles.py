@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Свободные прямоугольники листа (maximal empty rectangles)
+
+Алгоритм MaxRects: начинаем с прямоугольника листа, каждое препятствие
+(размещенная деталь) разбивает пересекаемые свободные прямоугольники
+на до четырех частей (слева, справа, снизу, сверху), вложенные
+прямоугольники отбрасываются. Результат - все максимальные пустые
+прямоугольники (они могут перекрываться).
+
+Прямоугольник - кортеж (x, y, width, height).
+"""
+
+from typing import Iterable, List, Optional, Tuple
+
+Rect = Tuple[float, float, float, float]
+
+EPS = 1e-6
+
+
+def _split(free: Rect, obstacle: Rect, min_side: float) -> List[Rect]:
+    """Части свободного прямоугольника вокруг препятствия (если пересекаются)"""
+    fx, fy, fw, fh = free
+    ox, oy, ow, oh = obstacle
+
+    if ox >= fx + fw - EPS or ox + ow <= fx + EPS or oy >= fy + fh - EPS or oy + oh <= fy + EPS:
+        return [free]
+
+    parts = []
+    if ox > fx + EPS:
+        parts.append((fx, fy, ox - fx, fh))
+    if ox + ow < fx + fw - EPS:
+        parts.append((ox + ow, fy, fx + fw - ox - ow, fh))
+    if oy > fy + EPS:
+        parts.append((fx, fy, fw, oy - fy))
+    if oy + oh < fy + fh - EPS:
+        parts.append((fx, oy + oh, fw, fy + fh - oy - oh))
+
+    # Дальнейшие разбиения только уменьшают прямоугольник - узкие можно отбросить сразу
+    return [p for p in parts if p[2] >= min_side - EPS and p[3] >= min_side - EPS]
+
+
+def _contains(outer: Rect, inner: Rect) -> bool:
+    return (inner[0] >= outer[0] - EPS and inner[1] >= outer[1] - EPS and
+            inner[0] + inner[2] <= outer[0] + outer[2] + EPS and
+            inner[1] + inner[3] <= outer[1] + outer[3] + EPS)
+
+
+def subtract(free_rects: List[Rect], obstacle: Rect, min_side: float = 0.0) -> List[Rect]:
+    """
+    Вычесть препятствие из набора максимальных свободных прямоугольников
+
+    Нетронутые прямоугольники между собой уже не вложены, поэтому
+    на вложенность проверяются только новые части.
+    """
+    kept = []
+    created = []
+    for rect in free_rects:
+        pieces = _split(rect, obstacle, min_side)
+        if len(pieces) == 1 and pieces[0] is rect:
+            kept.append(rect)
+        else:
+            created.extend(pieces)
+
+    if not created:
+        return kept
+
+    unique = []
+    for i, rect in enumerate(created):
+        if any(_contains(other, rect) for other in kept):
+            continue
+        if any(j != i and _contains(other, rect) and (not _contains(rect, other) or j < i)
+               for j, other in enumerate(created)):
+            continue
+        unique.append(rect)
+
+    return kept + unique
+
+
+def maximal_empty_rectangles(width: float, height: float, obstacles: Iterable[Rect],
+                             min_side: float = 0.0, origin: Tuple[float, float] = (0.0, 0.0)) -> List[Rect]:
+    """
+    Все максимальные пустые прямоугольники области
+
+    Args:
+        width, height: размеры области (лист)
+        obstacles: занятые прямоугольники (x, y, w, h)
+        min_side: прямоугольники с меньшей стороной не возвращаются
+        origin: левый нижний угол области
+    """
+    free = [(origin[0], origin[1], float(width), float(height))]
+
+    # Слева направо: новые части реже перекрываются с уже найденными
+    for obstacle in sorted(obstacles, key=lambda r: (r[0], r[1])):
+        free = subtract(free, obstacle, min_side)
+        if not free:
+            break
+
+    return free
+
+
+def largest_empty_rectangle(width: float, height: float, obstacles: Iterable[Rect],
+                            min_side: float = 0.0) -> Optional[Rect]:
+    """Наибольший по площади пустой прямоугольник (None, если нет)"""
+    free = maximal_empty_rectangles(width, height, obstacles, min_side)
+    if not free:
+        return None
+    return max(free, key=lambda r: r[2] * r[3])
+
+
+def disjoint_remnants(width: float, height: float, obstacles: Iterable[Rect],
+                      min_side: float = 0.0, min_area: float = 0.0) -> List[Rect]:
+    """
+    Непересекающиеся обрезки: жадно берется наибольший свободный
+    прямоугольник, вычитается из остальных, и так далее
+
+    Returns:
+        прямоугольники по убыванию площади
+    """
+    free = maximal_empty_rectangles(width, height, obstacles, min_side)
+    remnants = []
+
+    while free:
+        best = max(free, key=lambda r: r[2] * r[3])
+        if best[2] * best[3] < min_area:
+            break
+        remnants.append(best)
+        free = subtract(free, best, min_side)
+
+    return remnants
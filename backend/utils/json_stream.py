@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Потоковый разбор JSON тела запроса: массив листов по одному элементу
+
+Валидация и экспорт раскроя на сотни листов получают результат в теле
+запроса целиком, а request.get_json() сначала собирает весь JSON
+в словари Python. Здесь тело читается кусками CHUNK_SIZE, элементы
+массива по пути array_path (например, ('nesting_result', 'sheets'))
+разбираются по одному и сразу пишутся строками JSON во временный файл
+(до SPOOL_MEMORY_BYTES - в памяти). Остальные поля тела собираются
+как обычно - они могут идти и после массива (sheet_width, patterns_compact).
+
+После разбора листы читаются из файла по одному, проходов может быть
+несколько (utils.sheet_patterns.iter_sheet_groups).
+"""
+
+import codecs
+import json
+import logging
+import tempfile
+from typing import Any, BinaryIO, Dict, Iterator, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Размер куска чтения тела, байт
+CHUNK_SIZE = 64 * 1024
+# Листы до этого объема хранятся в памяти, больше - во временном файле
+SPOOL_MEMORY_BYTES = 4 * 1024 * 1024
+
+_WHITESPACE = ' \t\r\n'
+_DELIMITERS = _WHITESPACE + ',:]}'
+
+
+class SpooledArray:
+    """
+    Элементы массива из потокового разбора (исходный текст JSON каждого элемента)
+
+    present - массив был в теле (в том числе пустой): {"sheets": []}
+    отличается от тела без ключа.
+    """
+
+    def __init__(self):
+        self._file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES, mode='w+b')
+        self._sizes = []
+        self.present = False
+
+    def append_json(self, text: str):
+        data = text.encode('utf-8')
+        self._file.write(data)
+        self._sizes.append(len(data))
+
+    def __len__(self) -> int:
+        return len(self._sizes)
+
+    def __iter__(self) -> Iterator[Any]:
+        """Элементы по одному; каждый проход читает файл с начала (проходы - по очереди)"""
+        self._file.seek(0)
+        for size in self._sizes:
+            yield json.loads(self._file.read(size))
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self) -> 'SpooledArray':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _Reader:
+    """Чтение JSON из потока байт: значимые символы и значения целиком"""
+
+    def __init__(self, stream: BinaryIO, chunk_size: int):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size: int) -> bool:
+        """Дочитывает тело (прочитанное до pos отбрасывается); False - тело закончилось"""
+        if self.eof:
+            return False
+        chunk = self.stream.read(size)
+        self.eof = not chunk
+        self.buffer = self.buffer[self.pos:] + self.decoder.decode(chunk, final=self.eof)
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Следующий значимый символ ('' - конец тела)"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill(self.chunk_size):
+                return ''
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Invalid JSON: expected {' or '.join(repr(c) for c in chars)}, "
+                             f"got {char or 'end of body'!r}")
+        self.pos += 1
+        return char
+
+    def value(self) -> Any:
+        """Следующее значение JSON целиком"""
+        return self.value_text()[0]
+
+    def value_text(self) -> Tuple[Any, str]:
+        """Следующее значение JSON и его исходный текст"""
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.json.raw_decode(self.buffer, self.pos)
+                # Число, оборванное концом куска ('1' из '12', '1' из '1e5'),
+                # разбирается без ошибки - значение должно кончаться разделителем
+                if self.eof or (end < len(self.buffer) and self.buffer[end] in _DELIMITERS):
+                    text = self.buffer[self.pos:end]
+                    self.pos = end
+                    return value, text
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Длинное значение дочитывается все более крупными кусками,
+            # чтобы не разбирать его заново на каждые CHUNK_SIZE байт
+            self._fill(size)
+            size *= 2
+
+
+def _parse(reader: _Reader, path: Tuple[str, ...], array_path: Tuple[str, ...], items: SpooledArray) -> Any:
+    """Значение по пути path; массив по array_path уходит в items (в значение не попадает)"""
+    if path == array_path and reader.peek() == '[':
+        reader.expect('[')
+        items.present = True
+        if reader.peek() == ']':
+            reader.pos += 1
+            return None
+        while True:
+            # Разобранный элемент не хранится: в файл идет его исходный текст
+            items.append_json(reader.value_text()[1])
+            if reader.expect(',]') == ']':
+                return None
+
+    if path == array_path[:len(path)] and reader.peek() == '{':
+        reader.expect('{')
+        obj = {}
+        if reader.peek() == '}':
+            reader.pos += 1
+            return obj
+        while True:
+            if reader.peek() != '"':
+                reader.expect('"')
+            key = reader.value()
+            reader.expect(':')
+            value = _parse(reader, path + (key,), array_path, items)
+            if not (path + (key,) == array_path and value is None):
+                obj[key] = value
+            if reader.expect(',}') == '}':
+                return obj
+
+    return reader.value()
+
+
+def read_json_stream(stream: BinaryIO, array_path: Tuple[str, ...],
+                     chunk_size: int = CHUNK_SIZE) -> Tuple[Dict, SpooledArray]:
+    """
+    Разбор JSON объекта из потока с выносом массива по array_path
+
+    Args:
+        stream: поток тела запроса (request.stream)
+        array_path: ключи до массива, например ('sheets',)
+        chunk_size: размер куска чтения
+
+    Returns:
+        (объект без массива по array_path, элементы массива).
+        Элементы закрываются вызывающим (with items: ...). Пустое тело - ({}, [])
+        с items.present == False.
+
+    Raises:
+        ValueError: тело - не JSON объект или некорректный JSON
+    """
+    reader = _Reader(stream, chunk_size)
+    items = SpooledArray()
+    try:
+        if reader.peek() == '':
+            return {}, items
+        if reader.peek() != '{':
+            raise ValueError('Request body must be a JSON object')
+        data = _parse(reader, (), array_path, items)
+        if reader.peek() != '':
+            raise ValueError('Invalid JSON: extra data after the object')
+    except Exception:
+        items.close()
+        raise
+
+    logger.info(f"[JSON STREAM] Разобрано элементов {'.'.join(array_path)}: {len(items)}")
+    return data, items
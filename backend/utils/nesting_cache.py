@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Кэш результатов раскроя
+
+Два уровня хранения:
+- в памяти (LRU, OrderedDict)
+- на диске (необязательный, JSON-файлы в каталоге)
+
+Записи живут ограниченное время (TTL) и вытесняются по LRU.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _canonical_number(value: Any) -> Any:
+    """Приводит числа к единому виду (100 и 100.0 дают один ключ)"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        number = float(value)
+        return int(number) if number.is_integer() else round(number, 6)
+    return value
+
+
+def _canonical(value: Any) -> Any:
+    """Рекурсивно нормализует значение для хеширования"""
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return _canonical_number(value)
+
+
+def make_cache_key(parts: List[Dict], **params) -> str:
+    """
+    Вычисляет канонический хеш входных данных раскроя
+
+    Детали нормализуются (порядок ключей, запись чисел), но их порядок
+    сохраняется: от него зависят номера позиций в результате.
+
+    Args:
+        parts: список деталей
+        **params: параметры раскроя (размер листа, зазоры, поворот и т.д.)
+
+    Returns:
+        hex-строка SHA-256
+    """
+    payload = {
+        'parts': [_canonical(p) for p in parts],
+        'params': _canonical(params)
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class NestingCache:
+    """LRU-кэш результатов раскроя с TTL и необязательным дисковым уровнем"""
+
+    def __init__(self, max_entries: int = 128, ttl_seconds: float = 3600,
+                 disk_dir: Optional[str] = None, max_disk_entries: int = 1000):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max_disk_entries
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expired': 0
+        }
+
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            logger.info(f"[CACHE] Дисковый кэш раскроя: {self.disk_dir}")
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Получить значение по ключу
+
+        Возвращаемый объект общий для всех вызывающих - его нельзя изменять.
+        """
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    self._stats['memory_hits'] += 1
+                    return value
+                del self._entries[key]
+                self._stats['expired'] += 1
+
+        value = self._disk_get(key, now)
+
+        with self._lock:
+            if value is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['hits'] += 1
+            self._stats['disk_hits'] += 1
+            self._memory_put(key, value, now)
+
+        return value
+
+    def put(self, key: str, value: Any):
+        """Сохранить значение в кэш"""
+        now = time.time()
+
+        with self._lock:
+            self._memory_put(key, value, now)
+
+        self._disk_put(key, value, now)
+
+    def clear(self):
+        """Очистить оба уровня кэша"""
+        with self._lock:
+            self._entries.clear()
+
+        if self.disk_dir:
+            for path in self.disk_dir.glob('*.json'):
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+        logger.info("[CACHE] Кэш раскроя очищен")
+
+    def stats(self) -> Dict:
+        """Статистика попаданий и промахов"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate_percent'] = round(stats['hits'] / lookups * 100, 2) if lookups else 0
+        stats['max_entries'] = self.max_entries
+        stats['ttl_seconds'] = self.ttl_seconds
+        stats['disk_enabled'] = self.disk_dir is not None
+
+        return stats
+
+    def _memory_put(self, key: str, value: Any, now: float):
+        """Запись в память (вызывается под блокировкой)"""
+        self._entries[key] = (now + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / f'{key}.json'
+
+    def _disk_get(self, key: str, now: float) -> Optional[Any]:
+        if not self.disk_dir:
+            return None
+
+        path = self._disk_path(key)
+        if not path.exists():
+            return None
+
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"[CACHE] Не удалось прочитать {path.name}: {e}")
+            return None
+
+        if entry.get('created', 0) + self.ttl_seconds <= now:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            with self._lock:
+                self._stats['expired'] += 1
+            return None
+
+        return entry.get('value')
+
+    def _disk_put(self, key: str, value: Any, now: float):
+        if not self.disk_dir:
+            return
+
+        path = self._disk_path(key)
+        tmp_path = path.with_suffix('.tmp')
+
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'created': now, 'value': value}, f, ensure_ascii=False)
+            tmp_path.replace(path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"[CACHE] Не удалось записать {path.name}: {e}")
+            return
+
+        self._disk_prune()
+
+    def _disk_prune(self):
+        """Удаляет самые старые файлы при превышении лимита"""
+        files = list(self.disk_dir.glob('*.json'))
+        if len(files) <= self.max_disk_entries:
+            return
+
+        files.sort(key=lambda p: p.stat().st_mtime)
+        for path in files[:len(files) - self.max_disk_entries]:
+            try:
+                path.unlink()
+                with self._lock:
+                    self._stats['evictions'] += 1
+            except OSError:
+                pass
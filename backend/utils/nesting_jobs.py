@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Очередь асинхронных заданий раскроя
+
+Задания выполняются в ограниченном пуле потоков. Отмена передается
+через threading.Event, который optimize_nesting проверяет в цикле упаковки.
+Задания, статус которых давно никто не запрашивал и на прогресс которых
+никто не подписан (закрыта вкладка браузера), отменяются автоматически.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from utils.progress import progress_broker
+
+logger = logging.getLogger(__name__)
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_CANCELLED = 'cancelled'
+
+FINISHED_STATUSES = (STATUS_DONE, STATUS_FAILED, STATUS_CANCELLED)
+
+
+class JobQueueFull(Exception):
+    """Очередь заданий заполнена"""
+
+
+class NestingJob:
+    """Одно задание раскроя"""
+
+    def __init__(self, job_id: str, progress_id: Optional[str] = None):
+        self.id = job_id
+        self.progress_id = progress_id
+        self.status = STATUS_QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.last_polled = self.created_at
+        self.result = None
+        self.error = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def to_dict(self) -> Dict:
+        """Статус задания для API (без результата)"""
+        now = time.time()
+        started = self.started_at or now
+        finished = self.finished_at or now
+
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'wait_seconds': round(started - self.created_at, 3),
+            'run_seconds': round(finished - started, 3) if self.started_at else 0,
+            'error': self.error
+        }
+
+
+class NestingJobManager:
+    """Ограниченный пул заданий с лимитом глубины очереди"""
+
+    def __init__(self, max_workers: int = 2, max_queue: int = 8,
+                 retention_seconds: float = 3600, abandon_after: Optional[float] = 120):
+        """
+        Args:
+            max_workers: число одновременно выполняемых заданий
+            max_queue: максимум заданий, ожидающих в очереди
+            retention_seconds: сколько хранить завершенные задания
+            abandon_after: через сколько секунд без опроса статуса отменять задание
+                           (None - не отменять); подписка на поток прогресса
+                           задания (progress_id) считается опросом
+        """
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retention_seconds = retention_seconds
+        self.abandon_after = abandon_after
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='nesting-job')
+        self._jobs = {}  # job_id -> NestingJob
+        self._lock = threading.Lock()
+
+        if abandon_after:
+            watchdog = threading.Thread(target=self._watchdog, name='nesting-job-watchdog', daemon=True)
+            watchdog.start()
+
+    def submit(self, func: Callable, *args, **kwargs) -> NestingJob:
+        """
+        Поставить задание в очередь
+
+        func вызывается как func(*args, cancel_event=event, **kwargs) и должна
+        вернуть результат раскроя (dict).
+
+        Raises:
+            JobQueueFull: если в очереди уже max_queue ожидающих заданий
+        """
+        with self._lock:
+            self._purge_finished()
+
+            queued = sum(1 for j in self._jobs.values() if j.status == STATUS_QUEUED)
+            if queued >= self.max_queue:
+                raise JobQueueFull(f'Очередь заданий заполнена ({queued} в ожидании)')
+
+            job = NestingJob(uuid.uuid4().hex, kwargs.get('progress_id'))
+            self._jobs[job.id] = job
+
+        self._executor.submit(self._run, job, func, args, kwargs)
+        logger.info(f"[JOBS] Задание {job.id} поставлено в очередь")
+
+        return job
+
+    def get(self, job_id: str, touch: bool = True) -> Optional[NestingJob]:
+        """Получить задание (touch - отметить опрос клиентом)"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None and touch:
+            job.last_polled = time.time()
+        return job
+
+    def cancel(self, job_id: str) -> Optional[NestingJob]:
+        """Отменить задание. Возвращает задание или None, если не найдено"""
+        job = self.get(job_id, touch=False)
+        if job is None:
+            return None
+
+        with self._lock:
+            if job.finished:
+                return job
+            job.cancel_event.set()
+            if job.status == STATUS_QUEUED:
+                # Еще не запущено - _run увидит флаг и не станет считать
+                self._finish(job, STATUS_CANCELLED)
+
+        logger.info(f"[JOBS] Задание {job_id} отменено")
+        return job
+
+    def stats(self) -> Dict:
+        """Счетчики заданий по статусам"""
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+
+        return {
+            'max_workers': self.max_workers,
+            'max_queue': self.max_queue,
+            'jobs': counts
+        }
+
+    def _run(self, job: NestingJob, func: Callable, args, kwargs):
+        with self._lock:
+            if job.cancel_event.is_set():
+                return
+            job.status = STATUS_RUNNING
+            job.started_at = time.time()
+
+        logger.info(f"[JOBS] Задание {job.id} запущено")
+
+        try:
+            result = func(*args, cancel_event=job.cancel_event, **kwargs)
+        except Exception as e:
+            logger.error(f"[JOBS] Ошибка задания {job.id}: {e}", exc_info=True)
+            with self._lock:
+                job.error = str(e)
+                self._finish(job, STATUS_FAILED)
+            return
+
+        with self._lock:
+            if job.cancel_event.is_set() or (result or {}).get('cancelled'):
+                self._finish(job, STATUS_CANCELLED)
+            elif not (result or {}).get('success'):
+                job.error = (result or {}).get('error', 'Unknown error')
+                self._finish(job, STATUS_FAILED)
+            else:
+                job.result = result
+                self._finish(job, STATUS_DONE)
+
+        logger.info(f"[JOBS] Задание {job.id} завершено: {job.status}")
+
+    def _finish(self, job: NestingJob, status: str):
+        """Перевести задание в конечный статус (вызывается под блокировкой)"""
+        job.status = status
+        job.finished_at = time.time()
+
+    def _purge_finished(self):
+        """Удалить старые завершенные задания (вызывается под блокировкой)"""
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and now - job.finished_at > self.retention_seconds
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _watchdog(self):
+        """Отменяет задания, которые клиент перестал опрашивать"""
+        interval = max(1.0, self.abandon_after / 4)
+
+        while True:
+            time.sleep(interval)
+            now = time.time()
+
+            with self._lock:
+                active = [job for job in self._jobs.values() if not job.finished]
+
+            abandoned = []
+            for job in active:
+                # Клиент следит за заданием через SSE и статус не опрашивает
+                if progress_broker.has_subscribers(job.progress_id):
+                    job.last_polled = now
+                elif now - job.last_polled > self.abandon_after:
+                    abandoned.append(job)
+
+            for job in abandoned:
+                logger.warning(f"[JOBS] Задание {job.id} не опрашивалось {self.abandon_after} с, отменяю")
+                self.cancel(job.id)
@@ -0,0 +1,580 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Валидация раскроя - проверка координат и размещения деталей
+
+Проверки листа (выход за границы, некорректные размеры, пересечения,
+слишком малый зазор) зависят только от его раскроя, поэтому для
+одинаковых листов (utils.sheet_patterns) выполняются один раз,
+а сообщения формируются для каждого листа.
+
+Пары деталей для проверки пересечений и зазоров берутся из равномерной
+сетки (SheetValidator): деталь регистрируется в ячейках своего габарита,
+расширенного на MIN_GAP_MM, и проверяется только с соседями по ячейкам -
+вместо O(n²) получается примерно O(n + k). Сетка пополняется по одной
+детали, поэтому optimize_nesting проверяет лист по мере сборки
+и прикладывает отчет (validation_report) к результату.
+
+Крупные листы (от VECTOR_MIN_PARTS деталей) проверяются векторно
+в NumPy: детали сортируются по x, и блок строк сравнивается только
+с окном столбцов, где возможны пересечения и малые зазоры; размер
+блока ограничен MAX_BLOCK_ELEMENTS. Разные раскрои запроса с большим
+числом деталей проверяются параллельно в общем пуле процессов.
+"""
+
+import logging
+import math
+import os
+from typing import Dict, Iterable, List, Optional
+
+from utils.process_pool import map_in_pool
+from utils.sheet_patterns import group_sheets, signature_key
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Минимальный зазор между деталями, мм
+MIN_GAP_MM = 5.0
+# Деталь, занимающая больше ячеек сетки, проверяется со всеми
+MAX_CELLS_PER_PART = 256
+# Лист с таким числом деталей проверяется векторно
+VECTOR_MIN_PARTS = 64
+# Строк в блоке (чем уже блок по x, тем уже окно столбцов) и предел
+# элементов матриц пар в одном блоке (память ~ 30 байт на элемент)
+BLOCK_ROWS = 64
+MAX_BLOCK_ELEMENTS = 1 << 21
+# Параллельная проверка: от POOL_MIN_PATTERNS раскроев и POOL_MIN_PARTS деталей в них
+POOL_MIN_PATTERNS = 2
+POOL_MIN_PARTS = 20000
+# Поля размещения, нужные проверке (передаются в процессы)
+_CHECKED_FIELDS = ('name', 'x', 'y', 'width', 'height', 'inside', 'nest_id')
+
+
+def grid_cell(sides: List[float]) -> float:
+    """Ячейка сетки SheetValidator: медиана больших сторон деталей + MIN_GAP_MM"""
+    sides = sorted(side for side in sides if side > 0 and math.isfinite(side))
+    return (sides[len(sides) // 2] if sides else 0.0) + MIN_GAP_MM
+
+
+class SheetValidator:
+    """
+    Проверка листа по мере раскладки: размещения добавляются по одному
+    (add), каждое проверяется только с соседями по сетке
+
+    Деталь регистрируется в ячейках своего габарита, расширенного
+    на MIN_GAP_MM. Деталь, занимающая больше MAX_CELLS_PER_PART ячеек,
+    с неположительными размерами или нечисловыми координатами
+    проверяется со всеми. Результат issues() совпадает с проверкой
+    всех пар листа.
+    """
+
+    def __init__(self, sheet_width: float, sheet_height: float, cell: float):
+        self.sheet_width = sheet_width
+        self.sheet_height = sheet_height
+        self.cell = cell
+        self.boxes = []  # (имя, x, y, x2, y2, ширина, высота)
+        self.nests = []  # (inside, nest_id)
+        self._grid = {}
+        self._oversized = []
+        self._intersections = []  # по детали: индексы пересекающих
+        self._gaps = []  # по детали: (индекс, расстояние)
+
+    def _cells(self, box: tuple) -> Optional[List[tuple]]:
+        _, x, y, x2, y2, width, height = box
+        if not (width > 0 and height > 0 and math.isfinite(x) and math.isfinite(y)
+                and math.isfinite(x2) and math.isfinite(y2)):
+            return None
+        cx1, cy1 = math.floor((x - MIN_GAP_MM) / self.cell), math.floor((y - MIN_GAP_MM) / self.cell)
+        cx2, cy2 = math.floor((x2 + MIN_GAP_MM) / self.cell), math.floor((y2 + MIN_GAP_MM) / self.cell)
+        if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) > MAX_CELLS_PER_PART:
+            return None
+        return [(cx, cy) for cx in range(cx1, cx2 + 1) for cy in range(cy1, cy2 + 1)]
+
+    def add(self, part: Dict) -> List[int]:
+        """
+        Добавляет размещение на лист
+
+        Returns:
+            индексы ранее добавленных деталей, с которыми оно пересекается
+        """
+        i = len(self.boxes)
+        x = float(part.get('x', 0))
+        y = float(part.get('y', 0))
+        width = float(part.get('width', 0))
+        height = float(part.get('height', 0))
+        box = (part.get('name', f'Деталь {i+1}'), x, y, x + width, y + height, width, height)
+        # Деталь в вырезе другой детали (utils.part_in_part) - ее габарит
+        # лежит внутри габарита основной детали, это не пересечение
+        inside, nest_id = part.get('inside'), part.get('nest_id')
+        self.boxes.append(box)
+        self.nests.append((inside, nest_id))
+        self._intersections.append([])
+        self._gaps.append([])
+
+        cells = self._cells(box)
+        if cells is None:
+            candidates = range(i)
+            self._oversized.append(i)
+        else:
+            candidates = set(self._oversized)
+            for key in cells:
+                bucket = self._grid.setdefault(key, [])
+                candidates.update(bucket)
+                bucket.append(i)
+
+        _, x, y, x2, y2, _, _ = box
+        overlapping = []
+        for j in candidates:
+            other_inside, other_nest_id = self.nests[j]
+            if (inside is not None and inside == other_nest_id) or \
+                    (other_inside is not None and other_inside == nest_id):
+                continue
+            _, other_x, other_y, other_x2, other_y2, _, _ = self.boxes[j]
+
+            # Два прямоугольника НЕ пересекаются, если один полностью
+            # слева/справа или сверху/снизу от другого
+            if not (x2 <= other_x or other_x2 <= x or y2 <= other_y or other_y2 <= y):
+                self._intersections[i].append(j)
+                self._intersections[j].append(i)
+                overlapping.append(j)
+            else:
+                # Слишком близкое расположение
+                dx = max(0, max(x - other_x2, other_x - x2))
+                dy = max(0, max(y - other_y2, other_y - y2))
+                min_distance = max(dx, dy)
+
+                if min_distance < MIN_GAP_MM and min_distance > 0:
+                    self._gaps[i].append((j, min_distance))
+                    self._gaps[j].append((i, min_distance))
+        return sorted(overlapping)
+
+    def issues(self) -> List[tuple]:
+        """
+        Проблемы листа (без номера листа)
+
+        Returns:
+            [(вид, данные...)] в порядке деталей: границы, размеры,
+            пересечения и малые зазоры по возрастанию индекса второй детали
+        """
+        issues = []
+        for i, (name, x, y, x2, y2, width, height) in enumerate(self.boxes):
+            # Проверка 1: Выход за границы листа
+            if x < 0 or y < 0:
+                issues.append(('negative_coords', name, x, y))
+
+            if x2 > self.sheet_width or y2 > self.sheet_height:
+                issues.append(('out_of_bounds', name, x, y, x2, y2))
+
+            # Проверка 2: Некорректные размеры
+            if width <= 0 or height <= 0:
+                issues.append(('invalid_size', name, width, height))
+
+            # Проверка 3: Пересечения с другими деталями на этом листе
+            for j in sorted(self._intersections[i]):
+                other = self.boxes[j]
+                issues.append(('intersection', name, other[0], (x, y, x2, y2), other[1:5]))
+
+            # Проверка 4: Слишком близкое расположение
+            for j, min_distance in sorted(self._gaps[i], key=lambda gap: gap[0]):
+                issues.append(('gap', name, self.boxes[j][0], min_distance))
+        return issues
+
+
+def _sheet_issues_vectorized(parts: List[Dict], sheet_width: float, sheet_height: float) -> Optional[List[tuple]]:
+    """
+    Проблемы раскроя листа в NumPy - те же, что и у SheetValidator, в том же порядке
+
+    Returns:
+        список проблем или None - есть нечисловые координаты (NaN/inf),
+        проверяется поэлементно
+    """
+    boxes = []
+    nests = []
+    for i, part in enumerate(parts):
+        x = float(part.get('x', 0))
+        y = float(part.get('y', 0))
+        width = float(part.get('width', 0))
+        height = float(part.get('height', 0))
+        boxes.append((part.get('name', f'Деталь {i+1}'), x, y, x + width, y + height, width, height))
+        nests.append((part.get('inside'), part.get('nest_id')))
+
+    n = len(boxes)
+    coords = np.array([box[1:] for box in boxes], dtype=np.float64).reshape(n, 6)
+    if not np.isfinite(coords).all():
+        return None
+    x, y, x2, y2, width, height = coords.T
+
+    # Вложенные детали: inside/nest_id -> номера (-1 - нет)
+    ids = {}
+    inside = np.array([-1 if a is None else ids.setdefault(a, len(ids)) for a, _ in nests], dtype=np.int64)
+    nest_id = np.array([-1 if b is None else ids.setdefault(b, len(ids)) for _, b in nests], dtype=np.int64)
+
+    negative = (x < 0) | (y < 0)
+    outside = (x2 > sheet_width) | (y2 > sheet_height)
+    invalid = (width <= 0) | (height <= 0)
+
+    # Деталь j может пересечь деталь i или стоять ближе MIN_GAP_MM, только если
+    # x_j в [x_i - max(width) - MIN_GAP_MM, x2_i + MIN_GAP_MM]; при неположительных
+    # размерах окно не сужается
+    order = np.argsort(x, kind='stable')
+    sorted_x = x[order]
+    windowed = bool(width.min() > 0 and height.min() > 0)
+    reach = float(width.max()) + MIN_GAP_MM
+
+    hits = {'intersection': [], 'gap': []}
+    rows = max(1, min(BLOCK_ROWS, MAX_BLOCK_ELEMENTS // n))
+    for start in range(0, n, rows):
+        block = order[start:start + rows]
+        if windowed:
+            lo = int(np.searchsorted(sorted_x, sorted_x[start] - reach, side='left'))
+            hi = int(np.searchsorted(sorted_x, float(x2[block].max()) + MIN_GAP_MM, side='right'))
+        else:
+            lo, hi = 0, n
+        cols = order[lo:hi]
+
+        bx, by, bx2, by2 = (a[block, None] for a in (x, y, x2, y2))
+        ox, oy, ox2, oy2 = (a[None, cols] for a in (x, y, x2, y2))
+        apart = (bx2 <= ox) | (ox2 <= bx) | (by2 <= oy) | (oy2 <= by)
+        distance = np.maximum(np.maximum(np.maximum(bx - ox2, ox - bx2), 0),
+                              np.maximum(np.maximum(by - oy2, oy - by2), 0))
+        skip = block[:, None] == cols[None, :]
+        block_inside, block_nest = inside[block, None], nest_id[block, None]
+        skip |= (block_inside >= 0) & (block_inside == nest_id[None, cols])
+        skip |= (inside[None, cols] >= 0) & (inside[None, cols] == block_nest)
+
+        for kind, mask in (('intersection', ~apart & ~skip),
+                           ('gap', apart & ~skip & (distance > 0) & (distance < MIN_GAP_MM))):
+            r, c = np.nonzero(mask)
+            if len(r):
+                hits[kind].append((block[r], cols[c], distance[r, c]))
+
+    # Пары по детали i в порядке возрастания j
+    found = {}
+    for kind, chunks in hits.items():
+        if not chunks:
+            found[kind] = {}
+            continue
+        i, j, d = (np.concatenate(parts) for parts in zip(*chunks))
+        by_pair = np.lexsort((j, i))
+        pairs = {}
+        for a, b, value in zip(i[by_pair].tolist(), j[by_pair].tolist(), d[by_pair].tolist()):
+            pairs.setdefault(a, []).append((b, value))
+        found[kind] = pairs
+
+    flagged = set(np.nonzero(negative | outside | invalid)[0].tolist())
+    flagged.update(found['intersection'], found['gap'])
+
+    issues = []
+    for i in sorted(flagged):
+        name, bx, by, bx2, by2, bw, bh = boxes[i]
+        if negative[i]:
+            issues.append(('negative_coords', name, bx, by))
+        if outside[i]:
+            issues.append(('out_of_bounds', name, bx, by, bx2, by2))
+        if invalid[i]:
+            issues.append(('invalid_size', name, bw, bh))
+        for j, _ in found['intersection'].get(i, ()):
+            other = boxes[j]
+            issues.append(('intersection', name, other[0], (bx, by, bx2, by2), other[1:5]))
+        for j, distance in found['gap'].get(i, ()):
+            issues.append(('gap', name, boxes[j][0], distance))
+    return issues
+
+
+def _sheet_issues(parts: List[Dict], sheet_width: float, sheet_height: float) -> List[tuple]:
+    """
+    Проблемы раскроя одного листа (без номера листа)
+
+    Returns:
+        [(вид, данные...)] в порядке проверки деталей
+    """
+    if NUMPY_AVAILABLE and len(parts) >= VECTOR_MIN_PARTS:
+        issues = _sheet_issues_vectorized(parts, sheet_width, sheet_height)
+        if issues is not None:
+            return issues
+
+    cell = grid_cell([max(float(p.get('width', 0)), float(p.get('height', 0))) for p in parts])
+    validator = SheetValidator(sheet_width, sheet_height, cell)
+    for part in parts:
+        validator.add(part)
+    return validator.issues()
+
+
+def _pattern_issues(task: tuple) -> List[tuple]:
+    """_sheet_issues для процесса: (детали, ширина листа, высота листа)"""
+    return _sheet_issues(*task)
+
+
+def _patterns_issues(patterns: List[List[Dict]], sheet_width: float, sheet_height: float) -> List[List[tuple]]:
+    """Проблемы раскроев: параллельно в процессах, если раскроев и деталей много"""
+    if len(patterns) >= POOL_MIN_PATTERNS and sum(map(len, patterns)) >= POOL_MIN_PARTS:
+        tasks = [([{key: part[key] for key in _CHECKED_FIELDS if key in part} for part in parts],
+                  sheet_width, sheet_height) for parts in patterns]
+        if (os.cpu_count() or 1) > 1:
+            results = map_in_pool(_pattern_issues, tasks)
+            if results is not None:
+                return results
+            logger.warning("[VALIDATE] Параллельная проверка недоступна, проверяю последовательно")
+    return [_sheet_issues(parts, sheet_width, sheet_height) for parts in patterns]
+
+
+def validate_sheets(sheets: List[Dict], sheet_width: float = 2500, sheet_height: float = 1250) -> Dict:
+    """
+    Валидация листов раскроя
+
+    Args:
+        sheets: листы результата раскроя
+        sheet_width, sheet_height: размер листа
+
+    Returns:
+        {
+            'valid': bool,
+            'errors': [...],
+            'warnings': [...],
+            'details': {
+                'total_parts': int,
+                'total_sheets': int,
+                'intersections': [...],
+                'out_of_bounds': [...],
+                'overlaps': [...],
+                'errors_count': int,
+                'warnings_count': int
+            }
+        }
+    """
+    logger.info(f"[VALIDATE] Валидация раскроя: {len(sheets)} листов, размер {sheet_width}x{sheet_height}")
+
+    # Проблемы вычисляются один раз на раскрой; порядок деталей важен для сообщений
+    groups = group_sheets(sheets, ordered=True, precision=None)
+    patterns = [sheets[indices[0]].get('parts', []) for indices in groups]
+    sheet_issues = [None] * len(sheets)
+    for indices, issues in zip(groups, _patterns_issues(patterns, sheet_width, sheet_height)):
+        for idx in indices:
+            sheet_issues[idx] = issues
+
+    return validation_report(sheets, sheet_issues, sheet_width, sheet_height)
+
+
+def validation_report(sheets: List[Dict], sheet_issues: List[List[tuple]],
+                      sheet_width: float, sheet_height: float) -> Dict:
+    """
+    Отчет validate_sheets по готовым проблемам листов
+
+    Args:
+        sheets: листы результата раскроя
+        sheet_issues: проблемы каждого листа (SheetValidator.issues)
+        sheet_width, sheet_height: размер листа
+    """
+    entries = ((sheet.get('sheet_number', 0), len(sheet.get('parts', [])), issues)
+               for sheet, issues in zip(sheets, sheet_issues))
+    return _report(entries, sheet_width, sheet_height)
+
+
+def validate_sheet_stream(sheets: Iterable[Dict], sheet_width: float = 2500, sheet_height: float = 1250) -> Dict:
+    """
+    validate_sheets для листов, читаемых по одному (utils.json_stream)
+
+    Листы не держатся в памяти: проблемы запоминаются на раскрой (ключ
+    упорядоченной сигнатуры), лист компактного результата (без 'parts')
+    получает проблемы раскроя первого листа с тем же 'pattern_id'.
+    """
+    logger.info(f"[VALIDATE] Потоковая валидация раскроя, размер листа {sheet_width}x{sheet_height}")
+
+    def entries():
+        by_key = {}
+        by_pattern = {}
+        for sheet in sheets:
+            pattern_id = sheet.get('pattern_id')
+            if 'parts' not in sheet and pattern_id in by_pattern:
+                checked = by_pattern[pattern_id]
+            else:
+                parts = sheet.get('parts', [])
+                key = signature_key(sheet, ordered=True, precision=None)
+                checked = by_key.get(key)
+                if checked is None:
+                    checked = by_key[key] = (len(parts), _sheet_issues(parts, sheet_width, sheet_height))
+                if pattern_id is not None:
+                    by_pattern.setdefault(pattern_id, checked)
+            yield (sheet.get('sheet_number', 0),) + checked
+
+    return _report(entries(), sheet_width, sheet_height)
+
+
+def _report(entries: Iterable[tuple], sheet_width: float, sheet_height: float) -> Dict:
+    """Отчет валидации: entries - (номер листа, число деталей, проблемы листа)"""
+    errors = []
+    warnings = []
+    intersections = []
+    out_of_bounds = []
+    overlaps = []
+    total_parts = 0
+    total_sheets = 0
+
+    # Пересечение каждой пары деталей учитывается в деталях один раз
+    intersected_pairs = set()
+
+    for sheet_num, parts_count, issues in entries:
+        total_sheets += 1
+        total_parts += parts_count
+
+        logger.info(f"[VALIDATE] Лист {sheet_num}: {parts_count} деталей")
+
+        for issue in issues:
+            kind = issue[0]
+
+            if kind == 'negative_coords':
+                _, name, x, y = issue
+                error_msg = f"Лист {sheet_num}, {name}: координаты отрицательные (x={x:.1f}, y={y:.1f})"
+                errors.append(error_msg)
+                out_of_bounds.append({
+                    'sheet': sheet_num,
+                    'part': name,
+                    'issue': 'negative_coords',
+                    'x': x,
+                    'y': y
+                })
+                logger.warning(f"[VALIDATE] {error_msg}")
+
+            elif kind == 'out_of_bounds':
+                _, name, x, y, x2, y2 = issue
+                error_msg = f"Лист {sheet_num}, {name}: деталь выходит за границы листа (x2={x2:.1f} > {sheet_width} или y2={y2:.1f} > {sheet_height})"
+                errors.append(error_msg)
+                out_of_bounds.append({
+                    'sheet': sheet_num,
+                    'part': name,
+                    'issue': 'out_of_bounds',
+                    'x': x,
+                    'y': y,
+                    'x2': x2,
+                    'y2': y2,
+                    'sheet_width': sheet_width,
+                    'sheet_height': sheet_height
+                })
+                logger.warning(f"[VALIDATE] {error_msg}")
+
+            elif kind == 'invalid_size':
+                _, name, width, height = issue
+                error_msg = f"Лист {sheet_num}, {name}: некорректные размеры (width={width:.1f}, height={height:.1f})"
+                errors.append(error_msg)
+                logger.warning(f"[VALIDATE] {error_msg}")
+
+            elif kind == 'intersection':
+                _, name, other_name, (x, y, x2, y2), (other_x, other_y, other_x2, other_y2) = issue
+                intersection_x_min = max(x, other_x)
+                intersection_x_max = min(x2, other_x2)
+                intersection_y_min = max(y, other_y)
+                intersection_y_max = min(y2, other_y2)
+
+                intersection_width = intersection_x_max - intersection_x_min
+                intersection_height = intersection_y_max - intersection_y_min
+                intersection_area = intersection_width * intersection_height
+
+                error_msg = f"Лист {sheet_num}: ПЕРЕСЕЧЕНИЕ '{name}' и '{other_name}' - площадь пересечения: {intersection_area:.1f} мм² ({intersection_width:.1f}×{intersection_height:.1f} мм)"
+                errors.append(error_msg)
+
+                pair = frozenset((name, other_name))
+                if pair not in intersected_pairs:
+                    intersected_pairs.add(pair)
+                    intersections.append({
+                        'sheet': sheet_num,
+                        'part1': name,
+                        'part2': other_name,
+                        'part1_coords': {'x': x, 'y': y, 'x2': x2, 'y2': y2},
+                        'part2_coords': {'x': other_x, 'y': other_y, 'x2': other_x2, 'y2': other_y2},
+                        'intersection_area_mm2': intersection_area,
+                        'intersection_width': intersection_width,
+                        'intersection_height': intersection_height,
+                        'intersection_coords': {
+                            'x': intersection_x_min,
+                            'y': intersection_y_min,
+                            'x2': intersection_x_max,
+                            'y2': intersection_y_max
+                        }
+                    })
+                logger.warning(f"[VALIDATE] {error_msg}")
+
+            else:
+                _, name, other_name, min_distance = issue
+                warning_msg = f"Лист {sheet_num}: {name} и {other_name} слишком близко (расстояние: {min_distance:.1f} мм < 5 мм)"
+                warnings.append(warning_msg)
+                overlaps.append({
+                    'sheet': sheet_num,
+                    'part1': name,
+                    'part2': other_name,
+                    'distance_mm': min_distance
+                })
+                logger.info(f"[VALIDATE] {warning_msg}")
+
+    is_valid = len(errors) == 0
+
+    if is_valid:
+        logger.info(f"[VALIDATE] ✓ Раскрой валиден: {total_parts} деталей на {total_sheets} листах")
+    else:
+        logger.warning(f"[VALIDATE] ✗ Раскрой содержит ошибки: {len(errors)} ошибок, {len(warnings)} предупреждений")
+
+    return {
+        'valid': is_valid,
+        'errors': errors,
+        'warnings': warnings,
+        'details': {
+            'total_parts': total_parts,
+            'total_sheets': total_sheets,
+            'intersections': intersections,
+            'out_of_bounds': out_of_bounds,
+            'overlaps': overlaps,
+            'errors_count': len(errors),
+            'warnings_count': len(warnings)
+        }
+    }
+
+
+def refresh_validation(result: Dict) -> Dict:
+    """Пересчитывает отчет result['validation'] после изменения размещений (перекладка, вложение деталей)"""
+    result['validation'] = validate_sheets(result.get('sheets', []), result.get('sheet_width', 2500),
+                                           result.get('sheet_height', 1250))
+    return result
+
+
+# Причины, по которым деталь не размещена
+UNPLACED_REASONS = {
+    'too_large': 'не помещается на лист',
+    'sheet_limit': 'достигнут лимит листов',
+}
+
+
+def report_unplaced(result: Dict, unplaced: List[Dict]) -> Dict:
+    """
+    Неразмещенные детали: result['unplaced'] и ошибки в отчете валидации
+
+    Args:
+        unplaced: [{'name', 'position_number', 'quantity', 'reason'}],
+                  reason - ключ UNPLACED_REASONS
+
+    Без отчета в результате (раскрой по контуру: габариты деталей
+    пересекаются законно) он собирается по листам без проверки размещений -
+    и при полностью размещенном заказе, чтобы отчет был у любого результата.
+    """
+    result['unplaced'] = unplaced
+    validation = result.get('validation')
+    if validation is None:
+        validation = result['validation'] = _report(
+            ((s.get('sheet_number', 0), len(s.get('parts', [])), []) for s in result.get('sheets', [])),
+            result.get('sheet_width', 2500), result.get('sheet_height', 1250))
+    if not unplaced:
+        return result
+
+    for item in unplaced:
+        reason = UNPLACED_REASONS.get(item.get('reason'), item.get('reason'))
+        validation['errors'].append(f"Не размещено: {item['name']} × {item['quantity']} - {reason}")
+    validation['valid'] = False
+    validation['details']['unplaced'] = unplaced
+    validation['details']['errors_count'] = len(validation['errors'])
+
+    logger.warning(f"[VALIDATE] Не размещено деталей: {sum(item['quantity'] for item in unplaced)}")
+    return result
+
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Постоянный кэш no-fit polygon (SQLite)
+
+Построение NFP - основная стоимость раскроя по контуру, а библиотека деталей
+меняется редко: одни и те же пары деталей встречаются в заказ за заказом.
+
+Ключ - хеши геометрии двух деталей, относительный поворот и зазор.
+NFP для поворотов (rA, rB) получается из сохраненного NFP(A, B повернута
+на rB - rA) поворотом на rA и сдвигом (см. shape_nesting._orient_nfp),
+поэтому в кэше хранится одна запись на пару и относительный угол.
+
+Уровни: LRU в памяти процесса + таблица SQLite (вытеснение по last_used).
+Таблица parts считает, как часто деталь попадает в раскрой - по ней
+команда warmup заранее строит NFP для самых частых деталей:
+
+    python -m utils.nfp_cache warmup --top 50
+    python -m utils.nfp_cache stats
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = 'nfp_cache.db'
+
+
+def make_nfp_key(hash_a: str, hash_b: str, relative_rotation: float, gap: float) -> str:
+    """Ключ NFP пары деталей"""
+    return f'{hash_a}:{hash_b}:{round(relative_rotation % 360, 6):g}:{round(float(gap), 6):g}'
+
+
+class NfpCache:
+    """LRU в памяти + SQLite"""
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, max_memory_entries: int = 5000,
+                 max_disk_entries: int = 200000):
+        self.db_path = Path(db_path)
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # Запись на диск пачками: новые NFP и отметки last_used до flush()
+        self._pending = {}
+        self._touched = set()
+        self.flush_every = 200
+
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # Файл базы создается при первом обращении, а не при импорте приложения
+        self._schema_ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        """Соединение текущего потока (открывается один раз)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            if not self._schema_ready:
+                self._init_db(conn)
+                self._schema_ready = True
+        return conn
+
+    def _init_db(self, conn: sqlite3.Connection):
+        """Инициализация базы данных"""
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS nfp (
+                key TEXT PRIMARY KEY,
+                pieces TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER DEFAULT 0
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_nfp_last_used ON nfp (last_used)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS parts (
+                geometry_hash TEXT PRIMARY KEY,
+                geometry TEXT NOT NULL,
+                orders INTEGER DEFAULT 0,
+                quantity INTEGER DEFAULT 0,
+                last_used REAL NOT NULL
+            )
+        ''')
+
+        conn.commit()
+
+    # ------------------------------------------------------------------
+    # NFP
+    # ------------------------------------------------------------------
+
+    def _remember(self, key: str, pieces: List):
+        with self._lock:
+            self._memory[key] = pieces
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, key: str) -> Optional[List]:
+        """NFP по ключу или None"""
+        with self._lock:
+            pieces = self._memory.get(key)
+            if pieces is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return pieces
+            raw = self._pending.get(key)
+
+        if raw is None:
+            row = self._connect().execute('SELECT pieces FROM nfp WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                with self._lock:
+                    self.misses += 1
+                return None
+            raw = row[0]
+
+        pieces = [[tuple(p) for p in piece] for piece in json.loads(raw)]
+        self._remember(key, pieces)
+        with self._lock:
+            self.hits += 1
+            self.disk_hits += 1
+            self._touched.add(key)
+        return pieces
+
+    def put(self, key: str, pieces: List):
+        """Сохранить NFP"""
+        self._remember(key, pieces)
+
+        raw = json.dumps([[list(p) for p in piece] for piece in pieces], separators=(',', ':'))
+        with self._lock:
+            self._pending[key] = raw
+            full = len(self._pending) >= self.flush_every
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Записать на диск новые NFP и отметки использования"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            touched, self._touched = self._touched, set()
+
+        if not pending and not touched:
+            return
+
+        now = time.time()
+        conn = self._connect()
+        conn.executemany(
+            'INSERT OR REPLACE INTO nfp (key, pieces, created, last_used, hits) VALUES (?, ?, ?, ?, 0)',
+            [(key, raw, now, now) for key, raw in pending.items()]
+        )
+        conn.executemany(
+            'UPDATE nfp SET last_used = ?, hits = hits + 1 WHERE key = ?',
+            [(now, key) for key in touched]
+        )
+        conn.commit()
+
+        if pending:
+            self._trim_disk(conn)
+
+    def _trim_disk(self, conn: sqlite3.Connection):
+        """Вытеснение давно не использованных NFP сверх max_disk_entries"""
+        count = conn.execute('SELECT COUNT(*) FROM nfp').fetchone()[0]
+        excess = count - self.max_disk_entries
+        if excess <= 0:
+            return
+
+        conn.execute(
+            'DELETE FROM nfp WHERE key IN (SELECT key FROM nfp ORDER BY last_used LIMIT ?)',
+            (excess,)
+        )
+        conn.commit()
+        with self._lock:
+            self.evictions += excess
+        logger.info(f"[NFP CACHE] Вытеснено с диска: {excess}")
+
+    def get_or_compute(self, hash_a: str, hash_b: str, relative_rotation: float, gap: float,
+                       compute: Callable[[], List]) -> List:
+        """NFP из кэша, иначе compute() с сохранением"""
+        key = make_nfp_key(hash_a, hash_b, relative_rotation, gap)
+        pieces = self.get(key)
+        if pieces is None:
+            pieces = compute()
+            self.put(key, pieces)
+        return pieces
+
+    # ------------------------------------------------------------------
+    # Частота деталей и прогрев
+    # ------------------------------------------------------------------
+
+    def record_usage(self, parts: Dict[str, Tuple[Dict, int]]):
+        """
+        Учесть детали раскроя
+
+        Args:
+            parts: {geometry_hash: (geometry, quantity)}
+        """
+        if not parts:
+            return
+
+        now = time.time()
+        conn = self._connect()
+        conn.executemany('''
+            INSERT INTO parts (geometry_hash, geometry, orders, quantity, last_used)
+            VALUES (?, ?, 1, ?, ?)
+            ON CONFLICT(geometry_hash) DO UPDATE SET
+                orders = orders + 1,
+                quantity = quantity + excluded.quantity,
+                last_used = excluded.last_used
+        ''', [
+            (geometry_hash, json.dumps(geometry, separators=(',', ':')), int(quantity), now)
+            for geometry_hash, (geometry, quantity) in parts.items()
+        ])
+        conn.commit()
+
+    def top_parts(self, limit: int = 50) -> List[Tuple[str, Dict]]:
+        """Самые часто заказываемые детали: [(geometry_hash, geometry)]"""
+        rows = self._connect().execute(
+            'SELECT geometry_hash, geometry FROM parts ORDER BY orders DESC, quantity DESC LIMIT ?',
+            (limit,)
+        ).fetchall()
+
+        return [(geometry_hash, json.loads(geometry)) for geometry_hash, geometry in rows]
+
+    def warmup(self, top: int = 50, rotations: Sequence[float] = (0, 90, 180, 270),
+               gap: float = 5.0) -> Dict:
+        """
+        Построить NFP для всех пар самых частых деталей
+
+        Returns:
+            {'parts', 'pairs', 'computed', 'seconds'}
+        """
+        # Построение NFP живет в shape_nesting, который сам использует этот кэш
+        from utils.shape_nesting import base_nfp
+
+        started = time.time()
+        parts = self.top_parts(top)
+        relative_rotations = sorted({float(b - a) % 360 for a in rotations for b in rotations})
+
+        pairs = 0
+        computed = 0
+        for hash_a, geometry_a in parts:
+            for hash_b, geometry_b in parts:
+                for rel in relative_rotations:
+                    pairs += 1
+                    key = make_nfp_key(hash_a, hash_b, rel, gap)
+                    if self.get(key) is not None:
+                        continue
+                    self.put(key, base_nfp(geometry_a, geometry_b, rel, gap))
+                    computed += 1
+
+        self.flush()
+        seconds = round(time.time() - started, 2)
+        logger.info(f"[NFP CACHE] Прогрев: {len(parts)} деталей, {pairs} пар, построено {computed} за {seconds} с")
+
+        return {'parts': len(parts), 'pairs': pairs, 'computed': computed, 'seconds': seconds}
+
+    # ------------------------------------------------------------------
+
+    def clear(self):
+        """Очистить кэш NFP (статистика деталей сохраняется)"""
+        with self._lock:
+            self._memory.clear()
+            self._pending.clear()
+            self._touched.clear()
+
+        conn = self._connect()
+        conn.execute('DELETE FROM nfp')
+        conn.commit()
+
+    def stats(self) -> Dict:
+        """Статистика кэша"""
+        self.flush()
+
+        conn = self._connect()
+        disk_size = conn.execute('SELECT COUNT(*) FROM nfp').fetchone()[0]
+        parts = conn.execute('SELECT COUNT(*) FROM parts').fetchone()[0]
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'memory_size': len(self._memory),
+                'disk_size': disk_size,
+                'parts_tracked': parts,
+                'max_memory_entries': self.max_memory_entries,
+                'max_disk_entries': self.max_disk_entries,
+                'hit_rate_percent': round(self.hits / lookups * 100, 2) if lookups else 0.0
+            }
+
+
+def main(argv: Optional[List[str]] = None):
+    """Командная строка: warmup / stats / clear"""
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description='Кэш no-fit polygon')
+    parser.add_argument('--db', default=os.environ.get('NFP_CACHE_DB', DEFAULT_DB_PATH),
+                        help='файл SQLite кэша')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    warm = sub.add_parser('warmup', help='построить NFP для самых частых деталей')
+    warm.add_argument('--top', type=int, default=50, help='число деталей')
+    warm.add_argument('--gap', type=float, default=5.0, help='зазор между деталями, мм')
+    warm.add_argument('--rotations', type=float, nargs='+', default=[0, 90, 180, 270],
+                      help='допустимые углы поворота')
+
+    sub.add_parser('stats', help='статистика кэша')
+    sub.add_parser('clear', help='очистить NFP')
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    cache = NfpCache(args.db)
+    if args.command == 'warmup':
+        result = cache.warmup(top=args.top, rotations=args.rotations, gap=args.gap)
+    elif args.command == 'clear':
+        cache.clear()
+        result = {'success': True}
+    else:
+        result = cache.stats()
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
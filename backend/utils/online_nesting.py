@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Потоковый (online) раскрой для непрерывной очереди производства
+
+Детали поступают по мере прихода заказов и сразу размещаются на одном
+из открытых листов (MaxRects, best short side fit - как rectpack в
+optimize_nesting). Лист закрывается и передается на резку, когда
+заполнение достигает порога, истекает время ожидания или нужен новый
+лист сверх лимита открытых. Закрытые листы хранятся до подтверждения
+(release).
+
+Свободное место листа - максимальные пустые прямоугольники
+(utils.free_rectangles), обновляются при каждом размещении, поэтому
+добавление детали стоит O(открытые листы x свободные прямоугольники).
+
+Состояние сохраняется после каждого изменения: настройки и открытые
+листы - JSON (атомарная замена файла), закрытые листы дописываются
+в журнал '<state>.closed.jsonl' (перезаписывается только при release),
+поэтому запись не растет с числом ожидающих резки листов. Свободные
+прямоугольники восстанавливаются по размещениям при загрузке. Файл
+состояния читается при первом обращении: импорт API ничего не создает
+и не читает.
+"""
+
+import json
+import logging
+import math
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from utils.free_rectangles import EPS, maximal_empty_rectangles, subtract
+
+logger = logging.getLogger(__name__)
+
+STATE_VERSION = 1
+
+DEFAULT_CONFIG = {
+    'sheet_width': 2500,
+    'sheet_height': 1250,
+    'allow_rotation': True,
+    'cut_gap': 5.0,
+    'edge_margin': 5.0,
+    'close_utilization_percent': 85.0,  # лист закрывается при таком заполнении
+    'sheet_timeout_s': 4 * 3600,        # ... или через столько секунд после открытия
+    'max_open_sheets': 3                # больше открытых - закрывается самый заполненный
+}
+
+CLOSE_UTILIZATION = 'utilization'
+CLOSE_TIMEOUT = 'timeout'
+CLOSE_CAPACITY = 'capacity'
+CLOSE_MANUAL = 'manual'
+
+_INT_SETTINGS = {'max_open_sheets'}
+_BOOL_SETTINGS = {'allow_rotation'}
+_POSITIVE_SETTINGS = {'sheet_width', 'sheet_height', 'max_open_sheets'}
+
+
+class OnlineConfigConflict(ValueError):
+    """Размер листа и зазоры нельзя менять при открытых листах"""
+
+
+def _normalize_parts(parts: List[Dict], order_number: Optional[str]) -> List[Tuple]:
+    """
+    Проверка поступивших деталей до размещения
+
+    Returns:
+        [(name, width, height, quantity, order_number)]; некорректный
+        размер остается (деталь будет отклонена как invalid_size)
+
+    Raises:
+        ValueError: не список деталей или нечисловые размеры/количество
+    """
+    if not isinstance(parts, list):
+        raise ValueError('parts must be a list')
+    items = []
+    for index, part in enumerate(parts):
+        if not isinstance(part, dict):
+            raise ValueError(f'parts[{index}] must be an object')
+        try:
+            width = float(part.get('width', 0))
+            height = float(part.get('height', 0))
+            quantity = int(part.get('quantity', 1))
+        except (TypeError, ValueError):
+            raise ValueError(f"parts[{index}]: width, height and quantity must be numbers")
+        if not (math.isfinite(width) and math.isfinite(height)):
+            width = height = 0.0
+        items.append((part.get('name', 'unknown'), width, height, max(quantity, 0),
+                      part.get('order_number') or order_number))
+    return items
+
+
+def _normalize_setting(key: str, value):
+    """Значение настройки нужного типа (ValueError для некорректного)"""
+    if key in _BOOL_SETTINGS:
+        if not isinstance(value, bool):
+            raise ValueError(f'{key} must be true or false')
+        return value
+    if isinstance(value, bool):
+        raise ValueError(f'{key} must be a number')
+    try:
+        number = int(value) if key in _INT_SETTINGS else float(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f'{key} must be a number')
+    if not math.isfinite(number) or number < 0 or (key in _POSITIVE_SETTINGS and number <= 0):
+        raise ValueError(f'{key} must be {"positive" if key in _POSITIVE_SETTINGS else "non-negative"}')
+    return number
+
+
+class _OpenSheet:
+    """Открытый лист: размещения и свободные прямоугольники рабочей области"""
+
+    __slots__ = ('sheet_number', 'opened_at', 'updated_at', 'parts', 'free', 'used_area')
+
+    def __init__(self, sheet_number: int, opened_at: float, usable_width: float, usable_height: float):
+        self.sheet_number = sheet_number
+        self.opened_at = opened_at
+        self.updated_at = opened_at
+        self.parts = []
+        self.free = [(0.0, 0.0, usable_width, usable_height)]
+        self.used_area = 0.0
+
+
+class OnlineNester:
+    """
+    Потоковый раскрой с сохранением состояния
+
+    Args:
+        state_path: файл состояния (None - только в памяти)
+        config: настройки поверх DEFAULT_CONFIG (только для нового состояния;
+                сохраненное состояние загружается со своими настройками)
+    """
+
+    def __init__(self, state_path: Optional[str] = None, config: Optional[Dict] = None):
+        self.state_path = state_path
+        self._lock = threading.RLock()
+        self.config = dict(DEFAULT_CONFIG, **(config or {}))
+        self.positions = {}
+        self.next_sheet_number = 1
+        self.open_sheets = []
+        self.closed_sheets = []
+        self._loaded = False
+
+    def _ensure_loaded(self):
+        """Загрузка сохраненного состояния при первом обращении (под блокировкой)"""
+        if self._loaded:
+            return
+        self._loaded = True
+        if self.state_path and os.path.exists(self.state_path):
+            try:
+                self._load()
+            except Exception as e:
+                logger.error(f"[ONLINE] Не удалось загрузить состояние {self.state_path}: {e}", exc_info=True)
+
+    # ---- геометрия ----
+
+    @property
+    def _usable(self) -> Tuple[float, float]:
+        c = self.config
+        return (c['sheet_width'] - 2 * c['edge_margin'] - c['cut_gap'],
+                c['sheet_height'] - 2 * c['edge_margin'] - c['cut_gap'])
+
+    def _gap_rect(self, part: Dict) -> Tuple[float, float, float, float]:
+        """Размещение детали -> занятый прямоугольник рабочей области (с зазором)"""
+        c = self.config
+        offset = c['edge_margin'] + c['cut_gap'] / 2.0
+        return (part['x'] - offset, part['y'] - offset,
+                part['width'] + c['cut_gap'], part['height'] + c['cut_gap'])
+
+    def _find_position(self, width: float, height: float):
+        """
+        Лучшее место для детали среди открытых листов (best short side fit)
+
+        Returns:
+            (лист, x, y, повернута) или None
+        """
+        gap = self.config['cut_gap']
+        variants = [(width + gap, height + gap, False)]
+        if self.config['allow_rotation'] and width != height:
+            variants.append((height + gap, width + gap, True))
+
+        best = None
+        for sheet in self.open_sheets:
+            for fx, fy, fw, fh in sheet.free:
+                for w, h, rotated in variants:
+                    if w > fw + EPS or h > fh + EPS:
+                        continue
+                    leftover_w, leftover_h = fw - w, fh - h
+                    score = (min(leftover_w, leftover_h), max(leftover_w, leftover_h))
+                    if best is None or score < best[0]:
+                        best = (score, sheet, fx, fy, rotated)
+        return best[1:] if best else None
+
+    def _fits_empty(self, width: float, height: float) -> bool:
+        usable_width, usable_height = self._usable
+        gap = self.config['cut_gap']
+        if width + gap <= usable_width + EPS and height + gap <= usable_height + EPS:
+            return True
+        return (self.config['allow_rotation'] and
+                height + gap <= usable_width + EPS and width + gap <= usable_height + EPS)
+
+    # ---- листы ----
+
+    def _open_sheet(self, now: float) -> _OpenSheet:
+        sheet = _OpenSheet(self.next_sheet_number, now, *self._usable)
+        self.next_sheet_number += 1
+        self.open_sheets.append(sheet)
+        logger.info(f"[ONLINE] Открыт лист {sheet.sheet_number}")
+        return sheet
+
+    def _sheet_dict(self, sheet: _OpenSheet) -> Dict:
+        """Лист в формате результата optimize_nesting"""
+        sheet_area = self.config['sheet_width'] * self.config['sheet_height']
+        return {
+            'sheet_number': sheet.sheet_number,
+            'parts_count': len(sheet.parts),
+            'parts': sheet.parts,
+            'used_area_m2': sheet.used_area / 1_000_000,
+            'waste_area_m2': (sheet_area - sheet.used_area) / 1_000_000,
+            'utilization_percent': round(sheet.used_area / sheet_area * 100, 2),
+            'opened_at': sheet.opened_at,
+            'updated_at': sheet.updated_at
+        }
+
+    def _close(self, sheet: _OpenSheet, reason: str, now: float) -> Dict:
+        self.open_sheets.remove(sheet)
+        closed = self._sheet_dict(sheet)
+        closed['closed_at'] = now
+        closed['close_reason'] = reason
+        self.closed_sheets.append(closed)
+        if self.state_path:
+            with open(self._closed_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(closed, ensure_ascii=False, separators=(',', ':')) + '\n')
+        logger.info(f"[ONLINE] Лист {sheet.sheet_number} закрыт ({reason}): "
+                    f"{closed['parts_count']} деталей, {closed['utilization_percent']}%")
+        return closed
+
+    def _close_expired(self, now: float) -> List[Dict]:
+        timeout = self.config['sheet_timeout_s']
+        if not timeout:
+            return []
+        expired = [s for s in self.open_sheets if s.parts and now - s.opened_at >= timeout]
+        return [self._close(sheet, CLOSE_TIMEOUT, now) for sheet in expired]
+
+    # ---- API ----
+
+    def push(self, parts: List[Dict], order_number: Optional[str] = None) -> Dict:
+        """
+        Добавить поступившие детали
+
+        Args:
+            parts: [{'name', 'width', 'height', 'quantity', 'order_number'?}]
+            order_number: номер заказа по умолчанию для деталей
+
+        Returns:
+            {
+                'placed': [{'name', 'sheet_number', 'x', 'y', 'rotated'}],
+                'rejected': [{'name', 'reason'}],
+                'closed_sheets': [...],   # закрытые этим вызовом листы
+                'open_sheets': [...]      # сводка открытых листов
+            }
+        """
+        # Все детали проверяются до изменения состояния: ошибка в середине
+        # списка не должна оставить размещенным его начало (повтор - дубли)
+        items = _normalize_parts(parts, order_number)
+
+        with self._lock:
+            self._ensure_loaded()
+            placed = []
+            rejected = []
+            closed = []
+            try:
+                self._place(items, time.time(), placed, rejected, closed)
+            finally:
+                # Размещенное до сбоя не теряется при перезапуске
+                self._save()
+
+            return {
+                'placed': placed,
+                'rejected': rejected,
+                'closed_sheets': closed,
+                'open_sheets': self._open_summary()
+            }
+
+    def _place(self, items: List[Tuple], now: float, placed: List[Dict], rejected: List[Dict],
+               closed: List[Dict]):
+        """Размещение проверенных деталей (под блокировкой), результат - в списки"""
+        closed.extend(self._close_expired(now))
+        threshold = self.config['close_utilization_percent']
+        sheet_area = self.config['sheet_width'] * self.config['sheet_height']
+
+        # Крупные детали первыми - как сортировка по площади в optimize_nesting
+        items = sorted(items, key=lambda item: item[1] * item[2], reverse=True)
+
+        for name, width, height, quantity, part_order in items:
+            if width <= 0 or height <= 0:
+                rejected.append({'name': name, 'reason': 'invalid_size'})
+                continue
+            if not self._fits_empty(width, height):
+                rejected.append({'name': name, 'reason': 'does_not_fit_sheet'})
+                continue
+
+            if name not in self.positions:
+                self.positions[name] = len(self.positions) + 1
+
+            for _ in range(quantity):
+                found = self._find_position(width, height)
+                if found is None:
+                    if len(self.open_sheets) >= self.config['max_open_sheets']:
+                        fullest = max(self.open_sheets, key=lambda s: s.used_area)
+                        closed.append(self._close(fullest, CLOSE_CAPACITY, now))
+                    self._open_sheet(now)
+                    found = self._find_position(width, height)
+
+                sheet, fx, fy, rotated = found
+                final_width, final_height = (height, width) if rotated else (width, height)
+                offset = self.config['edge_margin'] + self.config['cut_gap'] / 2.0
+                placement = {
+                    'name': name,
+                    'width': final_width,
+                    'height': final_height,
+                    'x': fx + offset,
+                    'y': fy + offset,
+                    'rotated': rotated,
+                    'position_number': self.positions[name],
+                    'area_m2': final_width * final_height / 1_000_000
+                }
+                if part_order:
+                    placement['order_number'] = part_order
+
+                sheet.parts.append(placement)
+                sheet.free = subtract(sheet.free, self._gap_rect(placement))
+                sheet.used_area += final_width * final_height
+                sheet.updated_at = now
+                placed.append({'name': name, 'sheet_number': sheet.sheet_number,
+                               'x': placement['x'], 'y': placement['y'], 'rotated': rotated})
+
+                if sheet.used_area / sheet_area * 100 >= threshold:
+                    closed.append(self._close(sheet, CLOSE_UTILIZATION, now))
+
+    def close(self, sheet_number: Optional[int] = None) -> List[Dict]:
+        """Закрыть открытый лист (None - все непустые открытые листы)"""
+        with self._lock:
+            self._ensure_loaded()
+            now = time.time()
+            targets = [s for s in self.open_sheets
+                       if (sheet_number is None and s.parts) or s.sheet_number == sheet_number]
+            closed = [self._close(sheet, CLOSE_MANUAL, now) for sheet in targets]
+            if closed:
+                self._save()
+            return closed
+
+    def release(self, sheet_numbers: Optional[List[int]] = None) -> List[Dict]:
+        """
+        Забрать закрытые листы на резку (удаляются из состояния)
+
+        Args:
+            sheet_numbers: номера листов (None - все закрытые)
+        """
+        with self._lock:
+            self._ensure_loaded()
+            if sheet_numbers is None:
+                released, self.closed_sheets = self.closed_sheets, []
+            else:
+                wanted = set(sheet_numbers)
+                released = [s for s in self.closed_sheets if s['sheet_number'] in wanted]
+                self.closed_sheets = [s for s in self.closed_sheets if s['sheet_number'] not in wanted]
+            if released and self.state_path:
+                self._write_atomic(self._closed_path, ''.join(
+                    json.dumps(sheet, ensure_ascii=False, separators=(',', ':')) + '\n'
+                    for sheet in self.closed_sheets
+                ))
+            return released
+
+    def state(self) -> Dict:
+        """Настройки, открытые и закрытые листы (просроченные листы закрываются)"""
+        with self._lock:
+            self._ensure_loaded()
+            if self._close_expired(time.time()):
+                self._save()
+            return {
+                'config': dict(self.config),
+                'open_sheets': [self._sheet_dict(s) for s in self.open_sheets],
+                'closed_sheets': list(self.closed_sheets),
+                'next_sheet_number': self.next_sheet_number
+            }
+
+    def configure(self, **config) -> Dict:
+        """
+        Изменить настройки
+
+        Raises:
+            ValueError: неизвестная настройка или значение неверного типа
+            OnlineConfigConflict: размеры листа и зазоры при открытых листах
+        """
+        unknown = set(config) - set(DEFAULT_CONFIG)
+        if unknown:
+            raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}")
+        config = {key: _normalize_setting(key, value) for key, value in config.items()}
+
+        with self._lock:
+            self._ensure_loaded()
+            geometry = {'sheet_width', 'sheet_height', 'cut_gap', 'edge_margin', 'allow_rotation'}
+            changed = {k for k, v in config.items() if self.config.get(k) != v}
+            if changed & geometry and any(s.parts for s in self.open_sheets):
+                raise OnlineConfigConflict('Close open sheets before changing sheet size or gaps')
+
+            self.config.update(config)
+            if changed & geometry:
+                self.open_sheets = []
+            self._save()
+            return dict(self.config)
+
+    def _open_summary(self) -> List[Dict]:
+        sheet_area = self.config['sheet_width'] * self.config['sheet_height']
+        return [{
+            'sheet_number': s.sheet_number,
+            'parts_count': len(s.parts),
+            'utilization_percent': round(s.used_area / sheet_area * 100, 2),
+            'opened_at': s.opened_at
+        } for s in self.open_sheets]
+
+    # ---- состояние ----
+
+    @property
+    def _closed_path(self) -> str:
+        return f'{self.state_path}.closed.jsonl'
+
+    @staticmethod
+    def _write_atomic(path: str, text: str):
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def _save(self):
+        """Настройки и открытые листы (закрытые - в журнале, см. _close)"""
+        if not self.state_path:
+            return
+        state = {
+            'version': STATE_VERSION,
+            'config': self.config,
+            'positions': self.positions,
+            'next_sheet_number': self.next_sheet_number,
+            'open_sheets': [{
+                'sheet_number': s.sheet_number,
+                'opened_at': s.opened_at,
+                'updated_at': s.updated_at,
+                'parts': s.parts
+            } for s in self.open_sheets]
+        }
+        self._write_atomic(self.state_path, json.dumps(state, ensure_ascii=False, separators=(',', ':')))
+
+    def _load(self):
+        with open(self.state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('version') != STATE_VERSION:
+            raise ValueError(f"Unsupported state version: {state.get('version')}")
+
+        self.config = dict(DEFAULT_CONFIG, **state.get('config', {}))
+        self.positions = state.get('positions', {})
+        self.next_sheet_number = state.get('next_sheet_number', 1)
+        self.closed_sheets = []
+        if os.path.exists(self._closed_path):
+            with open(self._closed_path, 'r', encoding='utf-8') as f:
+                self.closed_sheets = [json.loads(line) for line in f if line.strip()]
+        # Лист мог попасть в журнал до сохранения состояния (сбой между записями)
+        closed_numbers = {s['sheet_number'] for s in self.closed_sheets}
+
+        usable_width, usable_height = self._usable
+        self.open_sheets = []
+        for saved in state.get('open_sheets', []):
+            if saved['sheet_number'] in closed_numbers:
+                continue
+            sheet = _OpenSheet(saved['sheet_number'], saved['opened_at'], usable_width, usable_height)
+            sheet.updated_at = saved.get('updated_at', saved['opened_at'])
+            sheet.parts = saved.get('parts', [])
+            sheet.used_area = sum(p['width'] * p['height'] for p in sheet.parts)
+            sheet.free = maximal_empty_rectangles(usable_width, usable_height,
+                                                  [self._gap_rect(p) for p in sheet.parts])
+            self.open_sheets.append(sheet)
+
+        logger.info(f"[ONLINE] Состояние загружено: {len(self.open_sheets)} открытых, "
+                    f"{len(self.closed_sheets)} закрытых листов")
+
+
+def sheets_result(sheets: List[Dict], sheet_width: float, sheet_height: float) -> Dict:
+    """Листы онлайн-раскроя -> результат в формате optimize_nesting (для экспорта и валидации)"""
+    sheet_area = sheet_width * sheet_height
+    total_parts_area = sum(s['used_area_m2'] for s in sheets) * 1_000_000
+    total_sheet_area = sheet_area * len(sheets)
+    utilization = total_parts_area / total_sheet_area * 100 if total_sheet_area > 0 else 0
+
+    position_data = {}
+    for sheet in sheets:
+        for part in sheet['parts']:
+            pos = position_data.setdefault(part['position_number'], {
+                'position_number': part['position_number'],
+                'name': part['name'],
+                'width': part['width'] if not part['rotated'] else part['height'],
+                'height': part['height'] if not part['rotated'] else part['width'],
+                'area_m2': part['area_m2'],
+                'quantity': 0,
+                'total_area_m2': 0
+            })
+            pos['quantity'] += 1
+            pos['total_area_m2'] += part['area_m2']
+
+    return {
+        'success': True,
+        'nesting_mode': 'online',
+        'sheets_needed': len(sheets),
+        'utilization_percent': round(utilization, 2),
+        'waste_percent': round(100 - utilization, 2),
+        'total_parts_area_m2': round(total_parts_area / 1_000_000, 4),
+        'total_sheet_area_m2': round(total_sheet_area / 1_000_000, 4),
+        'total_waste_area_m2': round((total_sheet_area - total_parts_area) / 1_000_000, 4),
+        'sheets': sheets,
+        'sheet_width': sheet_width,
+        'sheet_height': sheet_height,
+        'positions_summary': sorted(position_data.values(), key=lambda p: p['position_number'])
+    }
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Геометрия деталей: контуры, полигоны, хранилище геометрии
+
+Геометрия детали:
+    {
+        'outer': [[x, y], ...],        # наружный контур (CCW), габарит от (0, 0)
+        'holes': [[[x, y], ...], ...], # внутренние контуры (вырезы)
+        'width': float,
+        'height': float,
+        'area': float                  # площадь с учетом вырезов, мм²
+    }
+
+Поворот детали (rotated=True в прямоугольном раскрое) - на 90° против
+часовой стрелки с переносом габарита в (0, 0): (u, v) -> (h - v, u).
+
+Контуры загруженного DXF разбираются не при загрузке, а при первом
+обращении (раскрой по контуру, вложение деталей, экспорт DXF):
+загрузка сохраняет копию файла под geometry_id (хеш содержимого),
+load_geometry разбирает ее один раз и кладет геометрию рядом в JSON.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from utils.nesting_cache import NestingCache
+
+logger = logging.getLogger(__name__)
+
+Point = Tuple[float, float]
+
+# Хранилище геометрии загруженных DXF (geometry_id -> JSON, исходный DXF)
+GEOMETRY_FOLDER = Path('uploads') / 'geometry'
+
+# Недавно использованная геометрия (остальная - в хранилище на диске)
+_geometry_memo = NestingCache(max_entries=512, ttl_seconds=3600)
+
+
+def polygon_area(points: Sequence[Point]) -> float:
+    """Знаковая площадь полигона (> 0 для CCW)"""
+    area = 0.0
+    n = len(points)
+    for i in range(n):
+        x1, y1 = points[i]
+        x2, y2 = points[(i + 1) % n]
+        area += x1 * y2 - x2 * y1
+    return area / 2.0
+
+
+def ensure_ccw(points: Sequence[Point]) -> List[Point]:
+    """Ориентирует полигон против часовой стрелки"""
+    points = [tuple(p) for p in points]
+    if polygon_area(points) < 0:
+        points.reverse()
+    return points
+
+
+def bounding_box(points: Sequence[Point]) -> Tuple[float, float, float, float]:
+    """(min_x, min_y, max_x, max_y)"""
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def point_in_polygon(x: float, y: float, points: Sequence[Point]) -> bool:
+    """Точка внутри полигона (правило четности)"""
+    inside = False
+    n = len(points)
+    j = n - 1
+    for i in range(n):
+        xi, yi = points[i]
+        xj, yj = points[j]
+        if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+
+def clean_polygon(points: Sequence[Point], eps: float = 1e-6) -> List[Point]:
+    """Убирает повторяющиеся и коллинеарные вершины"""
+    result = []
+    for p in points:
+        if not result or abs(p[0] - result[-1][0]) > eps or abs(p[1] - result[-1][1]) > eps:
+            result.append((float(p[0]), float(p[1])))
+    if len(result) > 1 and abs(result[0][0] - result[-1][0]) <= eps and abs(result[0][1] - result[-1][1]) <= eps:
+        result.pop()
+
+    changed = True
+    while changed and len(result) > 3:
+        changed = False
+        for i in range(len(result)):
+            ax, ay = result[i - 1]
+            bx, by = result[i]
+            cx, cy = result[(i + 1) % len(result)]
+            cross = (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+            if abs(cross) <= eps * max(1.0, abs(cx - ax) + abs(cy - ay)):
+                del result[i]
+                changed = True
+                break
+
+    return result
+
+
+def simplify_polygon(points: Sequence[Point], tolerance: float = 0.5) -> List[Point]:
+    """Упрощение замкнутого контура (Douglas-Peucker)"""
+    points = [tuple(p) for p in points]
+    if len(points) <= 4 or tolerance <= 0:
+        return points
+
+    def dp(pts):
+        if len(pts) < 3:
+            return pts
+        ax, ay = pts[0]
+        bx, by = pts[-1]
+        dx, dy = bx - ax, by - ay
+        length = math.hypot(dx, dy)
+        best_i, best_d = 0, -1.0
+        for i in range(1, len(pts) - 1):
+            px, py = pts[i]
+            if length == 0:
+                d = math.hypot(px - ax, py - ay)
+            else:
+                d = abs(dy * px - dx * py + bx * ay - by * ax) / length
+            if d > best_d:
+                best_i, best_d = i, d
+        if best_d <= tolerance:
+            return [pts[0], pts[-1]]
+        return dp(pts[:best_i + 1])[:-1] + dp(pts[best_i:])
+
+    # Разрезаем контур в самой дальней от первой точке и упрощаем две половины
+    first = points[0]
+    far = max(range(len(points)), key=lambda i: (points[i][0] - first[0]) ** 2 + (points[i][1] - first[1]) ** 2)
+    half1 = dp(points[:far + 1])
+    half2 = dp(points[far:] + [first])
+    simplified = half1[:-1] + half2[:-1]
+
+    return simplified if len(simplified) >= 3 else points
+
+
+def rotate_points(points: Sequence[Point], angle_deg: float) -> List[Point]:
+    """Поворот вокруг начала координат против часовой стрелки (без переноса)"""
+    angle = angle_deg % 360
+    if angle == 0:
+        return [(float(x), float(y)) for x, y in points]
+    if angle == 90:
+        return [(-y, x) for x, y in points]
+    if angle == 180:
+        return [(-x, -y) for x, y in points]
+    if angle == 270:
+        return [(y, -x) for x, y in points]
+
+    c = math.cos(math.radians(angle))
+    s = math.sin(math.radians(angle))
+    return [(x * c - y * s, x * s + y * c) for x, y in points]
+
+
+def rotation_offset(points: Sequence[Point], angle_deg: float) -> Point:
+    """Сдвиг, который rotate_polygon вычитает после поворота (минимум габарита)"""
+    min_x, min_y, _, _ = bounding_box(rotate_points(points, angle_deg))
+    return (min_x, min_y)
+
+
+def rotate_polygon(points: Sequence[Point], angle_deg: float) -> List[Point]:
+    """Поворот против часовой стрелки с переносом габарита в (0, 0)"""
+    rotated = rotate_points(points, angle_deg)
+    min_x, min_y, _, _ = bounding_box(rotated)
+    return [(x - min_x, y - min_y) for x, y in rotated]
+
+
+def transform_point(u: float, v: float, width: float, height: float, rotated: bool) -> Point:
+    """
+    Точка детали в локальных координатах -> координаты в габарите размещения
+
+    width, height - размеры детали без поворота.
+    """
+    if rotated:
+        return (height - v, u)
+    return (u, v)
+
+
+def rectangle_geometry(width: float, height: float) -> Dict:
+    """Геометрия прямоугольной детали (если контур неизвестен)"""
+    width = float(width)
+    height = float(height)
+    return {
+        'outer': [[0.0, 0.0], [width, 0.0], [width, height], [0.0, height]],
+        'holes': [],
+        'width': width,
+        'height': height,
+        'area': width * height
+    }
+
+
+def build_geometry(loops: List[List[Point]], tolerance: float = 0.5) -> Optional[Dict]:
+    """
+    Геометрия детали из набора замкнутых контуров
+
+    Наружный контур - контур наибольшей площади, вырезы - контуры внутри него.
+    Контуры вне наружного (несколько тел в одном файле) игнорируются.
+    """
+    loops = [clean_polygon(loop) for loop in loops]
+    loops = [loop for loop in loops if len(loop) >= 3 and abs(polygon_area(loop)) > 1e-6]
+    if not loops:
+        return None
+
+    loops.sort(key=lambda loop: abs(polygon_area(loop)), reverse=True)
+    outer = ensure_ccw(simplify_polygon(loops[0], tolerance))
+
+    holes = []
+    for loop in loops[1:]:
+        x, y = loop[0]
+        if point_in_polygon(x, y, outer):
+            hole = ensure_ccw(simplify_polygon(loop, tolerance))
+            hole.reverse()  # вырезы - по часовой стрелке
+            holes.append(hole)
+
+    min_x, min_y, max_x, max_y = bounding_box(outer)
+
+    def normalize(points):
+        return [[round(x - min_x, 3), round(y - min_y, 3)] for x, y in points]
+
+    area = abs(polygon_area(outer)) - sum(abs(polygon_area(h)) for h in holes)
+
+    return {
+        'outer': normalize(outer),
+        'holes': [normalize(h) for h in holes],
+        'width': round(max_x - min_x, 3),
+        'height': round(max_y - min_y, 3),
+        'area': round(area, 3)
+    }
+
+
+def geometry_hash(geometry: Dict) -> str:
+    """Хеш геометрии (идентификатор для хранилища и кэшей)"""
+    raw = json.dumps({'outer': geometry['outer'], 'holes': geometry['holes']}, separators=(',', ':'))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def save_geometry(geometry: Dict, folder: Path = None) -> str:
+    """Сохранить геометрию в хранилище, вернуть geometry_id"""
+    folder = Path(folder) if folder else GEOMETRY_FOLDER
+    geometry_id = geometry_hash(geometry)
+
+    path = folder / f'{geometry_id}.json'
+    if not path.exists():
+        folder.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(geometry, f)
+
+    _geometry_memo.put(geometry_id, geometry)
+    return geometry_id
+
+
+def register_dxf(dxf_path: str, folder: Path = None) -> str:
+    """
+    Поставить DXF в хранилище без разбора контуров, вернуть geometry_id
+
+    Контуры разберет load_geometry при первом обращении.
+    """
+    folder = Path(folder) if folder else GEOMETRY_FOLDER
+    digest = hashlib.sha1()
+    with open(dxf_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    geometry_id = digest.hexdigest()
+
+    source = folder / f'{geometry_id}.dxf'
+    if not source.exists() and not (folder / f'{geometry_id}.json').exists():
+        folder.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(dxf_path, source)
+    return geometry_id
+
+
+def _parse_source(geometry_id: str, folder: Path) -> Optional[Dict]:
+    """Разбор контуров DXF из хранилища; результат (и неудача) сохраняется в JSON"""
+    from utils.dxf_parser import parse_dxf_contours
+
+    source = folder / f'{geometry_id}.dxf'
+    if not source.exists():
+        return None
+
+    geometry = parse_dxf_contours(str(source)) or {}
+    path = folder / f'{geometry_id}.json'
+    tmp = path.with_suffix(f'.{os.getpid()}.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(geometry, f)
+    os.replace(tmp, path)
+    source.unlink(missing_ok=True)
+
+    logger.info(f"[GEOMETRY] Контуры {geometry_id} разобраны" + ('' if geometry else ': замкнутых контуров нет'))
+    return geometry
+
+
+def load_geometry(geometry_id: str, folder: Path = None) -> Optional[Dict]:
+    """Загрузить геометрию по geometry_id (None, если не найдена)"""
+    if not geometry_id:
+        return None
+
+    geometry = _geometry_memo.get(geometry_id)
+    if geometry is not None:
+        return geometry or None
+
+    folder = Path(folder) if folder else GEOMETRY_FOLDER
+    # geometry_id приходит от клиента - допускаем только hex
+    if not all(c in '0123456789abcdef' for c in geometry_id):
+        return None
+
+    path = folder / f'{geometry_id}.json'
+    if path.exists():
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                geometry = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"[GEOMETRY] Не удалось прочитать {path}: {e}")
+            return None
+    else:
+        geometry = _parse_source(geometry_id, folder)
+        if geometry is None:
+            return None
+
+    # Пустая геометрия - в DXF нет замкнутых контуров (деталь - прямоугольник)
+    _geometry_memo.put(geometry_id, geometry)
+    return geometry or None
+
+
+def part_geometry(part: Dict) -> Dict:
+    """
+    Геометрия детали из запроса раскроя
+
+    Порядок: контур в самой детали ('contour', 'holes'), затем geometry_id
+    из хранилища, иначе прямоугольник width x height.
+    """
+    contour = part.get('contour')
+    if contour:
+        geometry = build_geometry([contour] + list(part.get('holes') or []), tolerance=0)
+        if geometry:
+            return geometry
+
+    geometry = load_geometry(part.get('geometry_id'))
+    if geometry:
+        return geometry
+
+    return rectangle_geometry(part.get('width', 0), part.get('height', 0))
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Раскрой «деталь в детали» (part-in-part)
+
+Крупные внутренние вырезы деталей (вентиляционные панели, фланцы)
+optimize_nesting считает сплошными. Здесь вырезы из геометрии DXF
+превращаются в дополнительные «листы»: в каждом вырезе ищутся
+вписанные прямоугольники, мелкие детали сначала упаковываются в них
+(тем же rectpack, что и основной раскрой), остаток раскладывается
+обычным optimize_nesting. Вложенные детали переносятся в координаты
+листа вместе с деталью-носителем. Если носитель не попал на листы
+(лимит листов), его вложенные детали возвращаются в обычный раскрой;
+носители, не помещающиеся на пустой лист, вырезов не дают.
+
+Вписанные прямоугольники выреза: габарит выреза делится сеткой
+(координаты вертикальных/горизонтальных ребер + равномерный шаг),
+ячейки, целиком лежащие внутри выреза, остаются свободными, из
+свободной области берутся непересекающиеся наибольшие прямоугольники
+(utils.free_rectangles.disjoint_remnants).
+"""
+
+import bisect
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from utils.free_rectangles import disjoint_remnants
+from utils.nesting_validator import refresh_validation, report_unplaced
+from utils.online_nesting import sheets_result
+from utils.part_geometry import part_geometry, polygon_area
+from utils.rectpack_optimizer import RECTPACK_AVAILABLE, optimize_nesting
+from utils.sheet_patterns import detect_patterns
+
+if RECTPACK_AVAILABLE:
+    from rectpack import newPacker, PackingMode, PackingBin, MaxRectsBssf, SORT_AREA
+
+logger = logging.getLogger(__name__)
+
+Rect = Tuple[float, float, float, float]
+
+# Вырезы с меньшей вписанной стороной не используются, мм
+DEFAULT_MIN_HOLE_SIDE = 50.0
+# Число равномерных делений габарита выреза по каждой оси
+GRID_STEPS = 64
+# Допуск совпадения габарита геометрии с размерами детали, мм
+SIZE_TOLERANCE = 1.0
+
+
+def _grid(values: List[float], lo: float, hi: float) -> List[float]:
+    """Равномерные линии сетки и заданные координаты (без округления - ребра точно на линиях)"""
+    step = (hi - lo) / GRID_STEPS
+    fixed = sorted(set(values) | {lo, hi})
+    lines = list(fixed)
+    for i in range(1, GRID_STEPS):
+        line = lo + i * step
+        # Равномерная линия вплотную к ребру дала бы вырожденную ячейку
+        idx = bisect.bisect_left(fixed, line)
+        near = [fixed[j] for j in (idx - 1, idx) if 0 <= j < len(fixed)]
+        if all(abs(line - v) > step * 1e-3 for v in near):
+            lines.append(line)
+    return sorted(lines)
+
+
+def inscribed_rectangles(hole: Sequence[Sequence[float]], min_side: float) -> List[Rect]:
+    """
+    Непересекающиеся прямоугольники внутри выреза (по убыванию площади)
+
+    Args:
+        hole: контур выреза [[x, y], ...]
+        min_side: минимальная сторона прямоугольника
+    """
+    points = [(float(x), float(y)) for x, y in hole]
+    n = len(points)
+    edges = [(points[i], points[(i + 1) % n]) for i in range(n)]
+
+    min_x = min(p[0] for p in points)
+    max_x = max(p[0] for p in points)
+    min_y = min(p[1] for p in points)
+    max_y = max(p[1] for p in points)
+    if min(max_x - min_x, max_y - min_y) < min_side:
+        return []
+
+    # Линии сетки через вертикальные и горизонтальные ребра - прямоугольные вырезы точные
+    xs = _grid([a[0] for a, b in edges if a[0] == b[0]], min_x, max_x)
+    ys = _grid([a[1] for a, b in edges if a[1] == b[1]], min_y, max_y)
+    cols, rows = len(xs) - 1, len(ys) - 1
+
+    # Ячейки, которые пересекает контур (наклонные ребра; вертикальные и
+    # горизонтальные лежат на линиях сетки)
+    boundary = [[False] * cols for _ in range(rows)]
+    for (x1, y1), (x2, y2) in edges:
+        if x1 == x2 or y1 == y2:
+            continue
+        if x1 > x2:
+            x1, y1, x2, y2 = x2, y2, x1, y1
+        first = max(bisect.bisect_right(xs, x1) - 1, 0)
+        last = min(bisect.bisect_left(xs, x2), cols)
+        for col in range(first, last):
+            lo, hi = max(xs[col], x1), min(xs[col + 1], x2)
+            if lo >= hi:
+                continue
+            ya = y1 + (y2 - y1) * (lo - x1) / (x2 - x1)
+            yb = y1 + (y2 - y1) * (hi - x1) / (x2 - x1)
+            ylo, yhi = min(ya, yb), max(ya, yb)
+            row = max(bisect.bisect_right(ys, ylo) - 1, 0)
+            while row < rows and ys[row] < yhi:
+                if ys[row + 1] > ylo:
+                    boundary[row][col] = True
+                row += 1
+
+    # Внутренние ячейки: центр внутри выреза (сканирующая прямая) и ячейку не пересекает контур
+    obstacles = []
+    for row in range(rows):
+        yc = (ys[row] + ys[row + 1]) / 2
+        crossings = sorted(
+            x1 + (yc - y1) * (x2 - x1) / (y2 - y1)
+            for (x1, y1), (x2, y2) in edges
+            if (y1 > yc) != (y2 > yc)
+        )
+        run_start = None
+        for col in range(cols + 1):
+            inside = False
+            if col < cols and not boundary[row][col]:
+                xc = (xs[col] + xs[col + 1]) / 2
+                inside = bisect.bisect_left(crossings, xc) % 2 == 1
+            if not inside and col < cols:
+                if run_start is None:
+                    run_start = col
+            elif run_start is not None:
+                obstacles.append((xs[run_start] - min_x, ys[row] - min_y,
+                                  xs[col] - xs[run_start], ys[row + 1] - ys[row]))
+                run_start = None
+
+    remnants = disjoint_remnants(max_x - min_x, max_y - min_y, obstacles,
+                                 min_side=min_side, min_area=min_side * min_side)
+    return [(x + min_x, y + min_y, w, h) for x, y, w, h in remnants]
+
+
+def hole_bins(part: Dict, cut_gap: float, min_side: float) -> List[Rect]:
+    """
+    Области вырезов детали для вложения мелких деталей
+
+    Прямоугольники в координатах детали (габарит без поворота) уже с
+    отступом cut_gap / 2 от контура выреза: вместе с зазором упаковки
+    вложенная деталь отстоит от контура на cut_gap.
+    """
+    geometry = part_geometry(part)
+    if not geometry.get('holes'):
+        return []
+
+    width, height = float(part.get('width', 0)), float(part.get('height', 0))
+    if abs(geometry['width'] - width) > SIZE_TOLERANCE or abs(geometry['height'] - height) > SIZE_TOLERANCE:
+        logger.warning(f"[PART IN PART] {part.get('name')}: габарит геометрии "
+                       f"{geometry['width']}x{geometry['height']} не совпадает с {width}x{height}, вырезы не используются")
+        return []
+
+    bins = []
+    for hole in geometry['holes']:
+        if abs(polygon_area(hole)) < min_side * min_side:
+            continue
+        for x, y, w, h in inscribed_rectangles(hole, min_side + cut_gap):
+            bins.append((x + cut_gap / 2, y + cut_gap / 2, w - cut_gap, h - cut_gap))
+    return bins
+
+
+def _fits_sheet(width: float, height: float, usable_width: float, usable_height: float,
+                allow_rotation: bool) -> bool:
+    """Деталь с зазором помещается в рабочую область пустого листа"""
+    if width <= usable_width and height <= usable_height:
+        return True
+    return allow_rotation and height <= usable_width and width <= usable_height
+
+
+def _unplaced(parts: List[Dict], sheets: List[Dict], position_map: Dict[str, int],
+              fits: Callable[[float, float], bool]) -> List[Dict]:
+    """Детали запроса, которых меньше на листах, чем заказано (для report_unplaced)"""
+    placed = {}
+    for sheet in sheets:
+        for placement in sheet['parts']:
+            placed[placement['name']] = placed.get(placement['name'], 0) + 1
+
+    unplaced = {}
+    for part in parts:
+        name = part.get('name', 'unknown')
+        width, height = float(part.get('width', 0)), float(part.get('height', 0))
+        if width <= 0 or height <= 0:
+            continue
+        item = unplaced.setdefault(name, {
+            'name': name,
+            'position_number': position_map.get(name, 0),
+            'quantity': -placed.get(name, 0),
+            'reason': 'sheet_limit' if fits(width, height) else 'too_large'
+        })
+        item['quantity'] += int(part.get('quantity', 1))
+    return [item for item in unplaced.values() if item['quantity'] > 0]
+
+
+def _nested_placement(child: Dict, host: Dict, host_width: float, host_height: float) -> Dict:
+    """Вложенная деталь: координаты детали-носителя (без поворота) -> координаты листа"""
+    u, v, w, h = child['x'], child['y'], child['width'], child['height']
+    placement = dict(child)
+    if host['rotated']:
+        # transform_point: (u, v) -> (H - v, u)
+        placement.update(x=host['x'] + host_height - v - h, y=host['y'] + u,
+                         width=h, height=w, rotated=not child['rotated'])
+    else:
+        placement.update(x=host['x'] + u, y=host['y'] + v)
+    return placement
+
+
+def optimize_part_in_part(parts: List[Dict], sheet_width: float = 2500,
+                          sheet_height: float = 1250, allow_rotation: bool = True,
+                          cut_gap: float = 5.0, edge_margin: float = 10.0,
+                          min_hole_side: float = DEFAULT_MIN_HOLE_SIDE,
+                          cancel_event: Optional[threading.Event] = None,
+                          progress_callback: Optional[Callable[[str, Dict], None]] = None) -> Dict:
+    """
+    Раскрой с вложением мелких деталей в вырезы крупных
+
+    Args:
+        parts: как в optimize_nesting; вырезы берутся из 'contour'/'holes'
+               или 'geometry_id' (см. utils.part_geometry.part_geometry)
+        min_hole_side: минимальная сторона используемой области выреза, мм
+
+    Returns:
+        результат в формате optimize_nesting и дополнительно:
+        'nesting_mode': 'part_in_part',
+        у вложенных деталей 'inside' - 'nest_id' детали-носителя,
+        'part_in_part' - число вырезов, вложенных деталей и их площадь,
+        'unplaced' - неразмещенные детали (они же - ошибки в 'validation')
+    """
+    if not RECTPACK_AVAILABLE:
+        return {'success': False, 'error': 'rectpack not installed. Run: pip install rectpack'}
+
+    usable_width = sheet_width - 2 * edge_margin - cut_gap
+    usable_height = sheet_height - 2 * edge_margin - cut_gap
+
+    def fits(width: float, height: float) -> bool:
+        return _fits_sheet(width + cut_gap, height + cut_gap, usable_width, usable_height, allow_rotation)
+
+    # Детали-носители: вырезы каждого экземпляра - отдельные бины
+    hosts = {}
+    for part in parts:
+        name = part.get('name', 'unknown')
+        width, height = float(part.get('width', 0)), float(part.get('height', 0))
+        if name in hosts or width <= 0 or height <= 0:
+            continue
+        if not fits(width, height):
+            # Носитель не попадет на лист - вложенные в него детали потерялись бы
+            logger.warning(f"[PART IN PART] {name} не помещается на лист, вырезы не используются")
+            continue
+        bins = hole_bins(part, cut_gap, min_hole_side)
+        if bins:
+            hosts[name] = (part, bins)
+
+    packer = newPacker(mode=PackingMode.Offline, bin_algo=PackingBin.BBF,
+                       pack_algo=MaxRectsBssf, sort_algo=SORT_AREA, rotation=allow_rotation)
+    bin_origins = {}
+    for name, (part, bins) in hosts.items():
+        for instance in range(int(part.get('quantity', 1))):
+            for bin_idx, (x, y, w, h) in enumerate(bins):
+                bid = (name, instance, bin_idx)
+                bin_origins[bid] = (x, y)
+                packer.add_bin(w, h, bid=bid)
+
+    max_bin = max((w * h for _, bins in hosts.values() for _, _, w, h in bins), default=0)
+    small_parts = {}
+    for part in parts:
+        name = part.get('name', 'unknown')
+        width, height = float(part.get('width', 0)), float(part.get('height', 0))
+        if name in hosts or width <= 0 or height <= 0:
+            continue
+        if (width + cut_gap) * (height + cut_gap) > max_bin:
+            continue
+        small_parts[name] = part
+        for i in range(int(part.get('quantity', 1))):
+            packer.add_rect(width + cut_gap, height + cut_gap, rid=(name, i))
+
+    nested = {}  # (host name, instance) -> [вложенные детали в координатах носителя]
+    nested_count = {}
+    if bin_origins and small_parts:
+        packer.pack()
+        for packed_bin in packer:
+            host_name, instance, bin_idx = packed_bin.bid
+            ox, oy = bin_origins[packed_bin.bid]
+            for rect in packed_bin:
+                name = rect.rid[0]
+                part = small_parts[name]
+                width, height = float(part['width']), float(part['height'])
+                rotated = abs(rect.width - (width + cut_gap)) > 1e-6 or abs(rect.height - (height + cut_gap)) > 1e-6
+                final_width, final_height = (height, width) if rotated else (width, height)
+                nested.setdefault((host_name, instance), []).append({
+                    'name': name,
+                    'width': final_width,
+                    'height': final_height,
+                    'x': ox + rect.x + cut_gap / 2,
+                    'y': oy + rect.y + cut_gap / 2,
+                    'rotated': rotated,
+                    'area_m2': final_width * final_height / 1_000_000
+                })
+                nested_count[name] = nested_count.get(name, 0) + 1
+
+    logger.info(f"[PART IN PART] Носителей: {len(hosts)}, областей вырезов: {len(bin_origins)}, "
+                f"вложено деталей: {sum(nested_count.values())}")
+
+    def remaining_parts() -> List[Dict]:
+        remaining = []
+        for part in parts:
+            quantity = int(part.get('quantity', 1)) - nested_count.get(part.get('name', 'unknown'), 0)
+            if quantity > 0:
+                remaining.append(dict(part, quantity=quantity))
+        return remaining
+
+    # Остаток - обычный раскрой. Вложения экземпляров носителя, не попавших
+    # на листы (лимит листов), возвращаются в остаток, раскрой повторяется
+    while True:
+        result = optimize_nesting(
+            parts=remaining_parts(), sheet_width=sheet_width, sheet_height=sheet_height,
+            allow_rotation=allow_rotation, cut_gap=cut_gap, edge_margin=edge_margin,
+            cancel_event=cancel_event, progress_callback=progress_callback
+        )
+        if not result.get('success'):
+            return result
+
+        placed_hosts = {}
+        for sheet in result['sheets']:
+            for placement in sheet['parts']:
+                if placement['name'] in hosts:
+                    placed_hosts[placement['name']] = placed_hosts.get(placement['name'], 0) + 1
+        orphaned = [key for key in nested if key[1] >= placed_hosts.get(key[0], 0)]
+        if not orphaned:
+            break
+        for key in orphaned:
+            for child in nested.pop(key):
+                nested_count[child['name']] -= 1
+        logger.warning(f"[PART IN PART] Носители не поместились на листы: {len(orphaned)}, "
+                       f"их вложенные детали раскладываются заново")
+
+    if not nested:
+        result['nesting_mode'] = 'part_in_part'
+        result['part_in_part'] = {'hole_bins': len(bin_origins), 'nested_parts': 0, 'nested_area_m2': 0}
+        position_map = {p['name']: p['position_number'] for p in result.get('positions_summary', [])}
+        return report_unplaced(result, _unplaced(parts, result['sheets'], position_map, fits))
+
+    # Номера позиций вложенных деталей, которых не осталось в основном раскрое
+    position_map = {p['name']: p['position_number'] for p in result.get('positions_summary', [])}
+    for part in parts:
+        name = part.get('name', 'unknown')
+        if name not in position_map:
+            position_map[name] = max(position_map.values(), default=0) + 1
+
+    # k-й размещенный экземпляр носителя получает вложения k-го экземпляра
+    host_instances = {}
+    nested_area = 0.0
+    for sheet in result['sheets']:
+        sheet_parts = []
+        for placement in sheet['parts']:
+            sheet_parts.append(placement)
+            name = placement['name']
+            if name not in hosts:
+                continue
+            instance = host_instances.get(name, 0)
+            host_instances[name] = instance + 1
+            children = nested.pop((name, instance), [])
+            if not children:
+                continue
+
+            host_part = hosts[name][0]
+            nest_id = f'{name}#{instance}'
+            placement['nest_id'] = nest_id
+            for child in children:
+                child_placement = _nested_placement(child, placement, float(host_part['width']),
+                                                     float(host_part['height']))
+                child_placement['position_number'] = position_map[child['name']]
+                child_placement['inside'] = nest_id
+                sheet_parts.append(child_placement)
+                nested_area += child['area_m2']
+
+        sheet['parts'] = sheet_parts
+        sheet['parts_count'] = len(sheet_parts)
+
+    # Площадь носителя с вложениями - по контуру за вычетом вырезов
+    for sheet in result['sheets']:
+        for placement in sheet['parts']:
+            if 'nest_id' in placement:
+                placement['area_m2'] = part_geometry(hosts[placement['name']][0])['area'] / 1_000_000
+        sheet['used_area_m2'] = sum(p['area_m2'] for p in sheet['parts'])
+
+    combined = sheets_result(result['sheets'], sheet_width, sheet_height)
+    for sheet in combined['sheets']:
+        sheet_area = sheet_width * sheet_height
+        sheet['waste_area_m2'] = (sheet_area - sheet['used_area_m2'] * 1_000_000) / 1_000_000
+        sheet['utilization_percent'] = round(sheet['used_area_m2'] * 1_000_000 / sheet_area * 100, 2)
+    combined['nesting_mode'] = 'part_in_part'
+    combined['part_in_part'] = {
+        'hole_bins': len(bin_origins),
+        'nested_parts': sum(nested_count.values()),
+        'nested_area_m2': round(nested_area, 4)
+    }
+    detect_patterns(combined)
+    refresh_validation(combined)
+    report_unplaced(combined, _unplaced(parts, combined['sheets'], position_map, fits))
+
+    logger.info(f"[PART IN PART] Готово: {combined['sheets_needed']} листов, "
+                f"использование {combined['utilization_percent']}%")
+
+    return combined
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Общий пул процессов для тяжелых расчетов (раскрой групп, валидация)
+
+Пул создается при первом использовании и живет все время работы
+приложения. Под Windows процессы запускаются через spawn и каждый
+заново импортирует приложение, поэтому пул на каждый запрос обходится
+дороже самого расчета.
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_lock = threading.Lock()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Пул процессов (по числу ядер), один на приложение"""
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+        return _pool
+
+
+def _reset_process_pool():
+    """Сломанный пул (процесс упал) заменяется новым при следующем вызове"""
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def map_in_pool(func: Callable, tasks: Sequence) -> Optional[List]:
+    """
+    func для каждой задачи в пуле процессов
+
+    Returns:
+        результаты в порядке tasks или None, если пул недоступен
+        (вызывающий считает последовательно)
+    """
+    try:
+        return list(get_process_pool().map(func, tasks))
+    except BrokenProcessPool as e:
+        logger.warning(f"[POOL] Пул процессов сломан ({e}), будет создан заново")
+        _reset_process_pool()
+    except Exception as e:
+        logger.warning(f"[POOL] Пул процессов недоступен ({e})")
+    return None
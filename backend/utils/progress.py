@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Рассылка событий прогресса (для Server-Sent Events)
+
+Клиент подписывается на канал (progress_id) и получает события
+долгих операций: загрузка DXF, упаковка деталей, закрытие листов.
+Если на канал никто не подписан, publish() сводится к одной проверке словаря.
+"""
+
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Последнее событие операции - после него поток SSE закрывается
+FINAL_EVENTS = ('done',)
+
+
+class ProgressBroker:
+    """Подписки на каналы прогресса"""
+
+    def __init__(self, max_queue: int = 1000):
+        self.max_queue = max_queue
+        self._channels = {}  # channel -> [queue.Queue]
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel: str) -> queue.Queue:
+        """Подписаться на канал"""
+        q = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._channels.setdefault(channel, []).append(q)
+        return q
+
+    def unsubscribe(self, channel: str, q: queue.Queue):
+        """Отписаться от канала"""
+        with self._lock:
+            subscribers = self._channels.get(channel)
+            if not subscribers:
+                return
+            if q in subscribers:
+                subscribers.remove(q)
+            if not subscribers:
+                del self._channels[channel]
+
+    def has_subscribers(self, channel: Optional[str]) -> bool:
+        return channel in self._channels
+
+    def publish(self, channel: Optional[str], event: str, data: Dict):
+        """Отправить событие всем подписчикам канала"""
+        if channel not in self._channels:
+            return
+
+        with self._lock:
+            subscribers = list(self._channels.get(channel, []))
+
+        message = (event, data)
+        for q in subscribers:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                # Медленный клиент - пропускаем промежуточное событие
+                pass
+
+    def stream(self, channel: str, keepalive_seconds: float = 15,
+               max_seconds: float = 3600) -> Iterator[str]:
+        """
+        Генератор текста SSE для канала
+
+        Завершается после события 'done' или по истечении max_seconds.
+        """
+        q = self.subscribe(channel)
+        deadline = time.time() + max_seconds
+
+        try:
+            yield format_sse('subscribed', {'channel': channel})
+
+            while time.time() < deadline:
+                try:
+                    event, data = q.get(timeout=keepalive_seconds)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+
+                yield format_sse(event, data)
+
+                if event in FINAL_EVENTS:
+                    break
+        finally:
+            self.unsubscribe(channel, q)
+
+
+def format_sse(event: str, data: Dict) -> str:
+    """Форматирует событие в текст SSE"""
+    payload = json.dumps(data, ensure_ascii=False)
+    return f'event: {event}\ndata: {payload}\n\n'
+
+
+progress_broker = ProgressBroker()
+
+
+def make_progress_callback(channel: Optional[str]) -> Optional[Callable[[str, Dict], None]]:
+    """
+    Callback для optimize_nesting и других долгих операций
+
+    Returns:
+        функция (event, data) или None, если канал не задан
+    """
+    if not channel:
+        return None
+
+    def callback(event: str, data: Dict):
+        progress_broker.publish(channel, event, data)
+
+    return callback
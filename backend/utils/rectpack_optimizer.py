@@ -6,20 +6,78 @@
 """
 
 import logging
-from typing import List, Dict
+import threading
+from typing import Callable, List, Dict, Optional
+
+from utils.nesting_validator import SheetValidator, grid_cell, validation_report
+from utils.sheet_patterns import detect_patterns
 
 try:
     from rectpack import newPacker, PackingMode, PackingBin
+    from rectpack import MaxRectsBssf, MaxRectsBaf, MaxRectsBl, MaxRectsBlsf, SkylineMwfl, GuillotineBssfSas
+    from rectpack import SORT_AREA, SORT_LSIDE, SORT_PERI
+    from rectpack.packer import Packer, PackerBBFMixin
     RECTPACK_AVAILABLE = True
 except ImportError:
     RECTPACK_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
+# Портфель алгоритмов упаковки: имя -> (алгоритм, сортировка деталей)
+DEFAULT_ALGORITHM = 'maxrects_bssf'
+if RECTPACK_AVAILABLE:
+    ALGORITHMS = {
+        'maxrects_bssf': (MaxRectsBssf, SORT_AREA),
+        'maxrects_baf': (MaxRectsBaf, SORT_AREA),
+        'maxrects_bl': (MaxRectsBl, SORT_AREA),
+        'maxrects_blsf': (MaxRectsBlsf, SORT_AREA),
+        'maxrects_bssf_lside': (MaxRectsBssf, SORT_LSIDE),
+        'maxrects_bssf_peri': (MaxRectsBssf, SORT_PERI),
+        'skyline_mwfl': (SkylineMwfl, SORT_AREA),
+        'guillotine_bssf_sas': (GuillotineBssfSas, SORT_AREA),
+    }
+else:
+    ALGORITHMS = {}
+
+
+class NestingCancelled(Exception):
+    """Раскрой отменен (задание снято пользователем)"""
+
+
+if RECTPACK_AVAILABLE:
+    class _PackingHookMixin(object):
+        """
+        Вызывает on_rect перед размещением каждого прямоугольника.
+        
+        Стоит в MRO между Packer и миксином выбора листа, поэтому
+        срабатывает внутри цикла Packer.pack().
+        """
+        on_rect = None
+        
+        def add_rect(self, width, height, rid=None):
+            if self.on_rect is not None:
+                self.on_rect(width, height)
+            return super(_PackingHookMixin, self).add_rect(width, height, rid=rid)
+    
+    class _HookedPackerBBF(Packer, _PackingHookMixin, PackerBBFMixin):
+        """Аналог newPacker() по умолчанию (Offline, BBF) с хуком на каждый прямоугольник"""
+        pass
+
+
+def _new_packer(rotation: bool = True, on_rect=None, algorithm: str = DEFAULT_ALGORITHM):
+    """Создает packer с теми же настройками, что newPacker(), и хуком on_rect"""
+    pack_algo, sort_algo = ALGORITHMS[algorithm]
+    packer = _HookedPackerBBF(pack_algo=pack_algo, sort_algo=sort_algo, rotation=rotation)
+    packer.on_rect = on_rect
+    return packer
+
 
 def optimize_nesting(parts: List[Dict], sheet_width: float = 2500, 
                      sheet_height: float = 1250, allow_rotation: bool = True,
-                     cut_gap: float = 5.0, edge_margin: float = 10.0) -> Dict:
+                     cut_gap: float = 5.0, edge_margin: float = 10.0,
+                     cancel_event: Optional[threading.Event] = None,
+                     progress_callback: Optional[Callable[[str, Dict], None]] = None,
+                     algorithm: Optional[str] = None) -> Dict:
     """
     Оптимизирует раскрой деталей на листах
     
@@ -28,6 +86,11 @@ def optimize_nesting(parts: List[Dict], sheet_width: float = 2500,
         sheet_width: ширина листа
         sheet_height: высота листа
         allow_rotation: разрешить поворот деталей
+        cancel_event: событие отмены; проверяется перед размещением каждой детали
+        progress_callback: функция (event, data) для событий прогресса
+                           ('rects_placed', 'sheet_closed')
+        algorithm: алгоритм упаковки из ALGORITHMS (по умолчанию DEFAULT_ALGORITHM)
+                   или 'auto' - выбор по признакам заказа (utils.algorithm_selector)
     
     Returns:
         {
@@ -44,6 +107,18 @@ def optimize_nesting(parts: List[Dict], sheet_width: float = 2500,
             'error': 'rectpack not installed. Run: pip install rectpack'
         }
     
+    if algorithm == 'auto':
+        from utils.algorithm_selector import optimize_auto
+        return optimize_auto(parts, sheet_width=sheet_width, sheet_height=sheet_height,
+                             allow_rotation=allow_rotation, cut_gap=cut_gap, edge_margin=edge_margin,
+                             cancel_event=cancel_event, progress_callback=progress_callback)
+    
+    if algorithm is not None and algorithm not in ALGORITHMS:
+        return {
+            'success': False,
+            'error': f"Unknown algorithm: {algorithm}. Available: auto, {', '.join(ALGORITHMS)}"
+        }
+    
     try:
         logger.info(f"[NESTING] Оптимизация раскроя: {len(parts)} деталей")
         logger.info(f"   Лист: {sheet_width}x{sheet_height} мм")
@@ -58,11 +133,35 @@ def optimize_nesting(parts: List[Dict], sheet_width: float = 2500,
         
         logger.info("[NESTING] Создаю packer...")
         
+        # Хук на каждый прямоугольник: отмена и прогресс упаковки
+        packing_state = {'count': 0, 'area': 0.0, 'step': 1}
+        
+        def on_rect(width, height):
+            if cancel_event is not None and cancel_event.is_set():
+                raise NestingCancelled()
+            
+            if progress_callback is not None:
+                placed = packing_state['count']
+                if placed and placed % packing_state['step'] == 0:
+                    bins_used = max(len(packer), 1)
+                    progress_callback('rects_placed', {
+                        'placed': placed,
+                        'total': total_rects,
+                        'sheets': len(packer),
+                        'utilization_percent': round(packing_state['area'] / (bins_used * usable_width * usable_height) * 100, 2)
+                    })
+                packing_state['count'] += 1
+                packing_state['area'] += width * height
+        
+        use_hook = cancel_event is not None or progress_callback is not None
+        
         # Создаем packer с упрощенными параметрами
         # Используем более простую конфигурацию, чтобы избежать ошибок
         try:
-            packer = newPacker(
-                rotation=allow_rotation
+            packer = _new_packer(
+                rotation=allow_rotation,
+                on_rect=on_rect if use_hook else None,
+                algorithm=algorithm or DEFAULT_ALGORITHM
             )
             logger.info("[NESTING] Packer создан (простая конфигурация)")
         except Exception as packer_error:
@@ -162,11 +261,21 @@ def optimize_nesting(parts: List[Dict], sheet_width: float = 2500,
         
         logger.info(f"[NESTING] Добавлено {total_rects} прямоугольников")
         
+        # Около сотни событий прогресса на весь раскрой
+        packing_state['step'] = max(1, total_rects // 100)
+        
         # Выполняем раскрой
         logger.info("[NESTING] Выполняю упаковку...")
         try:
             packer.pack()
             logger.info("[NESTING] Упаковка завершена")
+        except NestingCancelled:
+            logger.info("[NESTING] Упаковка отменена")
+            return {
+                'success': False,
+                'cancelled': True,
+                'error': 'Раскрой отменен'
+            }
         except Exception as pack_error:
             logger.error(f"[ERROR] Ошибка выполнения упаковки: {pack_error}", exc_info=True)
             return {
@@ -177,14 +286,17 @@ def optimize_nesting(parts: List[Dict], sheet_width: float = 2500,
         # Собираем результаты
         logger.info("[NESTING] Собираю результаты...")
         sheets = []
+        sheet_issues = []  # проблемы листов для отчета валидации
         sheet_area = sheet_width * sheet_height
         total_parts_area = 0
+        validation_cell = grid_cell([max(float(p.get('width', 0)), float(p.get('height', 0))) for p in parts])
         
         bin_count = 0
         for bin_idx, bin_obj in enumerate(packer, 1):
             bin_count += 1
             sheet_parts = []
             sheet_used_area = 0
+            validator = SheetValidator(sheet_width, sheet_height, validation_cell)
             
             try:
                 # Преобразуем bin в list для безопасной итерации
@@ -300,17 +412,6 @@ def optimize_nesting(parts: List[Dict], sheet_width: float = 2500,
                         # Мы используем оригинальные размеры (orig_width, orig_height) в тех же координатах
                         # Это правильно, так как зазор уже учтен при размещении
                         
-                        # Проверяем пересечения с другими деталями на этом листе
-                        for existing_part in sheet_parts:
-                            # Проверяем, не пересекается ли новая деталь с уже размещенной
-                            if not (final_x + final_width <= existing_part['x'] or 
-                                   existing_part['x'] + existing_part['width'] <= final_x or
-                                   final_y + final_height <= existing_part['y'] or 
-                                   existing_part['y'] + existing_part['height'] <= final_y):
-                                logger.warning(f"[NESTING] Пересечение деталей: {part_name} с {existing_part['name']}")
-                                logger.warning(f"  {part_name}: x={final_x:.1f}, y={final_y:.1f}, w={final_width:.1f}, h={final_height:.1f} (повернута: {rotated})")
-                                logger.warning(f"  {existing_part['name']}: x={existing_part['x']:.1f}, y={existing_part['y']:.1f}, w={existing_part['width']:.1f}, h={existing_part['height']:.1f}")
-                        
                         # Проверяем, что деталь не выходит за границы листа
                         # Учитываем, что справа и снизу должен остаться зазор cut_gap/2
                         max_x = sheet_width - (cut_gap / 2.0)
@@ -329,7 +430,7 @@ def optimize_nesting(parts: List[Dict], sheet_width: float = 2500,
                             # Не добавляем деталь, которая выходит за границы
                             continue
                         
-                        sheet_parts.append({
+                        placement = {
                             'name': part_name,
                             'width': final_width,
                             'height': final_height,
@@ -338,7 +439,16 @@ def optimize_nesting(parts: List[Dict], sheet_width: float = 2500,
                             'rotated': rotated,
                             'position_number': position_number,
                             'area_m2': (final_width * final_height) / 1_000_000
-                        })
+                        }
+                        
+                        # Проверяем пересечения с другими деталями на этом листе (по сетке валидатора)
+                        for other in validator.add(placement):
+                            existing_part = sheet_parts[other]
+                            logger.warning(f"[NESTING] Пересечение деталей: {part_name} с {existing_part['name']}")
+                            logger.warning(f"  {part_name}: x={final_x:.1f}, y={final_y:.1f}, w={final_width:.1f}, h={final_height:.1f} (повернута: {rotated})")
+                            logger.warning(f"  {existing_part['name']}: x={existing_part['x']:.1f}, y={existing_part['y']:.1f}, w={existing_part['width']:.1f}, h={existing_part['height']:.1f}")
+                        
+                        sheet_parts.append(placement)
                         
                         # Используем финальные размеры для расчета площади (уже с учетом поворота)
                         part_area = final_width * final_height
@@ -366,6 +476,15 @@ def optimize_nesting(parts: List[Dict], sheet_width: float = 2500,
                     'waste_area_m2': waste / 1_000_000,
                     'utilization_percent': round(utilization, 2)
                 })
+                sheet_issues.append(validator.issues())
+                
+                if progress_callback is not None:
+                    progress_callback('sheet_closed', {
+                        'sheet_number': bin_idx,
+                        'parts_count': len(sheet_parts),
+                        'utilization_percent': round(utilization, 2),
+                        'best_utilization_percent': max(s['utilization_percent'] for s in sheets)
+                    })
         
         sheets_needed = len(sheets)
         total_sheet_area = sheets_needed * sheet_area
@@ -414,6 +533,14 @@ def optimize_nesting(parts: List[Dict], sheet_width: float = 2500,
             'sheet_height': sheet_height,
             'positions_summary': positions_summary
         }
+        if algorithm is not None:
+            result['algorithm'] = algorithm
+        
+        # Отчет валидации (как /api/nesting/validate) - собран при раскладке листов
+        result['validation'] = validation_report(sheets, sheet_issues, sheet_width, sheet_height)
+        
+        # Одинаковые листы (серийные заказы) - раскрой с числом повторов
+        detect_patterns(result)
         
         logger.info(f"[OK] Раскрой оптимизирован: {sheets_needed} листов, "
                    f"использование {overall_utilization:.1f}%")
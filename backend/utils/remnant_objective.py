@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Вторичная цель раскроя - крупный деловой остаток
+
+optimize_nesting минимизирует число листов, но свободное место
+остается разбросанным по всем листам, и calculate_wastes не находит
+пригодного обрезка. Пост-проход при том же числе листов:
+
+1. Переносит мелкие детали с наименее заполненного листа на самые
+   заполненные (если они там помещаются при перекладке листа) -
+   освободившийся лист может и вовсе исчезнуть.
+2. Поджимает детали каждого листа к углу: лист перекладывается
+   несколькими алгоритмами rectpack, остается раскладка с наибольшим
+   пустым прямоугольником (utils.free_rectangles).
+
+Наименее заполненный лист ставится последним. Проход ограничен
+по времени; при нехватке времени остается лучшее найденное.
+"""
+
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from utils.free_rectangles import largest_empty_rectangle
+from utils.nesting_validator import refresh_validation
+from utils.rectpack_optimizer import RECTPACK_AVAILABLE
+from utils.sheet_patterns import detect_patterns, group_sheets
+from utils.waste_calculator import MIN_WASTE_SIDE_MM
+
+if RECTPACK_AVAILABLE:
+    from rectpack import newPacker, PackingMode
+    from rectpack import MaxRectsBl, MaxRectsBssf, MaxRectsBaf, SkylineBl
+    from rectpack import SORT_AREA, SORT_LSIDE, SORT_PERI
+
+    # Варианты перекладки листа: (алгоритм, сортировка)
+    PACKINGS = [(algo, sort) for algo in (MaxRectsBl, MaxRectsBssf, MaxRectsBaf, SkylineBl)
+                for sort in (SORT_AREA, SORT_LSIDE, SORT_PERI)]
+    # Для проверки «помещается ли еще деталь» - только быстрые MaxRects
+    MOVE_PACKINGS = [(algo, SORT_AREA) for algo in (MaxRectsBssf, MaxRectsBl, MaxRectsBaf)]
+else:
+    PACKINGS = []
+    MOVE_PACKINGS = []
+
+logger = logging.getLogger(__name__)
+
+# Ограничение времени прохода по умолчанию, с
+DEFAULT_TIME_LIMIT_S = 1.0
+
+
+def _movable(sheets: List[Dict]) -> bool:
+    """Проход применим только к прямоугольному раскрою (без контуров, общих резов и вложений)"""
+    for sheet in sheets:
+        if sheet.get('segments'):
+            return False
+        for part in sheet.get('parts', []):
+            if part.get('contour') or part.get('inside') or part.get('nest_id') or part.get('rotation'):
+                return False
+    return True
+
+
+def _largest_remnant(parts: List[Dict], sheet_width: float, sheet_height: float) -> float:
+    """Площадь наибольшего пустого прямоугольника листа, мм²"""
+    obstacles = [(p['x'], p['y'], p['width'], p['height']) for p in parts]
+    rect = largest_empty_rectangle(sheet_width, sheet_height, obstacles, min_side=MIN_WASTE_SIDE_MM)
+    return rect[2] * rect[3] if rect else 0.0
+
+
+def _repack(parts: List[Dict], usable_width: float, usable_height: float, allow_rotation: bool,
+            cut_gap: float, edge_margin: float, packing) -> Optional[List[Dict]]:
+    """
+    Раскладка деталей на один лист заданным алгоритмом
+
+    Returns:
+        новые размещения или None, если на один лист не помещаются
+    """
+    pack_algo, sort_algo = packing
+    packer = newPacker(mode=PackingMode.Offline, pack_algo=pack_algo,
+                       sort_algo=sort_algo, rotation=allow_rotation)
+    packer.add_bin(usable_width, usable_height)
+    for idx, part in enumerate(parts):
+        width, height = (part['height'], part['width']) if part.get('rotated') else (part['width'], part['height'])
+        packer.add_rect(width + cut_gap, height + cut_gap, rid=idx)
+    packer.pack()
+
+    if len(packer) != 1 or len(packer[0]) != len(parts):
+        return None
+
+    placements = [None] * len(parts)
+    for rect in packer[0]:
+        part = parts[rect.rid]
+        width, height = (part['height'], part['width']) if part.get('rotated') else (part['width'], part['height'])
+        rotated = abs(rect.width - (width + cut_gap)) > 1e-6
+        final_width, final_height = (height, width) if rotated else (width, height)
+        placements[rect.rid] = dict(part, x=rect.x + edge_margin + cut_gap / 2,
+                                    y=rect.y + edge_margin + cut_gap / 2,
+                                    width=final_width, height=final_height, rotated=rotated)
+    return placements
+
+
+def _best_layout(parts: List[Dict], current: Optional[List[Dict]], sheet_width: float,
+                 sheet_height: float, pack_args: Tuple, deadline: float) -> Tuple[Optional[List[Dict]], float]:
+    """
+    Раскладка листа с наибольшим пустым прямоугольником
+
+    Args:
+        current: текущая раскладка (участвует в сравнении) или None
+
+    Returns:
+        (раскладка, площадь наибольшего остатка) или (None, 0), если детали
+        не помещаются на лист ни одним алгоритмом
+    """
+    best = current
+    best_area = _largest_remnant(current, sheet_width, sheet_height) if current is not None else -1.0
+    for packing in PACKINGS:
+        if time.monotonic() > deadline and best is not None:
+            break
+        layout = _repack(parts, *pack_args, packing)
+        if layout is None:
+            continue
+        area = _largest_remnant(layout, sheet_width, sheet_height)
+        if area > best_area + 1e-6:
+            best, best_area = layout, area
+    return best, max(best_area, 0.0)
+
+
+def consolidate_remnants(result: Dict, sheet_width: Optional[float] = None,
+                         sheet_height: Optional[float] = None, allow_rotation: bool = True,
+                         cut_gap: float = 5.0, edge_margin: float = 10.0,
+                         time_limit_s: float = DEFAULT_TIME_LIMIT_S) -> Dict:
+    """
+    Собирает свободное место в крупный остаток при том же числе листов
+
+    Args:
+        result: результат optimize_nesting (изменяется на месте)
+        sheet_width, sheet_height: по умолчанию - из результата
+        allow_rotation, cut_gap, edge_margin: как при раскрое
+        time_limit_s: ограничение времени прохода, с
+
+    Returns:
+        тот же результат; добавляется 'remnant_objective': наибольший
+        остаток до и после, перенесенные детали, время
+    """
+    if not result.get('success') or not RECTPACK_AVAILABLE or time_limit_s <= 0:
+        return result
+
+    sheets = result.get('sheets', [])
+    if not sheets or not _movable(sheets):
+        return result
+
+    started = time.monotonic()
+    deadline = started + time_limit_s
+    sheet_width = float(sheet_width or result.get('sheet_width', 2500))
+    sheet_height = float(sheet_height or result.get('sheet_height', 1250))
+    pack_args = (sheet_width - 2 * edge_margin - cut_gap, sheet_height - 2 * edge_margin - cut_gap,
+                 allow_rotation, cut_gap, edge_margin)
+
+    layouts = [list(sheet.get('parts', [])) for sheet in sheets]
+    before = max(_largest_remnant(parts, sheet_width, sheet_height) for parts in layouts)
+
+    # 1. Мелкие детали наименее заполненного листа - на самые заполненные
+    def used(parts):
+        return sum((p['width'] + cut_gap) * (p['height'] + cut_gap) for p in parts)
+
+    usable_area = pack_args[0] * pack_args[1]
+    remnant_idx = min(range(len(layouts)), key=lambda i: (used(layouts[i]), -i))
+    moved = 0
+    if len(layouts) > 1:
+        targets = sorted((i for i in range(len(layouts)) if i != remnant_idx),
+                         key=lambda i: -used(layouts[i]))
+        failed = []  # (меньшая, большая сторона) деталей, которые никуда не поместились
+        for part in sorted(layouts[remnant_idx], key=lambda p: p['width'] * p['height']):
+            if time.monotonic() > deadline:
+                break
+            sides = sorted((part['width'], part['height']))
+            # Не поместилась деталь не больше этой - эту не пробуем
+            if any(sides[0] >= a and sides[1] >= b for a, b in failed):
+                continue
+            part_area = (part['width'] + cut_gap) * (part['height'] + cut_gap)
+            for target in targets:
+                if used(layouts[target]) + part_area > usable_area:
+                    continue
+                layout = None
+                for packing in MOVE_PACKINGS:
+                    layout = _repack(layouts[target] + [part], *pack_args, packing)
+                    if layout is not None:
+                        break
+                if layout is not None:
+                    layouts[target] = layout
+                    layouts[remnant_idx] = [p for p in layouts[remnant_idx] if p is not part]
+                    moved += 1
+                    break
+            else:
+                failed.append(tuple(sides))
+
+    # 2. Поджатие к углу; одинаковые листы перекладываются один раз
+    order = [i for i in range(len(layouts)) if i != remnant_idx and layouts[i]]
+    if layouts[remnant_idx]:
+        order.append(remnant_idx)
+    new_sheets = [dict(sheets[i], parts=layouts[i]) for i in order]
+
+    for indices in group_sheets(new_sheets):
+        if time.monotonic() > deadline:
+            break
+        current = new_sheets[indices[0]]['parts']
+        layout, _ = _best_layout(current, current, sheet_width, sheet_height, pack_args, deadline)
+        for idx in indices:
+            new_sheets[idx]['parts'] = [dict(p) for p in layout]
+
+    sheet_area = sheet_width * sheet_height
+    total_parts_area = 0.0
+    for number, sheet in enumerate(new_sheets, start=1):
+        used_area = sum(p['area_m2'] for p in sheet['parts']) * 1_000_000
+        total_parts_area += used_area
+        sheet.update(sheet_number=number, parts_count=len(sheet['parts']),
+                     used_area_m2=used_area / 1_000_000,
+                     waste_area_m2=(sheet_area - used_area) / 1_000_000,
+                     utilization_percent=round(used_area / sheet_area * 100, 2))
+
+    after = max(_largest_remnant(s['parts'], sheet_width, sheet_height) for s in new_sheets)
+    # Перекладка не обязана улучшать: при худшем итоге остается исходный раскрой
+    if len(new_sheets) == len(sheets) and after < before:
+        logger.info("[REMNANT] Улучшения нет, раскрой не изменен")
+        return result
+
+    total_sheet_area = len(new_sheets) * sheet_area
+    utilization = total_parts_area / total_sheet_area * 100
+    result.update({
+        'sheets': new_sheets,
+        'sheets_needed': len(new_sheets),
+        'utilization_percent': round(utilization, 2),
+        'waste_percent': round(100 - utilization, 2),
+        'total_sheet_area_m2': round(total_sheet_area / 1_000_000, 4),
+        'total_waste_area_m2': round((total_sheet_area - total_parts_area) / 1_000_000, 4)
+    })
+    result['remnant_objective'] = {
+        'largest_remnant_before_m2': round(before / 1_000_000, 4),
+        'largest_remnant_m2': round(after / 1_000_000, 4),
+        'parts_moved': moved,
+        'time_s': round(time.monotonic() - started, 3)
+    }
+    detect_patterns(result)
+    refresh_validation(result)
+
+    logger.info(f"[REMNANT] Наибольший остаток {before / 1_000_000:.3f} -> {after / 1_000_000:.3f} м², "
+                f"перенесено деталей: {moved}, листов: {len(sheets)} -> {len(new_sheets)}")
+
+    return result
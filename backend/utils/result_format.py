@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Компактный (колоночный) формат результата раскроя
+
+Вместо списка словарей размещений по листам - по одному массиву на поле:
+
+    'placements': {
+        'x': [...], 'y': [...],          # мм, с точностью 0.1
+        'rotated': [0/1, ...],
+        'part': [индекс в 'parts', ...],
+        'pierce_x': [...], 'pierce_y': [...]  # точка врезки, если есть у всех деталей
+    },
+    'sheet_placements': [число размещений каждого листа, ...],
+    'parts': {                           # словарь деталей, тоже по колонкам
+        'name': [...], 'position_number': [...],
+        'width': [...], 'height': [...]  # без поворота
+    }
+
+Имя, позиция и размер детали хранятся один раз в 'parts': размер
+размещения - размер детали, переставленный для rotated. Размещения
+идут в порядке листов и в исходном порядке внутри листа (после
+utils.cut_sequence это порядок резки: 'cut_order' - номер размещения
+на листе с 1), лист размещения определяется по 'sheet_placements'.
+Листы ('sheets') остаются без 'parts', остальные поля результата - как есть.
+
+Форматы ответа: 'json' (обычный), 'columnar' (колонки в JSON),
+'msgpack' (колонки как little-endian буферы float32/uint8/uint16|uint32,
+типы - в 'column_types'),
+'npz' (numpy.savez_compressed, метаданные - JSON в массиве 'meta').
+При compact=True детали передаются только у первого листа каждого
+одинакового раскроя (utils.sheet_patterns.compact_patterns).
+Колоночные форматы - только для раскроя по габаритам (COLUMNAR_MODES):
+контуры и отверстия режима 'shape', вложения part_in_part, блоки
+common_line в колонки не укладываются, для этих режимов - только 'json'.
+"""
+
+import io
+import json
+import logging
+import sys
+from array import array
+from typing import Dict, Tuple
+
+from utils.sheet_patterns import compact_patterns
+
+logger = logging.getLogger(__name__)
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+RESULT_FORMATS = ('json', 'columnar', 'msgpack', 'npz')
+
+# Бинарные форматы и их необязательные зависимости
+FORMAT_DEPENDENCIES = {
+    'msgpack': ('msgpack', MSGPACK_AVAILABLE),
+    'npz': ('numpy', NUMPY_AVAILABLE)
+}
+
+# Режимы раскроя (nesting_mode), результат которых переводится в колонки без потерь
+COLUMNAR_MODES = ('rect',)
+
+# Типы колонок для бинарных форматов (код array / numpy)
+COLUMN_TYPES = {
+    'x': 'f',
+    'y': 'f',
+    'rotated': 'B',
+    'part': 'I',
+    'pierce_x': 'f',
+    'pierce_y': 'f'
+}
+
+# Колонки, которые есть только при наличии поля у всех размещений
+OPTIONAL_COLUMNS = {'pierce_x': 'pierce_point', 'pierce_y': 'pierce_point'}
+
+# Колонки словаря деталей
+PART_COLUMNS = ('name', 'position_number', 'width', 'height')
+
+NUMPY_TYPES = {'f': '<f4', 'B': 'u1', 'H': '<u2', 'I': '<u4'}
+
+
+def _compact_number(value: float, precision: int):
+    """Округление; целые значения - как int (короче в JSON)"""
+    value = round(value, precision)
+    return int(value) if value == int(value) else value
+
+
+def to_columnar(result: Dict, precision: int = 1) -> Dict:
+    """Результат optimize_nesting -> колоночный формат (координаты с точностью precision знаков)"""
+    columns = {name: [] for name in COLUMN_TYPES}
+    missing = set()
+    parts = {name: [] for name in PART_COLUMNS}
+    part_index = {}
+    sheets = []
+    sheet_placements = []
+
+    for sheet in result.get('sheets', []):
+        sheets.append({k: v for k, v in sheet.items() if k != 'parts'})
+        sheet_parts = sheet.get('parts', [])
+        sheet_placements.append(len(sheet_parts))
+
+        for placement in sheet_parts:
+            rotated = bool(placement.get('rotated'))
+            width = _compact_number(placement['width'], precision)
+            height = _compact_number(placement['height'], precision)
+            if rotated:
+                width, height = height, width
+            key = (placement['name'], placement.get('position_number', 0), width, height)
+            idx = part_index.get(key)
+            if idx is None:
+                idx = part_index[key] = len(part_index)
+                for name, value in zip(PART_COLUMNS, key):
+                    parts[name].append(value)
+
+            columns['x'].append(_compact_number(placement['x'], precision))
+            columns['y'].append(_compact_number(placement['y'], precision))
+            columns['rotated'].append(1 if rotated else 0)
+            columns['part'].append(idx)
+
+            pierce = placement.get('pierce_point')
+            if pierce is None:
+                missing.add('pierce_point')
+            else:
+                columns['pierce_x'].append(_compact_number(pierce[0], precision))
+                columns['pierce_y'].append(_compact_number(pierce[1], precision))
+
+    for name, field in OPTIONAL_COLUMNS.items():
+        if field in missing:
+            del columns[name]
+
+    columnar = {k: v for k, v in result.items() if k != 'sheets'}
+    columnar['format'] = 'columnar'
+    columnar['sheets'] = sheets
+    columnar['sheet_placements'] = sheet_placements
+    columnar['parts'] = parts
+    columnar['placements'] = columns
+    return columnar
+
+
+def _split_meta(columnar: Dict) -> Tuple[Dict, Dict, Dict]:
+    """Метаданные, колонки и типы колонок (индексы - uint16, если помещаются)"""
+    meta = {k: v for k, v in columnar.items() if k != 'placements'}
+    columns = columnar['placements']
+
+    codes = {}
+    for name, code in COLUMN_TYPES.items():
+        if name not in columns:
+            continue
+        if code == 'I' and max(columns[name], default=0) < 65536:
+            code = 'H'
+        codes[name] = code
+
+    return meta, columns, codes
+
+
+def to_msgpack(columnar: Dict) -> bytes:
+    """Колоночный формат -> MessagePack с бинарными колонками"""
+    if not MSGPACK_AVAILABLE:
+        raise RuntimeError('msgpack not installed. Run: pip install msgpack')
+
+    meta, columns, codes = _split_meta(columnar)
+    meta['placements'] = {}
+    for name, code in codes.items():
+        buffer = array(code, columns[name])
+        if sys.byteorder == 'big':
+            buffer.byteswap()
+        meta['placements'][name] = buffer.tobytes()
+    meta['column_types'] = {name: NUMPY_TYPES[code] for name, code in codes.items()}
+    return msgpack.packb(meta, use_bin_type=True)
+
+
+def to_npz(columnar: Dict) -> bytes:
+    """Колоночный формат -> numpy .npz (колонки + JSON метаданных в 'meta')"""
+    if not NUMPY_AVAILABLE:
+        raise RuntimeError('numpy not installed. Run: pip install numpy')
+
+    meta, columns, codes = _split_meta(columnar)
+    arrays = {
+        name: np.asarray(columns[name], dtype=NUMPY_TYPES[code]) for name, code in codes.items()
+    }
+    arrays['meta'] = np.frombuffer(json.dumps(meta, ensure_ascii=False).encode('utf-8'), dtype=np.uint8)
+
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def check_format(fmt: str, nesting_mode: str = 'rect') -> str:
+    """
+    Проверка формата ответа до расчета
+
+    Raises:
+        ValueError: неизвестный формат, формат без установленной зависимости
+                    или колоночный формат для режима не из COLUMNAR_MODES
+    """
+    if fmt not in RESULT_FORMATS:
+        raise ValueError(f"Unknown format: {fmt}. Available: {', '.join(RESULT_FORMATS)}")
+    package, available = FORMAT_DEPENDENCIES.get(fmt, (None, True))
+    if not available:
+        raise ValueError(f"Format unavailable: {fmt} ({package} not installed)")
+    if fmt != 'json' and nesting_mode not in COLUMNAR_MODES:
+        raise ValueError(f"Format {fmt} is only available for nesting_mode {', '.join(COLUMNAR_MODES)}, "
+                         f"not {nesting_mode}")
+    return fmt
+
+
+def encode_result(result: Dict, fmt: str, compact: bool = False) -> Tuple[object, str]:
+    """
+    Результат в запрошенном формате
+
+    Args:
+        compact: одинаковые раскрои - детали только у первого листа
+
+    Returns:
+        (dict для jsonify или bytes, mimetype)
+    """
+    check_format(fmt, result.get('nesting_mode', 'rect'))
+
+    if not result.get('success'):
+        return result, 'application/json'
+
+    if compact:
+        result = compact_patterns(result)
+
+    if fmt == 'json':
+        return result, 'application/json'
+
+    columnar = to_columnar(result)
+    if fmt == 'columnar':
+        return columnar, 'application/json'
+    if fmt == 'msgpack':
+        return to_msgpack(columnar), 'application/x-msgpack'
+    return to_npz(columnar), 'application/octet-stream'
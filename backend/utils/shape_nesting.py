@@ -0,0 +1,726 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Раскрой по реальному контуру (no-fit polygon, bottom-left)
+
+Детали раскладываются по наружным контурам из DXF, а не по габаритам.
+Невыпуклые контуры разбиваются на выпуклые части, NFP пары деталей
+строится как объединение сумм Минковского выпуклых частей (с зазором -
+еще и с восьмиугольником радиуса cut_gap). Позиция детали - самая нижняя,
+затем самая левая допустимая точка среди вершин NFP и точек пересечения
+их ребер.
+
+Прямоугольный раскрой (rectpack_optimizer) остается быстрым режимом
+по умолчанию.
+"""
+
+import logging
+import math
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from utils.part_geometry import (
+    clean_polygon, ensure_ccw, geometry_hash, part_geometry, polygon_area,
+    rotate_points, rotate_polygon, rotation_offset
+)
+from utils.nesting_validator import report_unplaced
+from utils.rectpack_optimizer import NestingCancelled
+from utils.sheet_patterns import detect_patterns
+
+logger = logging.getLogger(__name__)
+
+Point = Tuple[float, float]
+
+EPS = 1e-6
+MAX_SHEETS = 100
+DEFAULT_ROTATIONS = (0, 90, 180, 270)
+
+
+# ---------------------------------------------------------------------------
+# Выпуклая геометрия
+# ---------------------------------------------------------------------------
+
+def _cross(ax: float, ay: float, bx: float, by: float) -> float:
+    return ax * by - ay * bx
+
+
+def is_convex(points: Sequence[Point]) -> bool:
+    """Полигон (CCW) выпуклый"""
+    n = len(points)
+    for i in range(n):
+        ax, ay = points[i - 1]
+        bx, by = points[i]
+        cx, cy = points[(i + 1) % n]
+        if _cross(bx - ax, by - ay, cx - bx, cy - by) < -EPS:
+            return False
+    return True
+
+
+def _point_in_triangle(p, a, b, c) -> bool:
+    d1 = _cross(b[0] - a[0], b[1] - a[1], p[0] - a[0], p[1] - a[1])
+    d2 = _cross(c[0] - b[0], c[1] - b[1], p[0] - b[0], p[1] - b[1])
+    d3 = _cross(a[0] - c[0], a[1] - c[1], p[0] - c[0], p[1] - c[1])
+    return d1 >= -EPS and d2 >= -EPS and d3 >= -EPS
+
+
+def _ear_clip(points: List[Point]) -> List[Tuple[int, int, int]]:
+    """Триангуляция простого CCW полигона отсечением ушей"""
+    indices = list(range(len(points)))
+    triangles = []
+
+    while len(indices) > 3:
+        n = len(indices)
+        ear_found = False
+
+        for k in range(n):
+            i_prev, i_cur, i_next = indices[k - 1], indices[k], indices[(k + 1) % n]
+            a, b, c = points[i_prev], points[i_cur], points[i_next]
+
+            if _cross(b[0] - a[0], b[1] - a[1], c[0] - b[0], c[1] - b[1]) <= EPS:
+                continue
+
+            if any(_point_in_triangle(points[j], a, b, c)
+                   for j in indices if j not in (i_prev, i_cur, i_next)):
+                continue
+
+            triangles.append((i_prev, i_cur, i_next))
+            del indices[k]
+            ear_found = True
+            break
+
+        if not ear_found:
+            # Вырожденный контур - отсекаем первую выпуклую вершину без проверки
+            for k in range(n):
+                a, b, c = points[indices[k - 1]], points[indices[k]], points[indices[(k + 1) % n]]
+                if _cross(b[0] - a[0], b[1] - a[1], c[0] - b[0], c[1] - b[1]) > 0:
+                    break
+            triangles.append((indices[k - 1], indices[k], indices[(k + 1) % n]))
+            del indices[k]
+
+    triangles.append(tuple(indices))
+    return triangles
+
+
+def _hertel_mehlhorn(points: List[Point], triangles: List[Tuple[int, int, int]]) -> List[List[int]]:
+    """Склеивает треугольники по диагоналям, пока части остаются выпуклыми"""
+    polygons = [list(t) for t in triangles]
+
+    merged = True
+    while merged:
+        merged = False
+        edges = {}
+        for pid, poly in enumerate(polygons):
+            for i in range(len(poly)):
+                edges[(poly[i], poly[(i + 1) % len(poly)])] = pid
+
+        for (a, b), pid in edges.items():
+            qid = edges.get((b, a))
+            if qid is None or qid == pid:
+                continue
+
+            p, q = polygons[pid], polygons[qid]
+            ib = p.index(b)
+            p_rot = p[ib:] + p[:ib]              # b ... a
+            ia = q.index(a)
+            q_rot = q[ia:] + q[:ia]              # a ... b
+            candidate = p_rot + q_rot[1:-1]
+
+            if is_convex([points[i] for i in candidate]):
+                polygons[pid] = candidate
+                del polygons[qid]
+                merged = True
+                break
+
+    return polygons
+
+
+def convex_decompose(points: Sequence[Point]) -> List[List[Point]]:
+    """Разбиение простого полигона на выпуклые части"""
+    pts = clean_polygon(ensure_ccw(points))
+    if len(pts) < 3:
+        return []
+    if is_convex(pts):
+        return [pts]
+
+    triangles = _ear_clip(pts)
+    parts = _hertel_mehlhorn(pts, triangles)
+    return [clean_polygon([pts[i] for i in part]) for part in parts]
+
+
+def minkowski_convex(p: Sequence[Point], q: Sequence[Point]) -> List[Point]:
+    """Сумма Минковского двух выпуклых CCW полигонов"""
+    def lowest_first(poly):
+        k = min(range(len(poly)), key=lambda i: (poly[i][1], poly[i][0]))
+        return list(poly[k:]) + list(poly[:k])
+
+    p = lowest_first(p)
+    q = lowest_first(q)
+    n, m = len(p), len(q)
+    p = p + p[:2]
+    q = q + q[:2]
+
+    result = []
+    i = j = 0
+    while i < n or j < m:
+        result.append((p[i][0] + q[j][0], p[i][1] + q[j][1]))
+        cross = _cross(p[i + 1][0] - p[i][0], p[i + 1][1] - p[i][1],
+                       q[j + 1][0] - q[j][0], q[j + 1][1] - q[j][1])
+        if cross >= 0 and i < n:
+            i += 1
+        if cross <= 0 and j < m:
+            j += 1
+
+    return clean_polygon(result)
+
+
+def gap_polygon(gap: float) -> List[Point]:
+    """Восьмиугольник, описанный вокруг окружности радиуса gap"""
+    radius = gap / math.cos(math.pi / 8)
+    return [
+        (radius * math.cos(math.radians(22.5 + 45 * k)), radius * math.sin(math.radians(22.5 + 45 * k)))
+        for k in range(8)
+    ]
+
+
+def compute_nfp(fixed_pieces: List[List[Point]], moving_pieces: List[List[Point]],
+                gap: float = 0.0) -> List[List[Point]]:
+    """
+    NFP неподвижной детали A и перемещаемой B как набор выпуклых частей
+
+    Точка отсчета B - начало ее локальных координат. B в позиции t пересекает A
+    (или подходит ближе gap), если t строго внутри одной из частей.
+    """
+    octagon = gap_polygon(gap) if gap > 0 else None
+    pieces = []
+
+    for a in fixed_pieces:
+        for b in moving_pieces:
+            piece = minkowski_convex(a, [(-x, -y) for x, y in b])
+            if octagon:
+                piece = minkowski_convex(piece, octagon)
+            pieces.append(piece)
+
+    return pieces
+
+
+# ---------------------------------------------------------------------------
+# Раскладка
+# ---------------------------------------------------------------------------
+
+class _Shape:
+    """Деталь в конкретном повороте"""
+
+    __slots__ = ('key', 'geometry_key', 'geometry', 'angle', 'outer', 'holes', 'width', 'height',
+                 'area', 'pieces')
+
+    def __init__(self, geometry_key: str, geometry: Dict, angle: float):
+        self.geometry_key = geometry_key
+        self.geometry = geometry
+        self.angle = angle
+        self.key = (geometry_key, angle)
+
+        outer = [tuple(p) for p in geometry['outer']]
+        rotated_all = rotate_polygon(outer + [tuple(p) for h in geometry['holes'] for p in h], angle)
+        self.outer = rotated_all[:len(outer)]
+
+        self.holes = []
+        offset = len(outer)
+        for hole in geometry['holes']:
+            self.holes.append(rotated_all[offset:offset + len(hole)])
+            offset += len(hole)
+
+        self.width = max(x for x, _ in self.outer)
+        self.height = max(y for _, y in self.outer)
+        self.area = geometry.get('area') or abs(polygon_area(self.outer))
+        self.pieces = convex_decompose(self.outer)
+
+
+def base_nfp(geometry_a: Dict, geometry_b: Dict, relative_rotation: float,
+             gap: float) -> List[List[Point]]:
+    """NFP детали A без поворота и детали B, повернутой на relative_rotation (для кэша)"""
+    fixed = _Shape('a', geometry_a, 0.0)
+    moving = _Shape('b', geometry_b, relative_rotation)
+    return compute_nfp(fixed.pieces, moving.pieces, gap)
+
+
+def _orient_nfp(base: List[List[Point]], fixed: _Shape, moving: _Shape,
+                relative_rotation: float) -> List[List[Point]]:
+    """
+    NFP для поворотов (fixed.angle, moving.angle) из base_nfp
+
+    Повороты в _Shape переносят габарит в (0, 0), отсюда сдвиг:
+    t = o_B(rB) - o_A(rA) - R(rA) * o_B(rel), где o_X(r) - rotation_offset.
+    Восьмиугольник зазора при повороте на угол, кратный 45°, не меняется,
+    иначе остается описанным вокруг той же окружности.
+    """
+    outer_a = fixed.geometry['outer']
+    outer_b = moving.geometry['outer']
+
+    oa_x, oa_y = rotation_offset(outer_a, fixed.angle)
+    ob_x, ob_y = rotation_offset(outer_b, moving.angle)
+    (orel_x, orel_y), = rotate_points([rotation_offset(outer_b, relative_rotation)], fixed.angle)
+
+    tx = ob_x - oa_x - orel_x
+    ty = ob_y - oa_y - orel_y
+
+    return [[(x + tx, y + ty) for x, y in rotate_points(piece, fixed.angle)] for piece in base]
+
+
+class _PieceIndex:
+    """Равномерная сетка по габаритам выпуклых частей NFP"""
+
+    def __init__(self, cell: float):
+        self.cell = cell
+        self.cells = {}
+        self.pieces = []  # (poly, min_x, min_y, max_x, max_y, owner)
+
+    def add(self, poly: List[Point], owner: int):
+        xs = [p[0] for p in poly]
+        ys = [p[1] for p in poly]
+        entry = (poly, min(xs), min(ys), max(xs), max(ys), owner)
+        idx = len(self.pieces)
+        self.pieces.append(entry)
+
+        c = self.cell
+        for cx in range(int(math.floor(entry[1] / c)), int(math.floor(entry[3] / c)) + 1):
+            for cy in range(int(math.floor(entry[2] / c)), int(math.floor(entry[4] / c)) + 1):
+                self.cells.setdefault((cx, cy), []).append(idx)
+
+    def blocked(self, x: float, y: float) -> bool:
+        """Точка строго внутри какой-либо части"""
+        bucket = self.cells.get((int(math.floor(x / self.cell)), int(math.floor(y / self.cell))))
+        if not bucket:
+            return False
+
+        for idx in bucket:
+            poly, min_x, min_y, max_x, max_y, _ = self.pieces[idx]
+            if x <= min_x + EPS or x >= max_x - EPS or y <= min_y + EPS or y >= max_y - EPS:
+                continue
+            inside = True
+            n = len(poly)
+            for i in range(n):
+                ax, ay = poly[i]
+                bx, by = poly[(i + 1) % n]
+                if (bx - ax) * (y - ay) - (by - ay) * (x - ax) <= EPS * (abs(bx - ax) + abs(by - ay)):
+                    inside = False
+                    break
+            if inside:
+                return True
+
+        return False
+
+
+class _Sheet:
+    """Лист с размещенными деталями"""
+
+    def __init__(self, number: int, cell: float):
+        self.number = number
+        self.cell = cell
+        self.placed = []        # (shape, x, y, part_index)
+        self.used_area = 0.0
+        self.indexes = {}       # shape.key -> (_PieceIndex, число учтенных деталей)
+        self.failed = set()     # shape.key, для которых места уже нет
+        # Допустимая область формы на листе только сужается, поэтому
+        # нижняя-левая позиция не опускается ниже найденной ранее
+        self.lower_bounds = {}  # shape.key -> y последней найденной позиции
+
+
+class ShapeNester:
+    """Bottom-left раскладка по NFP"""
+
+    def __init__(self, sheet_width: float, sheet_height: float, cut_gap: float, edge_margin: float,
+                 nfp_cache=None):
+        self.sheet_width = sheet_width
+        self.sheet_height = sheet_height
+        self.cut_gap = cut_gap
+        # Как в прямоугольном режиме: отступ от края + половина зазора
+        self.margin = edge_margin + cut_gap / 2.0
+        self.cell = max(sheet_width, sheet_height) / 32.0
+        self.usable_area = (sheet_width - 2 * edge_margin) * (sheet_height - 2 * edge_margin)
+        self.nfp_cache = nfp_cache  # utils.nfp_cache.NfpCache или None
+        self.nfp_memo = {}
+        self.sheets = []
+
+    def fits_sheet(self, shape: _Shape) -> bool:
+        """Габарит формы помещается в рабочую область пустого листа"""
+        return (shape.width <= self.sheet_width - 2 * self.margin + EPS and
+                shape.height <= self.sheet_height - 2 * self.margin + EPS)
+
+    def nfp(self, fixed: _Shape, moving: _Shape) -> List[List[Point]]:
+        key = (fixed.key, moving.key)
+        pieces = self.nfp_memo.get(key)
+        if pieces is not None:
+            return pieces
+
+        if self.nfp_cache is None:
+            pieces = compute_nfp(fixed.pieces, moving.pieces, self.cut_gap)
+        else:
+            relative = (moving.angle - fixed.angle) % 360
+            base = self.nfp_cache.get_or_compute(
+                fixed.geometry_key, moving.geometry_key, relative, self.cut_gap,
+                lambda: base_nfp(fixed.geometry, moving.geometry, relative, self.cut_gap)
+            )
+            pieces = _orient_nfp(base, fixed, moving, relative)
+
+        self.nfp_memo[key] = pieces
+        return pieces
+
+    def _index(self, sheet: _Sheet, shape: _Shape) -> _PieceIndex:
+        """Индекс NFP листа для формы, дополняется новыми деталями"""
+        index, counted = sheet.indexes.get(shape.key, (None, 0))
+        if index is None:
+            index = _PieceIndex(self.cell)
+
+        for owner in range(counted, len(sheet.placed)):
+            placed_shape, px, py, _ = sheet.placed[owner]
+            for piece in self.nfp(placed_shape, shape):
+                index.add([(x + px, y + py) for x, y in piece], owner)
+
+        sheet.indexes[shape.key] = (index, len(sheet.placed))
+        return index
+
+    def bottom_left(self, sheet: _Sheet, shape: _Shape) -> Optional[Point]:
+        """Самая нижняя, затем самая левая допустимая позиция формы на листе"""
+        if shape.key in sheet.failed:
+            return None
+
+        x_min = self.margin
+        y_min = self.margin
+        x_max = self.sheet_width - self.margin - shape.width
+        y_max = self.sheet_height - self.margin - shape.height
+        if x_max < x_min - EPS or y_max < y_min - EPS:
+            sheet.failed.add(shape.key)
+            return None
+
+        if sheet.used_area + shape.area > self.usable_area:
+            sheet.failed.add(shape.key)
+            return None
+
+        index = self._index(sheet, shape)
+        y_low = max(y_min, sheet.lower_bounds.get(shape.key, y_min)) - EPS
+
+        def inside_ifp(x, y):
+            return x_min - EPS <= x <= x_max + EPS and y_low <= y <= y_max + EPS
+
+        def first_free(points, limit=None):
+            points.sort(key=lambda p: (p[1], p[0]))
+            for x, y in points:
+                if limit is not None and (y, x) >= limit:
+                    break
+                x = min(max(x, x_min), x_max)
+                y = min(max(y, y_min), y_max)
+                if not index.blocked(x, y):
+                    return (x, y)
+            return None
+
+        # 1. Углы IFP, вершины NFP и пересечения ребер NFP с границей IFP
+        candidates = [(x_min, y_min), (x_max, y_min), (x_min, y_max), (x_max, y_max)]
+        edges = []
+
+        for poly, p_min_x, p_min_y, p_max_x, p_max_y, owner in index.pieces:
+            if p_max_x < x_min or p_min_x > x_max or p_max_y < y_low or p_min_y > y_max:
+                continue
+            n = len(poly)
+            for i in range(n):
+                ax, ay = poly[i]
+                bx, by = poly[(i + 1) % n]
+                if inside_ifp(ax, ay):
+                    candidates.append((ax, ay))
+                if ay < y_low and by < y_low:
+                    continue
+                edges.append((ax, ay, bx, by, owner))
+
+                for line_y in (y_min, y_max):
+                    if (ay - line_y) * (by - line_y) < 0:
+                        x = ax + (line_y - ay) * (bx - ax) / (by - ay)
+                        if x_min <= x <= x_max:
+                            candidates.append((x, line_y))
+                for line_x in (x_min, x_max):
+                    if (ax - line_x) * (bx - line_x) < 0:
+                        y = ay + (line_x - ax) * (by - ay) / (bx - ax)
+                        if y_min <= y <= y_max:
+                            candidates.append((line_x, y))
+
+        best = first_free([p for p in candidates if p[1] >= y_low])
+
+        # 2. Пересечения ребер NFP разных деталей (позиции "в углу" между деталями).
+        # Нужны только точки ниже/левее уже найденной - берем ребра не выше нее.
+        limit = (best[1], best[0]) if best else None
+        if limit is not None:
+            edges = [e for e in edges if min(e[1], e[3]) < limit[0] + EPS]
+
+        if len(edges) > 1:
+            c = self.cell
+            buckets = {}
+            for e_idx, (ax, ay, bx, by, _) in enumerate(edges):
+                for cx in range(int(math.floor(min(ax, bx) / c)), int(math.floor(max(ax, bx) / c)) + 1):
+                    for cy in range(int(math.floor(min(ay, by) / c)), int(math.floor(max(ay, by) / c)) + 1):
+                        buckets.setdefault((cx, cy), []).append(e_idx)
+
+            crossings = []
+            for (cx, cy), bucket in buckets.items():
+                for i in range(len(bucket)):
+                    ax, ay, bx, by, o1 = edges[bucket[i]]
+                    rx, ry = bx - ax, by - ay
+                    for j in range(i + 1, len(bucket)):
+                        px, py, qx, qy, o2 = edges[bucket[j]]
+                        if o1 == o2:
+                            continue
+                        sx, sy = qx - px, qy - py
+                        d = rx * sy - ry * sx
+                        if abs(d) < 1e-12:
+                            continue
+                        t = ((px - ax) * sy - (py - ay) * sx) / d
+                        u = ((px - ax) * ry - (py - ay) * rx) / d
+                        if t < -EPS or t > 1 + EPS or u < -EPS or u > 1 + EPS:
+                            continue
+                        x = ax + t * rx
+                        y = ay + t * ry
+                        # Пара ребер встречается в нескольких ячейках - точку берем в одной
+                        if int(math.floor(x / c)) != cx or int(math.floor(y / c)) != cy:
+                            continue
+                        if inside_ifp(x, y):
+                            crossings.append((x, y))
+
+            better = first_free(crossings, limit)
+            if better is not None:
+                best = better
+
+        if best is not None:
+            sheet.lower_bounds[shape.key] = best[1]
+            return best
+
+        sheet.failed.add(shape.key)
+        return None
+
+    def place(self, sheet: _Sheet, shape: _Shape, x: float, y: float, part_index: int):
+        sheet.placed.append((shape, x, y, part_index))
+        sheet.used_area += shape.area
+
+    def new_sheet(self) -> _Sheet:
+        sheet = _Sheet(len(self.sheets) + 1, self.cell)
+        self.sheets.append(sheet)
+        return sheet
+
+
+def _placement_dict(shape: _Shape, x: float, y: float, name: str, position_number: int,
+                    geometry_id: Optional[str]) -> Dict:
+    """Размещение детали в формате результата optimize_nesting"""
+    def moved(points):
+        return [[round(px + x, 2), round(py + y, 2)] for px, py in points]
+
+    placement = {
+        'name': name,
+        'width': round(shape.width, 3),
+        'height': round(shape.height, 3),
+        'x': x,
+        'y': y,
+        'rotated': shape.angle % 180 != 0,
+        'rotation': shape.angle,
+        'position_number': position_number,
+        'area_m2': shape.area / 1_000_000,
+        'contour': moved(shape.outer),
+        'holes': [moved(h) for h in shape.holes]
+    }
+    if geometry_id:
+        placement['geometry_id'] = geometry_id
+    return placement
+
+
+def optimize_shape_nesting(parts: List[Dict], sheet_width: float = 2500,
+                           sheet_height: float = 1250, allow_rotation: bool = True,
+                           cut_gap: float = 5.0, edge_margin: float = 10.0,
+                           rotations: Optional[Sequence[float]] = None,
+                           cancel_event: Optional[threading.Event] = None,
+                           progress_callback: Optional[Callable[[str, Dict], None]] = None,
+                           nfp_cache=None) -> Dict:
+    """
+    Раскрой по реальным контурам деталей
+
+    Args:
+        parts: детали как в optimize_nesting; контур берется из 'contour'/'holes',
+               'geometry_id' (загруженный DXF) или прямоугольник width x height
+        rotations: допустимые углы поворота, градусы (по умолчанию 0/90/180/270,
+                   без поворота - только 0)
+        nfp_cache: постоянный кэш NFP (utils.nfp_cache.NfpCache), None - только в памяти
+
+    Returns:
+        результат в формате optimize_nesting; у размещений дополнительно
+        'rotation', 'contour', 'holes' и 'area_m2' по реальной площади контура;
+        'unplaced' - неразмещенные детали (они же - ошибки в 'validation')
+    """
+    try:
+        if rotations is None:
+            rotations = DEFAULT_ROTATIONS if allow_rotation else (0,)
+        rotations = [float(a) % 360 for a in rotations] or [0.0]
+
+        logger.info(f"[SHAPE] Раскрой по контуру: {len(parts)} позиций, повороты {rotations}")
+
+        nester = ShapeNester(sheet_width, sheet_height, cut_gap, edge_margin, nfp_cache)
+
+        # Формы деталей во всех поворотах
+        instances = []   # (shapes, name, position_number, geometry_id)
+        position_map = {}
+        usage = {}
+        for part in parts:
+            name = part.get('name', 'unknown')
+            quantity = int(part.get('quantity', 1))
+            geometry = part_geometry(part)
+
+            if geometry['width'] <= 0 or geometry['height'] <= 0:
+                logger.warning(f"   [WARN] Пропущена деталь с некорректными размерами: {name}")
+                continue
+
+            geometry_key = geometry_hash(geometry)
+            shapes = [_Shape(geometry_key, geometry, angle) for angle in rotations]
+
+            previous = usage.get(geometry_key, (geometry, 0))[1]
+            usage[geometry_key] = (geometry, previous + quantity)
+
+            if name not in position_map:
+                position_map[name] = len(position_map) + 1
+
+            for _ in range(quantity):
+                instances.append((shapes, name, position_map[name], part.get('geometry_id')))
+
+        if nfp_cache is not None:
+            nfp_cache.record_usage(usage)
+
+        # Крупные детали первыми
+        instances.sort(key=lambda item: -item[0][0].area)
+        total = len(instances)
+        step = max(1, total // 100)
+        unplaced = {}  # (name, reason) -> {'name', 'position_number', 'quantity', 'reason'}
+
+        for done, (shapes, name, position_number, geometry_id) in enumerate(instances):
+            if cancel_event is not None and cancel_event.is_set():
+                raise NestingCancelled()
+
+            placed = False
+            reason = 'too_large'
+            for sheet in nester.sheets + [None]:
+                if sheet is None:
+                    if len(nester.sheets) >= MAX_SHEETS:
+                        if any(nester.fits_sheet(shape) for shape in shapes):
+                            reason = 'sheet_limit'
+                        break
+                    sheet = nester.new_sheet()
+
+                best = None
+                for shape in shapes:
+                    position = nester.bottom_left(sheet, shape)
+                    if position is None:
+                        continue
+                    score = (position[1], position[0], shape.height)
+                    if best is None or score < best[0]:
+                        best = (score, shape, position)
+
+                if best:
+                    _, shape, (x, y) = best
+                    nester.place(sheet, shape, x, y, done)
+                    placed = True
+                    break
+
+                if not sheet.placed:
+                    # Не помещается даже на пустой лист
+                    nester.sheets.remove(sheet)
+                    break
+
+            if not placed:
+                item = unplaced.setdefault((name, reason), {'name': name, 'position_number': position_number,
+                                                            'quantity': 0, 'reason': reason})
+                item['quantity'] += 1
+                if reason == 'sheet_limit':
+                    logger.warning(f"   [WARN] Деталь {name} не размещена: достигнут лимит {MAX_SHEETS} листов")
+                else:
+                    logger.warning(f"   [WARN] Деталь {name} не помещается на лист")
+
+            if progress_callback is not None and done % step == 0:
+                used = sum(s.used_area for s in nester.sheets)
+                sheets_count = max(len(nester.sheets), 1)
+                progress_callback('rects_placed', {
+                    'placed': done + 1,
+                    'total': total,
+                    'sheets': len(nester.sheets),
+                    'utilization_percent': round(used / (sheets_count * sheet_width * sheet_height) * 100, 2)
+                })
+
+        if nfp_cache is not None:
+            nfp_cache.flush()
+
+        # Сборка результата в формате optimize_nesting
+        sheet_area = sheet_width * sheet_height
+        sheets = []
+        total_parts_area = 0.0
+
+        for sheet in nester.sheets:
+            sheet_parts = []
+            for shape, x, y, idx in sheet.placed:
+                _, name, position_number, geometry_id = instances[idx]
+                sheet_parts.append(_placement_dict(shape, x, y, name, position_number, geometry_id))
+
+            utilization = sheet.used_area / sheet_area * 100
+            total_parts_area += sheet.used_area
+            sheets.append({
+                'sheet_number': sheet.number,
+                'parts_count': len(sheet_parts),
+                'parts': sheet_parts,
+                'used_area_m2': sheet.used_area / 1_000_000,
+                'waste_area_m2': (sheet_area - sheet.used_area) / 1_000_000,
+                'utilization_percent': round(utilization, 2)
+            })
+
+            if progress_callback is not None:
+                progress_callback('sheet_closed', {
+                    'sheet_number': sheet.number,
+                    'parts_count': len(sheet_parts),
+                    'utilization_percent': round(utilization, 2),
+                    'best_utilization_percent': max(s['utilization_percent'] for s in sheets)
+                })
+
+        sheets_needed = len(sheets)
+        total_sheet_area = sheets_needed * sheet_area
+        overall_utilization = total_parts_area / total_sheet_area * 100 if total_sheet_area > 0 else 0
+
+        position_data = {}
+        for sheet in sheets:
+            for part in sheet['parts']:
+                pos = position_data.setdefault(part['position_number'], {
+                    'position_number': part['position_number'],
+                    'name': part['name'],
+                    'width': part['width'] if not part['rotated'] else part['height'],
+                    'height': part['height'] if not part['rotated'] else part['width'],
+                    'area_m2': part['area_m2'],
+                    'quantity': 0,
+                    'total_area_m2': 0
+                })
+                pos['quantity'] += 1
+                pos['total_area_m2'] += part['area_m2']
+
+        logger.info(f"[SHAPE] Готово: {sheets_needed} листов, использование {overall_utilization:.1f}%, "
+                    f"не размещено {sum(item['quantity'] for item in unplaced.values())}, NFP построено/взято: {len(nester.nfp_memo)}")
+
+        result = detect_patterns({
+            'success': True,
+            'nesting_mode': 'shape',
+            'rotations': rotations,
+            'sheets_needed': sheets_needed,
+            'utilization_percent': round(overall_utilization, 2),
+            'waste_percent': round(100 - overall_utilization, 2),
+            'total_parts_area_m2': round(total_parts_area / 1_000_000, 4),
+            'total_sheet_area_m2': round(total_sheet_area / 1_000_000, 4),
+            'total_waste_area_m2': round((total_sheet_area - total_parts_area) / 1_000_000, 4),
+            'sheets': sheets,
+            'sheet_width': sheet_width,
+            'sheet_height': sheet_height,
+            'positions_summary': sorted(position_data.values(), key=lambda p: p['position_number'])
+        })
+        # Неразмещенные детали не пропадают из заказа молча
+        return report_unplaced(result, list(unplaced.values()))
+
+    except NestingCancelled:
+        logger.info("[SHAPE] Раскрой отменен")
+        return {'success': False, 'cancelled': True, 'error': 'Раскрой отменен'}
+    except Exception as e:
+        logger.error(f"[ERROR] Ошибка раскроя по контуру: {e}", exc_info=True)
+        return {'success': False, 'error': str(e)}
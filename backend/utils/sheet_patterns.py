@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Одинаковые раскрои листов (patterns)
+
+Серийные заказы дают десятки листов с одной и той же раскладкой.
+После раскроя такие листы группируются: каждый уникальный раскрой
+описывается один раз с числом повторов и номерами листов, а экспорт
+и валидация выполняют работу по раскрою однократно.
+
+Раскрой листа определяется набором размещений
+(имя, x, y, ширина, высота, поворот).
+"""
+
+import hashlib
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Точность сравнения координат, мм
+SIGNATURE_PRECISION = 3
+
+
+def _value(value, precision: Optional[int]):
+    if precision is None or not isinstance(value, (int, float)):
+        return value
+    return round(value, precision)
+
+
+def pattern_signature(sheet: Dict, ordered: bool = False,
+                      precision: Optional[int] = SIGNATURE_PRECISION) -> tuple:
+    """
+    Ключ раскроя листа
+
+    Args:
+        sheet: лист результата раскроя
+        ordered: учитывать порядок деталей (для побайтно одинакового
+                 вывода, зависящего от порядка - валидация)
+        precision: округление координат (None - сравнение без округления)
+    """
+    signature = []
+    for part in sheet.get('parts', []):
+        signature.append((
+            part.get('name'),
+            'name' in part,
+            _value(part.get('x', 0), precision),
+            _value(part.get('y', 0), precision),
+            _value(part.get('width', 0), precision),
+            _value(part.get('height', 0), precision),
+            bool(part.get('rotated', False)),
+            _value(part.get('rotation', 0), precision)
+        ))
+    if not ordered:
+        signature.sort(key=repr)
+    return tuple(signature)
+
+
+def group_sheets(sheets: List[Dict], ordered: bool = False,
+                 precision: Optional[int] = SIGNATURE_PRECISION) -> List[List[int]]:
+    """
+    Группирует одинаковые листы
+
+    Returns:
+        индексы листов по группам, группы - в порядке первого появления
+    """
+    groups = {}
+    for idx, sheet in enumerate(sheets):
+        groups.setdefault(pattern_signature(sheet, ordered, precision), []).append(idx)
+    return list(groups.values())
+
+
+def signature_key(sheet: Dict, ordered: bool = False,
+                  precision: Optional[int] = SIGNATURE_PRECISION) -> bytes:
+    """Короткий ключ раскроя (хеш pattern_signature) - для листов, которые не держатся в памяти"""
+    return hashlib.sha1(repr(pattern_signature(sheet, ordered, precision)).encode('utf-8')).digest()
+
+
+def iter_sheet_groups(sheets: Iterable[Dict]) -> Iterator[Tuple[Dict, List]]:
+    """
+    group_sheets для листов, читаемых по одному (utils.json_stream)
+
+    Два прохода: ключи раскроев, затем первый лист каждой группы.
+    Лист компактного результата (без 'parts') относится к раскрою
+    первого листа с тем же 'pattern_id', как в expand_patterns.
+
+    Args:
+        sheets: листы, по которым можно пройти дважды (список, json_stream.SpooledArray)
+
+    Yields:
+        (первый лист группы, номера листов группы) в порядке первого появления
+    """
+    keys = {}
+    by_pattern = {}
+    first = []  # индекс первого листа каждой группы
+    numbers = []  # номера листов каждой группы
+    for idx, sheet in enumerate(sheets):
+        pattern_id = sheet.get('pattern_id')
+        if 'parts' not in sheet and pattern_id in by_pattern:
+            key = by_pattern[pattern_id]
+        else:
+            key = signature_key(sheet)
+            if pattern_id is not None:
+                by_pattern.setdefault(pattern_id, key)
+        group = keys.setdefault(key, len(keys))
+        if group == len(first):
+            first.append(idx)
+            numbers.append([])
+        numbers[group].append(sheet.get('sheet_number', idx + 1))
+
+    group_of_first = {idx: group for group, idx in enumerate(first)}
+    for idx, sheet in enumerate(sheets):
+        group = group_of_first.get(idx)
+        if group is not None:
+            yield sheet, numbers[group]
+
+
+def format_sheet_numbers(numbers: List[int]) -> str:
+    """[1, 2, 3, 5] -> '1-3, 5'"""
+    ranges = []
+    for number in sorted(numbers):
+        if ranges and number == ranges[-1][1] + 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ', '.join(str(a) if a == b else f'{a}-{b}' for a, b in ranges)
+
+
+def detect_patterns(result: Dict) -> Dict:
+    """
+    Находит одинаковые раскрои и добавляет их в результат
+
+    Листам добавляется 'pattern_id', результату - 'patterns':
+    [{'pattern_id', 'sheet_numbers', 'repeat_count', 'parts_count',
+      'used_area_m2', 'utilization_percent'}]
+
+    Returns:
+        тот же результат (изменяется на месте)
+    """
+    sheets = result.get('sheets', [])
+    patterns = []
+
+    for pattern_id, indices in enumerate(group_sheets(sheets), start=1):
+        for idx in indices:
+            sheets[idx]['pattern_id'] = pattern_id
+
+        representative = sheets[indices[0]]
+        patterns.append({
+            'pattern_id': pattern_id,
+            'sheet_numbers': [sheets[idx].get('sheet_number', idx + 1) for idx in indices],
+            'repeat_count': len(indices),
+            'parts_count': len(representative.get('parts', [])),
+            'used_area_m2': representative.get('used_area_m2', 0),
+            'utilization_percent': representative.get('utilization_percent', 0)
+        })
+
+    result['patterns'] = patterns
+
+    if len(patterns) < len(sheets):
+        logger.info(f"[PATTERNS] {len(sheets)} листов, уникальных раскроев: {len(patterns)}")
+
+    return result
+
+
+def compact_patterns(result: Dict) -> Dict:
+    """
+    Компактный результат: детали только у первого листа каждого раскроя
+
+    У повторяющихся листов 'parts' не передаются, остается 'pattern_id'.
+    Исходный результат не изменяется.
+    """
+    if 'patterns' not in result:
+        result = detect_patterns(dict(result, sheets=[dict(s) for s in result.get('sheets', [])]))
+
+    seen = set()
+    sheets = []
+    for sheet in result.get('sheets', []):
+        pattern_id = sheet.get('pattern_id')
+        if pattern_id in seen:
+            sheets.append({k: v for k, v in sheet.items() if k != 'parts'})
+        else:
+            seen.add(pattern_id)
+            sheets.append(sheet)
+
+    return dict(result, sheets=sheets, patterns_compact=True)
+
+
+def expand_patterns(result: Dict) -> Dict:
+    """
+    Обратное к compact_patterns (полный результат возвращается без изменений)
+
+    Детали раскроя берутся у первого листа с тем же 'pattern_id'.
+    """
+    if not result.get('patterns_compact'):
+        return result
+
+    parts_by_pattern = {}
+    sheets = []
+    for sheet in result.get('sheets', []):
+        pattern_id = sheet.get('pattern_id')
+        if pattern_id not in parts_by_pattern:
+            parts_by_pattern[pattern_id] = sheet.get('parts', [])
+            sheets.append(sheet)
+        else:
+            sheets.append(dict(sheet, parts=[dict(p) for p in parts_by_pattern[pattern_id]]))
+
+    expanded = {k: v for k, v in result.items() if k != 'patterns_compact'}
+    expanded['sheets'] = sheets
+    return expanded
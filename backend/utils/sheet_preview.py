@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Превью листов раскроя: SVG и PNG с кэшем и тайлами
+
+Фронтенду не нужно рисовать каждую деталь из полного JSON или строить
+PDF ради картинки: лист отдается готовым SVG или PNG в заданном
+масштабе (zoom - пикселей на мм). Крупный PNG (сторона больше
+MAX_IMAGE_PX) отдается тайлами TILE_SIZE_PX x TILE_SIZE_PX.
+
+Ключ кэша - хеш результата, раскрой листа (utils.sheet_patterns),
+формат, масштаб и тайл: одинаковые листы результата делят одну запись.
+Ось Y направлена вниз, как на схеме листа в PDF.
+"""
+
+import hashlib
+import io
+import logging
+import math
+from typing import Dict, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from utils.nesting_cache import NestingCache, make_cache_key
+from utils.sheet_patterns import pattern_signature
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image, ImageDraw
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+PREVIEW_FORMATS = ('svg', 'png')
+
+# Масштаб по умолчанию - лист шириной DEFAULT_WIDTH_PX
+DEFAULT_WIDTH_PX = 800
+MIN_ZOOM = 0.01
+MAX_ZOOM = 10.0
+# PNG с большей стороной отдается тайлами
+MAX_IMAGE_PX = 2048
+TILE_SIZE_PX = 512
+
+# Цвета позиций - как на схеме листа в PDF
+PART_COLORS = ('#4CAF50', '#2196F3', '#FF9800', '#9C27B0', '#F44336', '#00BCD4', '#FFC107', '#E91E63')
+SHEET_COLOR = '#D3D3D3'
+OUTLINE_COLOR = '#000000'
+
+# Готовые превью - в памяти (PNG и SVG не сериализуются в дисковый кэш JSON)
+preview_cache = NestingCache(max_entries=512, ttl_seconds=3600)
+
+
+def result_hash(result: Dict) -> str:
+    """Хеш результата раскроя (для результатов, пришедших в запросе): листы и размер листа"""
+    return make_cache_key(result.get('sheets', []), sheet_width=result.get('sheet_width', 2500),
+                          sheet_height=result.get('sheet_height', 1250))
+
+
+def default_zoom(sheet_width: float) -> float:
+    return DEFAULT_WIDTH_PX / float(sheet_width)
+
+
+def image_size(sheet_width: float, sheet_height: float, zoom: float) -> Tuple[int, int]:
+    """Размер изображения листа, px"""
+    return max(1, math.ceil(sheet_width * zoom)), max(1, math.ceil(sheet_height * zoom))
+
+
+def tile_grid(sheet_width: float, sheet_height: float, zoom: float) -> Tuple[int, int]:
+    """(столбцов, строк) тайлов; (1, 1) - изображение отдается целиком"""
+    width, height = image_size(sheet_width, sheet_height, zoom)
+    if max(width, height) <= MAX_IMAGE_PX:
+        return 1, 1
+    return math.ceil(width / TILE_SIZE_PX), math.ceil(height / TILE_SIZE_PX)
+
+
+def _color(part: Dict) -> str:
+    return PART_COLORS[(int(part.get('position_number') or 1) - 1) % len(PART_COLORS)]
+
+
+def _outlines(part: Dict) -> Tuple[List[Tuple[float, float]], List[List[Tuple[float, float]]]]:
+    """Наружный контур и вырезы размещения в координатах листа"""
+    if part.get('contour'):
+        return ([tuple(p) for p in part['contour']],
+                [[tuple(p) for p in hole] for hole in part.get('holes') or []])
+    x, y = float(part.get('x', 0)), float(part.get('y', 0))
+    width, height = float(part.get('width', 0)), float(part.get('height', 0))
+    return [(x, y), (x + width, y), (x + width, y + height), (x, y + height)], []
+
+
+def render_svg(parts: List[Dict], sheet_width: float, sheet_height: float, zoom: float) -> str:
+    """SVG листа: viewBox в мм, размер в px по zoom"""
+    width, height = image_size(sheet_width, sheet_height, zoom)
+    stroke = 1.0 / zoom
+    chunks = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+              f'viewBox="0 0 {sheet_width:g} {sheet_height:g}">',
+              f'<rect x="0" y="0" width="{sheet_width:g}" height="{sheet_height:g}" '
+              f'fill="{SHEET_COLOR}" stroke="{OUTLINE_COLOR}" stroke-width="{stroke:.4g}"/>']
+
+    for part in parts:
+        outer, holes = _outlines(part)
+        path = ' '.join('M' + ' L'.join(f'{x:.2f},{y:.2f}' for x, y in loop) + ' Z'
+                        for loop in [outer] + holes)
+        title = escape(f"{part.get('position_number', '')} {part.get('name', '')}".strip())
+        chunks.append(f'<path d="{path}" fill="{_color(part)}" fill-opacity="0.7" fill-rule="evenodd" '
+                      f'stroke="{OUTLINE_COLOR}" stroke-width="{stroke:.4g}"><title>{title}</title></path>')
+
+        position = part.get('position_number')
+        part_width, part_height = float(part.get('width', 0)), float(part.get('height', 0))
+        font = min(part_width, part_height) / 3
+        # Номер позиции - только если читается в этом масштабе
+        if position and font * zoom >= 6:
+            cx = float(part.get('x', 0)) + part_width / 2
+            cy = float(part.get('y', 0)) + part_height / 2
+            chunks.append(f'<text x="{cx:.2f}" y="{cy:.2f}" font-size="{font:.2f}" text-anchor="middle" '
+                          f'dominant-baseline="central" font-family="sans-serif">{position}</text>')
+
+    chunks.append('</svg>')
+    return ''.join(chunks)
+
+
+def render_png(parts: List[Dict], sheet_width: float, sheet_height: float, zoom: float,
+               tile: Optional[Tuple[int, int]] = None) -> bytes:
+    """
+    PNG листа или его тайла
+
+    Args:
+        tile: (столбец, строка) тайла TILE_SIZE_PX или None - лист целиком
+    """
+    if not PIL_AVAILABLE:
+        raise RuntimeError('Pillow не установлен. Установите: pip install Pillow')
+
+    full_width, full_height = image_size(sheet_width, sheet_height, zoom)
+    if tile is None:
+        left, top, width, height = 0, 0, full_width, full_height
+    else:
+        col, row = tile
+        left, top = col * TILE_SIZE_PX, row * TILE_SIZE_PX
+        if col < 0 or row < 0 or left >= full_width or top >= full_height:
+            raise ValueError(f'Tile {col},{row} is out of range')
+        width, height = min(TILE_SIZE_PX, full_width - left), min(TILE_SIZE_PX, full_height - top)
+
+    image = Image.new('RGB', (width, height), '#FFFFFF')
+    draw = ImageDraw.Draw(image)
+
+    def px(x, y):
+        return (x * zoom - left, y * zoom - top)
+
+    draw.rectangle([px(0, 0), px(sheet_width, sheet_height)], fill=SHEET_COLOR, outline=OUTLINE_COLOR)
+
+    # В тайл попадают только детали, пересекающие его область
+    region = (left / zoom, top / zoom, (left + width) / zoom, (top + height) / zoom)
+    for part in parts:
+        x, y = float(part.get('x', 0)), float(part.get('y', 0))
+        if (x > region[2] or y > region[3] or
+                x + float(part.get('width', 0)) < region[0] or y + float(part.get('height', 0)) < region[1]):
+            continue
+        outer, holes = _outlines(part)
+        draw.polygon([px(*p) for p in outer], fill=_color(part), outline=OUTLINE_COLOR)
+        for hole in holes:
+            draw.polygon([px(*p) for p in hole], fill=SHEET_COLOR, outline=OUTLINE_COLOR)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=False)
+    return buffer.getvalue()
+
+
+def sheet_preview(result: Dict, result_id: str, sheet_number: int, fmt: str = 'svg',
+                  zoom: Optional[float] = None, tile: Optional[Tuple[int, int]] = None) -> Dict:
+    """
+    Превью листа результата (с кэшем)
+
+    Args:
+        result: результат раскроя (полный или compact_patterns)
+        result_id: хеш результата (ключ кэша расчета или result_hash)
+        sheet_number: номер листа
+        fmt: 'svg' | 'png'
+        zoom: пикселей на мм (по умолчанию - ширина DEFAULT_WIDTH_PX)
+        tile: (столбец, строка) для крупного PNG
+
+    Returns:
+        {'body': str | bytes, 'mimetype', 'cache_key'} или, если PNG нужно
+        запрашивать тайлами, {'tiles': {...}} с сеткой тайлов
+    """
+    if fmt not in PREVIEW_FORMATS:
+        raise ValueError(f"Unknown preview format: {fmt}. Available: {', '.join(PREVIEW_FORMATS)}")
+
+    sheets = result.get('sheets', [])
+    sheet = next((s for s in sheets if s.get('sheet_number') == sheet_number), None)
+    if sheet is None:
+        raise KeyError(f'Sheet {sheet_number} not found')
+    if 'parts' not in sheet:
+        # Компактный результат: детали у первого листа того же раскроя
+        sheet = next(s for s in sheets if s.get('pattern_id') == sheet.get('pattern_id') and 'parts' in s)
+
+    sheet_width = float(result.get('sheet_width', 2500))
+    sheet_height = float(result.get('sheet_height', 1250))
+    zoom = min(max(float(zoom) if zoom else default_zoom(sheet_width), MIN_ZOOM), MAX_ZOOM)
+
+    if fmt == 'png' and tile is None:
+        cols, rows = tile_grid(sheet_width, sheet_height, zoom)
+        if cols * rows > 1:
+            width, height = image_size(sheet_width, sheet_height, zoom)
+            return {'tiles': {'columns': cols, 'rows': rows, 'tile_size': TILE_SIZE_PX,
+                              'width': width, 'height': height, 'zoom': zoom}}
+
+    layout = hashlib.sha256(repr(pattern_signature(sheet)).encode('utf-8')).hexdigest()[:16]
+    cache_key = f"{result_id}:{layout}:{fmt}:{zoom:.6g}:{'%d,%d' % tile if tile else '-'}"
+    body = preview_cache.get(cache_key)
+    if body is None:
+        parts = sheet.get('parts', [])
+        if fmt == 'svg':
+            body = render_svg(parts, sheet_width, sheet_height, zoom)
+        else:
+            body = render_png(parts, sheet_width, sheet_height, zoom, tile)
+        preview_cache.put(cache_key, body)
+
+    return {'body': body, 'mimetype': 'image/svg+xml' if fmt == 'svg' else 'image/png',
+            'cache_key': cache_key}
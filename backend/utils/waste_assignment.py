@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Подбор обрезков для всех деталей заказа одним проходом
+
+Поиск для каждой детали отдельно (find_suitable) отдает один и тот же
+обрезок нескольким деталям, а мелкая деталь может занять крупный
+обрезок, нужный крупной. Здесь доступные обрезки материала читаются
+из базы один раз, и каждый обрезок достается не больше чем одной детали.
+
+Жадный подбор: экономия от детали - стоимость ее металла, поэтому
+детали идут по убыванию площади (сначала самые дорогие и самые
+требовательные к размеру), каждая получает самый маленький по площади
+свободный обрезок, в который помещается с зазором (с поворотом).
+Крупные обрезки так остаются крупным деталям.
+
+Подбор и резервирование (статус 'reserved') выполняются в одной
+транзакции BEGIN IMMEDIATE: между ними обрезки никто не займет.
+"""
+
+import logging
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from utils.waste_database import CUT_GAP_MM, WasteDatabase, economy_rub
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+
+def _part_order(sizes: Sequence[Tuple[float, float]]) -> List[int]:
+    """Индексы деталей по убыванию площади (при равенстве - в порядке запроса)"""
+    return sorted(range(len(sizes)), key=lambda i: -sizes[i][0] * sizes[i][1])
+
+
+def assign(sizes: Sequence[Tuple[float, float]], remnants: Sequence[tuple]) -> List[Optional[int]]:
+    """
+    Жадное распределение обрезков по деталям
+
+    Args:
+        sizes: (длинная, короткая) сторона каждой детали с зазором
+        remnants: (rowid, width, height, area_m2) по возрастанию площади
+
+    Returns:
+        индекс обрезка в remnants или None для каждой детали
+    """
+    result = [None] * len(sizes)
+    if not sizes or not remnants:
+        return result
+
+    if NUMPY_AVAILABLE:
+        dims = np.array([(r[1], r[2]) for r in remnants], dtype=np.float64)
+        long_sides = dims.max(axis=1)
+        short_sides = dims.min(axis=1)
+        free = np.ones(len(remnants), dtype=bool)
+        for i in _part_order(sizes):
+            long_side, short_side = sizes[i]
+            fits = free & (long_sides >= long_side) & (short_sides >= short_side)
+            # Обрезки по возрастанию площади: первый подходящий - самый маленький
+            j = int(fits.argmax())
+            if fits[j]:
+                free[j] = False
+                result[i] = j
+        return result
+
+    long_sides = [max(r[1], r[2]) for r in remnants]
+    short_sides = [min(r[1], r[2]) for r in remnants]
+    free = [True] * len(remnants)
+    for i in _part_order(sizes):
+        long_side, short_side = sizes[i]
+        for j in range(len(remnants)):
+            if free[j] and long_sides[j] >= long_side and short_sides[j] >= short_side:
+                free[j] = False
+                result[i] = j
+                break
+    return result
+
+
+def assign_wastes(db: WasteDatabase, parts: List[Dict], material: str = 'Оцинковка 1.5мм',
+                  reserve: bool = False, used_in: Optional[str] = None) -> Dict:
+    """
+    Подбор обрезков для деталей заказа (каждый обрезок - одной детали)
+
+    Args:
+        db: база обрезков
+        parts: детали ('width', 'height', мм)
+        material: материал
+        reserve: зарезервировать подобранные обрезки
+        used_in: заказ/проект для резерва (поле used_in)
+
+    Returns:
+        {'matches': [{'part', 'waste', 'economy_rub'}] в порядке parts,
+         'total_economy', 'unmatched': деталей без обрезка, 'reserved'}
+    """
+    start = time.time()
+    sizes = [(max(part['width'], part['height']) + CUT_GAP_MM,
+              min(part['width'], part['height']) + CUT_GAP_MM) for part in parts]
+
+    with db.transaction(immediate=reserve):
+        remnants = []
+        if sizes:
+            # Обрезки меньше самой маленькой детали не нужны ни одной
+            remnants = db.available_sizes(material, min(s[0] for s in sizes), min(s[1] for s in sizes))
+        chosen = assign(sizes, remnants)
+        wastes = db.get_by_rowids([remnants[j][0] for j in chosen if j is not None])
+
+        matches = []
+        for part, j in zip(parts, chosen):
+            if j is None:
+                continue
+            waste = wastes[remnants[j][0]]
+            waste['economy_rub'] = economy_rub(part['width'], part['height'])
+            matches.append({
+                'part': part,
+                'waste': waste,
+                'economy_rub': waste['economy_rub']
+            })
+
+        if reserve and matches:
+            db.reserve([m['waste']['id'] for m in matches], used_in)
+
+    total_economy = round(sum(m['economy_rub'] for m in matches), 2)
+    logger.info(f"[WASTES] Подбор: деталей {len(parts)}, обрезков-кандидатов {len(remnants)}, "
+                f"подобрано {len(matches)}, экономия {total_economy} руб, {time.time() - start:.3f} с")
+
+    return {
+        'matches': matches,
+        'total_economy': total_economy,
+        'unmatched': len(parts) - len(matches),
+        'reserved': reserve and bool(matches)
+    }
@@ -2,55 +2,84 @@
 # -*- coding: utf-8 -*-
 """
 Калькулятор обрезков из результата раскроя
+
+Обрезки - реальные пустые прямоугольники листа: из максимальных
+свободных прямоугольников (utils.free_rectangles) жадно выбираются
+непересекающиеся, начиная с наибольшего. Для одинаковых листов
+(utils.sheet_patterns) обрезки вычисляются один раз.
 """
 
 import logging
 from typing import Dict, List
 
+from utils.free_rectangles import disjoint_remnants
+from utils.sheet_patterns import group_sheets
+
 logger = logging.getLogger(__name__)
 
+# Минимальный учитываемый обрезок
+MIN_WASTE_AREA_M2 = 0.02
+MIN_WASTE_SIDE_MM = 100
+# Обрезок, пригодный для повторного использования (>= 300x300 мм)
+USABLE_SIDE_MM = 300
+
 
-def calculate_wastes(nesting_result: Dict) -> List[Dict]:
+def calculate_wastes(nesting_result: Dict, min_area_m2: float = MIN_WASTE_AREA_M2,
+                     min_side_mm: float = MIN_WASTE_SIDE_MM) -> List[Dict]:
     """
     Вычисляет обрезки из результата раскроя
-    
+
     Args:
         nesting_result: результат от optimize_nesting()
-    
+        min_area_m2: обрезки меньшей площади не учитываются
+        min_side_mm: обрезки с меньшей стороной не учитываются
+
     Returns:
         список обрезков с размерами и координатами
+        [{'id', 'sheet_number', 'x', 'y', 'width', 'height', 'area_m2', 'usable'}]
     """
-    
+
     if not nesting_result.get('success'):
         return []
-    
+
+    sheet_width = nesting_result.get('sheet_width', 2500)
+    sheet_height = nesting_result.get('sheet_height', 1250)
+
+    sheets = nesting_result.get('sheets', [])
+
+    # Обрезки по раскроям: одинаковые листы считаются один раз
+    sheet_remnants = [None] * len(sheets)
+    for indices in group_sheets(sheets):
+        # Детали - препятствия по габариту (для раскроя по контуру - описанный прямоугольник)
+        obstacles = [(p['x'], p['y'], p['width'], p['height']) for p in sheets[indices[0]].get('parts', [])]
+
+        remnants = disjoint_remnants(
+            sheet_width, sheet_height, obstacles,
+            min_side=min_side_mm, min_area=min_area_m2 * 1_000_000
+        )
+        for idx in indices:
+            sheet_remnants[idx] = remnants
+
     wastes = []
     waste_counter = 0
-    
-    for sheet in nesting_result.get('sheets', []):
+
+    for sheet, remnants in zip(sheets, sheet_remnants):
         sheet_number = sheet['sheet_number']
-        
-        # Упрощенный расчет: берем waste_area из листа
-        # TODO: Реализовать точное определение геометрии обрезков
-        
-        waste_area_m2 = sheet.get('waste_area_m2', 0)
-        
-        if waste_area_m2 > 0.02:  # Минимум 200×200 мм = 0.04 м²
+
+        for x, y, width, height in remnants:
             waste_counter += 1
-            
-            # Примерные размеры обрезка (квадратный)
-            waste_size_mm = int((waste_area_m2 * 1_000_000) ** 0.5)
-            
+
             wastes.append({
                 'id': f'W-{waste_counter:03d}',
                 'sheet_number': sheet_number,
-                'width': waste_size_mm,
-                'height': waste_size_mm,
-                'area_m2': waste_area_m2,
-                'usable': waste_size_mm >= 300  # >= 300x300 мм
+                'x': round(x, 1),
+                'y': round(y, 1),
+                'width': round(width, 1),
+                'height': round(height, 1),
+                'area_m2': round(width * height / 1_000_000, 4),
+                'usable': min(width, height) >= USABLE_SIDE_MM
             })
-    
+
     logger.info(f"Вычислено обрезков: {len(wastes)}")
-    
-    return wastes
 
+    return wastes
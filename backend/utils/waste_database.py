@@ -2,27 +2,241 @@
 # -*- coding: utf-8 -*-
 """
 База данных обрезков (SQLite)
+
+Соединение одно на поток и открывается один раз (как в utils.nfp_cache):
+WAL - чтение не блокируется записью, подготовленные запросы
+переиспользуются из кэша соединения. Несколько операций выполняются
+в одной транзакции через transaction(), поиск обрезков для заказа -
+одним вызовом find_suitable_many.
+
+Схема обновляется миграциями MIGRATIONS (номер - PRAGMA user_version).
+Подбор по размеру идет по индексу R-tree wastes_size: в нем только
+доступные обрезки, измерения - материал, длинная и короткая сторона,
+площадь. Триггеры держат его в соответствии с таблицей wastes.
+Без модуля rtree в SQLite поиск идет по составному индексу.
 """
 
 import sqlite3
 import logging
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Optional
 
 logger = logging.getLogger(__name__)
 
+# Кэш подготовленных запросов соединения
+STATEMENT_CACHE_SIZE = 256
+# Настройки соединения: WAL, синхронизация при checkpoint, временные данные в памяти, кэш страниц 8 МБ
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-8192',
+)
+
+# Зазор резки, мм
+CUT_GAP_MM = 10
+# Стоимость металла для расчета экономии, руб/м²
+PRICE_RUB_PER_M2 = 3500
+# Окно поиска по площади: от площади детали до нее же с запасом AREA_WINDOW_START,
+# запас растет в AREA_WINDOW_GROWTH раз, пока не найдется top_k обрезков
+AREA_WINDOW_START = 0.02
+AREA_WINDOW_GROWTH = 4.0
+
+
+def _migrate_indexes(conn: sqlite3.Connection):
+    """Составные индексы: доступные обрезки материала по площади, выборка по статусу"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_wastes_status_material_area '
+                 'ON wastes (status, material, area_m2)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_wastes_status_date '
+                 'ON wastes (status, date_created)')
+
+
+def _migrate_size_index(conn: sqlite3.Connection):
+    """R-tree доступных обрезков по материалу, сторонам и площади"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS waste_materials (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+    ''')
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS wastes_size USING rtree(
+            id,
+            material_min, material_max,
+            long_min, long_max,
+            short_min, short_max,
+            area_min, area_max
+        )
+    ''')
+    size_row = '''
+        SELECT NEW.rowid, m.id, m.id,
+               max(NEW.width, NEW.height), max(NEW.width, NEW.height),
+               min(NEW.width, NEW.height), min(NEW.width, NEW.height),
+               NEW.area_m2, NEW.area_m2
+        FROM waste_materials m WHERE m.name = NEW.material AND NEW.status = 'available'
+    '''
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS wastes_size_insert AFTER INSERT ON wastes
+        BEGIN
+            INSERT OR IGNORE INTO waste_materials (name) VALUES (NEW.material);
+            INSERT INTO wastes_size {size_row};
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS wastes_size_update
+        AFTER UPDATE OF status, width, height, area_m2, material ON wastes
+        BEGIN
+            DELETE FROM wastes_size WHERE id = OLD.rowid;
+            INSERT OR IGNORE INTO waste_materials (name) VALUES (NEW.material);
+            INSERT INTO wastes_size {size_row};
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS wastes_size_delete AFTER DELETE ON wastes
+        BEGIN
+            DELETE FROM wastes_size WHERE id = OLD.rowid;
+        END
+    ''')
+    # Обрезки, добавленные до миграции
+    conn.execute('INSERT OR IGNORE INTO waste_materials (name) SELECT DISTINCT material FROM wastes')
+    conn.execute('''
+        INSERT INTO wastes_size
+        SELECT w.rowid, m.id, m.id,
+               max(w.width, w.height), max(w.width, w.height),
+               min(w.width, w.height), min(w.width, w.height),
+               w.area_m2, w.area_m2
+        FROM wastes w JOIN waste_materials m ON m.name = w.material
+        WHERE w.status = 'available'
+    ''')
+
+
+# Миграции схемы по порядку: после i-й user_version = i
+MIGRATIONS = (
+    _migrate_indexes,
+    _migrate_size_index,
+)
+
+# Подбор по R-tree: material, длинная и короткая сторона детали с зазором,
+# граница окна площади; точная проверка размеров - по таблице wastes.
+# CROSS JOIN - перебор всегда от R-tree (иначе без статистики SQLite идет от wastes)
+FIND_CANDIDATES_RTREE_SQL = '''
+    SELECT w.* FROM wastes_size s CROSS JOIN wastes w ON w.rowid = s.id
+    WHERE s.material_min <= ?1 AND s.material_max >= ?1
+    AND s.long_max >= ?2 AND s.short_max >= ?3
+    AND s.area_min <= ?4
+    AND w.status = 'available'
+    AND w.area_m2 <= ?4
+    AND (
+        (w.width >= ?2 AND w.height >= ?3) OR
+        (w.width >= ?3 AND w.height >= ?2)
+    )
+    ORDER BY w.area_m2 ASC, w.rowid ASC
+    LIMIT ?5
+'''
+
+FIND_CANDIDATES_SQL = '''
+    SELECT * FROM wastes 
+    WHERE status = 'available' 
+    AND material = ?
+    AND (
+        (width >= ? AND height >= ?) OR
+        (width >= ? AND height >= ?)
+    )
+    ORDER BY area_m2 ASC, rowid ASC
+    LIMIT ?
+'''
+
+# Доступные обрезки материала не меньше заданных сторон по возрастанию площади
+# (порядок - как у FIND_CANDIDATES_SQL); для подбора на весь заказ (utils.waste_assignment)
+AVAILABLE_SIZES_SQL = '''
+    SELECT rowid, width, height, area_m2 FROM wastes
+    WHERE status = 'available'
+    AND material = ?
+    AND max(width, height) >= ? AND min(width, height) >= ?
+    ORDER BY area_m2 ASC, rowid ASC
+'''
+
+# Параметров в одном запросе IN (...) не больше
+SQL_VARIABLES_CHUNK = 500
+
+
+class WastesUnavailable(Exception):
+    """Обрезки для резервирования уже заняты или удалены"""
+
+
+def economy_rub(width: float, height: float) -> float:
+    """Экономия от детали из обрезка (стоимость металла детали), руб"""
+    part_area_m2 = (width * height) / 1_000_000
+    return round(part_area_m2 * PRICE_RUB_PER_M2, 2)
+
 
 class WasteDatabase:
     """Управление базой данных обрезков"""
     
     def __init__(self, db_path: str = 'wastes.db'):
         self.db_path = Path(db_path)
-        self._init_db()
+        self._local = threading.local()
+        # Файл базы и схема создаются при первом обращении, а не при импорте API
+        self._schema_ready = False
+        self.size_index = False
     
-    def _init_db(self):
+    def _connect(self) -> sqlite3.Connection:
+        """Соединение текущего потока (открывается один раз)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Автокоммит: транзакции открывает transaction()
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None,
+                                   check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+            conn.row_factory = sqlite3.Row
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+            self._local.depth = 0
+            if not self._schema_ready:
+                self._init_db(conn)
+                self._schema_ready = True
+        return conn
+    
+    @contextmanager
+    def transaction(self, immediate: bool = False) -> Iterator[sqlite3.Connection]:
+        """
+        Транзакция на несколько операций
+        
+        Вложенные вызовы (методы внутри with db.transaction()) выполняются
+        в той же транзакции; при исключении она откатывается целиком.
+        
+        Args:
+            immediate: сразу взять блокировку записи (BEGIN IMMEDIATE) -
+                       прочитанное в транзакции не изменится до ее конца
+        """
+        conn = self._connect()
+        depth = self._local.depth
+        if depth == 0:
+            conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+        self._local.depth = depth + 1
+        try:
+            yield conn
+        except BaseException:
+            self._local.depth = depth
+            if depth == 0:
+                conn.rollback()
+            raise
+        self._local.depth = depth
+        if depth == 0:
+            conn.commit()
+    
+    def close(self):
+        """Закрыть соединение текущего потока"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+    
+    def _init_db(self, conn: sqlite3.Connection):
         """Инициализация базы данных"""
-        conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -42,16 +256,31 @@ class WasteDatabase:
             )
         ''')
         
-        conn.commit()
-        conn.close()
+        self._migrate(conn)
+        self.size_index = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'wastes_size'").fetchone() is not None
         
         logger.info(f"База данных инициализирована: {self.db_path}")
     
+    def _migrate(self, conn: sqlite3.Connection):
+        """Миграции схемы после текущей user_version"""
+        with self.transaction(immediate=True):
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+                try:
+                    migration(conn)
+                except sqlite3.OperationalError as e:
+                    if 'rtree' not in str(e):
+                        raise
+                    # SQLite без модуля rtree: миграция повторится при следующем запуске
+                    logger.warning(f"[WASTES] Индекс R-tree недоступен ({e}), поиск по составному индексу")
+                    break
+                conn.execute(f'PRAGMA user_version = {number}')
+                logger.info(f"[WASTES] Миграция схемы {number}: {migration.__name__}")
+    
     def get_all(self, status_filter: Optional[str] = None) -> List[Dict]:
         """Получить все обрезки"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        cursor = self._connect().cursor()
         
         if status_filter:
             cursor.execute('SELECT * FROM wastes WHERE status = ?', (status_filter,))
@@ -59,66 +288,178 @@ class WasteDatabase:
             cursor.execute('SELECT * FROM wastes')
         
         rows = cursor.fetchall()
-        conn.close()
         
         return [dict(row) for row in rows]
     
     def get_by_id(self, waste_id: str) -> Optional[Dict]:
         """Получить обрезок по ID"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM wastes WHERE id = ?', (waste_id,))
-        row = cursor.fetchone()
-        conn.close()
+        row = self._connect().execute('SELECT * FROM wastes WHERE id = ?', (waste_id,)).fetchone()
         
         return dict(row) if row else None
     
+    def get_by_rowids(self, rowids: List[int]) -> Dict[int, Dict]:
+        """Обрезки по rowid (из available_sizes): rowid -> обрезок"""
+        conn = self._connect()
+        wastes = {}
+        for start in range(0, len(rowids), SQL_VARIABLES_CHUNK):
+            chunk = rowids[start:start + SQL_VARIABLES_CHUNK]
+            placeholders = ', '.join('?' * len(chunk))
+            for row in conn.execute(f'SELECT rowid AS _rowid, * FROM wastes WHERE rowid IN ({placeholders})', chunk):
+                waste = dict(row)
+                wastes[waste.pop('_rowid')] = waste
+        return wastes
+    
+    def available_sizes(self, material: str, long_side: float = 0,
+                        short_side: float = 0) -> List[tuple]:
+        """
+        Размеры доступных обрезков материала одним запросом
+        
+        Args:
+            long_side, short_side: обрезки меньше (с учетом поворота) не нужны
+        
+        Returns:
+            [(rowid, width, height, area_m2)] по возрастанию площади
+        """
+        return self._connect().execute(AVAILABLE_SIZES_SQL, (material, long_side, short_side)).fetchall()
+    
+    def reserve(self, waste_ids: List[str], used_in: Optional[str] = None):
+        """
+        Зарезервировать обрезки (статус 'reserved') - все или ни одного
+        
+        Raises:
+            WastesUnavailable: часть обрезков уже не доступна
+        """
+        with self.transaction(immediate=True) as conn:
+            unavailable = [waste_id for waste_id in waste_ids
+                           if conn.execute("UPDATE wastes SET status = 'reserved', used_in = ? "
+                                           "WHERE id = ? AND status = 'available'",
+                                           (used_in, waste_id)).rowcount == 0]
+            if unavailable:
+                raise WastesUnavailable(f"Wastes are not available: {', '.join(unavailable)}")
+        
+        logger.info(f"Зарезервировано обрезков: {len(waste_ids)}" + (f" для {used_in}" if used_in else ''))
+    
     def find_suitable(self, width: float, height: float, 
                      material: str = 'Оцинковка 1.5мм') -> Optional[Dict]:
         """Найти подходящий обрезок"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        gap = 10  # Зазор резки
-        
-        cursor.execute('''
-            SELECT * FROM wastes 
-            WHERE status = 'available' 
-            AND material = ?
-            AND (
-                (width >= ? AND height >= ?) OR
-                (width >= ? AND height >= ?)
-            )
-            ORDER BY area_m2 ASC
-            LIMIT 1
-        ''', (material, width + gap, height + gap, height + gap, width + gap))
+        candidates = self.find_candidates(width, height, material)
+        return candidates[0] if candidates else None
+    
+    def find_candidates(self, width: float, height: float,
+                        material: str = 'Оцинковка 1.5мм', top_k: int = 1) -> List[Dict]:
+        """
+        Подходящие обрезки по возрастанию площади (лучший - первый)
+        
+        Args:
+            width, height: размеры детали, мм (поворот допускается)
+            material: материал
+            top_k: сколько обрезков вернуть
+        
+        Returns:
+            до top_k обрезков с 'economy_rub'
+        """
+        return self._find_candidates(self._connect(), width, height, material, top_k)
+    
+    def find_suitable_many(self, parts: List[Dict],
+                           material: str = 'Оцинковка 1.5мм') -> List[Optional[Dict]]:
+        """
+        Подходящие обрезки для списка деталей (как find_suitable для каждой)
+        
+        Returns:
+            обрезок или None для каждой детали, в порядке parts
+        """
+        return [candidates[0] if candidates else None
+                for candidates in self.find_candidates_many(parts, material)]
+    
+    def find_candidates_many(self, parts: List[Dict], material: str = 'Оцинковка 1.5мм',
+                             top_k: int = 1) -> List[List[Dict]]:
+        """
+        find_candidates для списка деталей
+        
+        Все поиски - одним соединением в одной транзакции чтения
+        (один снимок базы) одним подготовленным запросом.
+        """
+        with self.transaction() as conn:
+            return [self._find_candidates(conn, part['width'], part['height'], material, top_k)
+                    for part in parts]
+    
+    def _find_candidates(self, conn: sqlite3.Connection, width: float, height: float,
+                         material: str, top_k: int) -> List[Dict]:
+        long_side = max(width, height) + CUT_GAP_MM
+        short_side = min(width, height) + CUT_GAP_MM
         
-        row = cursor.fetchone()
-        conn.close()
+        if self.size_index:
+            rows = self._find_in_size_index(conn, long_side, short_side, material, top_k)
+        else:
+            rows = conn.execute(FIND_CANDIDATES_SQL, (material, long_side, short_side,
+                                                      short_side, long_side, top_k)).fetchall()
         
-        if row:
+        candidates = []
+        for row in rows:
             result = dict(row)
             # Расчет экономии
-            part_area_m2 = (width * height) / 1_000_000
-            result['economy_rub'] = round(part_area_m2 * 3500, 2)
-            return result
-        
-        return None
+            result['economy_rub'] = economy_rub(width, height)
+            candidates.append(result)
+        return candidates
+    
+    @staticmethod
+    def _find_in_size_index(conn: sqlite3.Connection, long_side: float, short_side: float,
+                            material: str, top_k: int) -> List[sqlite3.Row]:
+        """
+        Лучшие по площади обрезки через R-tree
+        
+        Площадь обрезка не меньше площади детали: окно площади растет от
+        нее, пока в нем не найдется top_k обрезков. Обрезки вне окна
+        больше любого найденного, поэтому результат совпадает с полной
+        сортировкой, а читается только начало окна.
+        """
+        row = conn.execute('SELECT id FROM waste_materials WHERE name = ?', (material,)).fetchone()
+        if row is None:
+            return []
+        material_id = row[0]
+        
+        part_area = long_side * short_side / 1_000_000
+        excess = AREA_WINDOW_START
+        max_area = None
+        while True:
+            bound = part_area * (1 + excess)
+            rows = conn.execute(FIND_CANDIDATES_RTREE_SQL,
+                                (material_id, long_side, short_side, bound, top_k)).fetchall()
+            if len(rows) >= top_k:
+                return rows
+            if max_area is None:
+                max_area = conn.execute(
+                    "SELECT MAX(area_m2) FROM wastes WHERE status = 'available' AND material = ?",
+                    (material,)).fetchone()[0]
+            if max_area is None or bound >= max_area:
+                return rows
+            excess *= AREA_WINDOW_GROWTH
     
     def add(self, waste_data: Dict) -> str:
         """Добавить новый обрезок"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.transaction() as conn:
+            waste_id = self._insert(conn, waste_data)
         
+        logger.info(f"Добавлен обрезок {waste_id}")
+        
+        return waste_id
+    
+    def add_many(self, wastes: List[Dict]) -> List[str]:
+        """Добавить несколько обрезков одной транзакцией"""
+        with self.transaction() as conn:
+            waste_ids = [self._insert(conn, waste_data) for waste_data in wastes]
+        
+        logger.info(f"Добавлено обрезков: {len(waste_ids)}")
+        
+        return waste_ids
+    
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, waste_data: Dict) -> str:
         # Генерируем ID
-        cursor.execute('SELECT COUNT(*) FROM wastes')
-        count = cursor.fetchone()[0]
+        count = conn.execute('SELECT COUNT(*) FROM wastes').fetchone()[0]
         waste_id = f"W-{count + 1:03d}"
         
-        cursor.execute('''
+        conn.execute('''
             INSERT INTO wastes (
                 id, width, height, area_m2, material, project, 
                 order_number, date_created, location, status
@@ -136,40 +477,28 @@ class WasteDatabase:
             'available'
         ))
         
-        conn.commit()
-        conn.close()
-        
-        logger.info(f"Добавлен обрезок {waste_id}")
-        
         return waste_id
     
     def update(self, waste_id: str, updates: Dict) -> bool:
         """Обновить обрезок"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Проверяем существование
-        cursor.execute('SELECT id FROM wastes WHERE id = ?', (waste_id,))
-        if not cursor.fetchone():
-            conn.close()
-            return False
-        
-        # Обновляем
-        update_fields = []
-        values = []
-        
-        for field in ['status', 'location', 'used_in', 'notes']:
-            if field in updates:
-                update_fields.append(f'{field} = ?')
-                values.append(updates[field])
-        
-        if update_fields:
-            values.append(waste_id)
-            query = f"UPDATE wastes SET {', '.join(update_fields)} WHERE id = ?"
-            cursor.execute(query, values)
-            conn.commit()
-        
-        conn.close()
+        with self.transaction() as conn:
+            # Проверяем существование
+            if not conn.execute('SELECT id FROM wastes WHERE id = ?', (waste_id,)).fetchone():
+                return False
+            
+            # Обновляем
+            update_fields = []
+            values = []
+            
+            for field in ['status', 'location', 'used_in', 'notes']:
+                if field in updates:
+                    update_fields.append(f'{field} = ?')
+                    values.append(updates[field])
+            
+            if update_fields:
+                values.append(waste_id)
+                query = f"UPDATE wastes SET {', '.join(update_fields)} WHERE id = ?"
+                conn.execute(query, values)
         
         logger.info(f"Обновлен обрезок {waste_id}")
         
@@ -177,14 +506,8 @@ class WasteDatabase:
     
     def delete(self, waste_id: str) -> bool:
         """Удалить обрезок"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM wastes WHERE id = ?', (waste_id,))
-        deleted = cursor.rowcount > 0
-        
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            deleted = conn.execute('DELETE FROM wastes WHERE id = ?', (waste_id,)).rowcount > 0
         
         if deleted:
             logger.info(f"Удален обрезок {waste_id}")
@@ -193,8 +516,7 @@ class WasteDatabase:
     
     def get_statistics(self) -> Dict:
         """Получить статистику"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self._connect().cursor()
         
         cursor.execute('SELECT COUNT(*) FROM wastes')
         total = cursor.fetchone()[0]
@@ -205,15 +527,17 @@ class WasteDatabase:
         cursor.execute("SELECT COUNT(*) FROM wastes WHERE status = 'used'")
         used = cursor.fetchone()[0]
         
+        cursor.execute("SELECT COUNT(*) FROM wastes WHERE status = 'reserved'")
+        reserved = cursor.fetchone()[0]
+        
         cursor.execute("SELECT SUM(area_m2) FROM wastes WHERE status = 'available'")
         total_area = cursor.fetchone()[0] or 0
         
-        conn.close()
-        
         return {
             'total': total,
             'available': available,
             'used': used,
+            'reserved': reserved,
             'total_area_m2': round(total_area, 4),
             'total_value_rub': round(total_area * 3500, 2),
             'reuse_percent': round((used / total * 100) if total > 0 else 0, 2)